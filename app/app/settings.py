@@ -21,12 +21,14 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # See https://docs.djangoproject.com/en/3.1/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'q^-2#!g0za%n1mo==)lv@x(@^&&l^vnebjws18)6w$+7!gdmkq'
+SECRET_KEY = os.environ.get('SECRET_KEY', 'q^-2#!g0za%n1mo==)lv@x(@^&&l^vnebjws18)6w$+7!gdmkq')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# The production profile of docker-compose.yml runs with DEBUG=0.
+DEBUG = os.environ.get('DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = []
+# Comma separated, e.g. ALLOWED_HOSTS=api.example.com,localhost
+ALLOWED_HOSTS = [host for host in os.environ.get('ALLOWED_HOSTS', '').split(',') if host]
 
 
 # Application definition
@@ -46,6 +48,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the load balancer probes skip everything below
+    'core.middleware.HealthCheckMiddleware',
+    # Next, so its timings cover all the rest of the request
+    'core.middleware.InstrumentationMiddleware',
+    'core.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,6 +64,11 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'app.urls'
 
+# Liveness and readiness probes answered by core.middleware.HealthCheckMiddleware
+HEALTHZ_PATH = '/healthz'
+READYZ_PATH = '/readyz'
+READYZ_CHECK_MIGRATIONS = os.environ.get('READYZ_CHECK_MIGRATIONS') == '1'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -76,19 +88,155 @@ TEMPLATES = [
 WSGI_APPLICATION = 'app.wsgi.application'
 
 
+# Per request measurements by core.middleware.InstrumentationMiddleware. INSTRUMENTATION=0 turns it off,
+# SERVER_TIMING_HEADER=0 keeps the timings out of the responses. Requests taking SLOW_REQUEST_MS or longer
+# are logged with their SLOW_REQUEST_TOP_QUERIES slowest queries, SLOW_REQUEST_MS=0 logs none.
+INSTRUMENTATION = os.environ.get('INSTRUMENTATION', '1') == '1'
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', '1') == '1'
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+SLOW_REQUEST_TOP_QUERIES = int(os.environ.get('SLOW_REQUEST_TOP_QUERIES', 5))
+
+# PROFILING=1 samples the stacks of PROFILE_SAMPLE_RATE of the requests, and of every request that runs for
+# PROFILE_SLOW_MS (0 for none), every PROFILE_INTERVAL_MS. At most PROFILE_MAX_PER_MINUTE profiles a minute per
+# process are written to PROFILE_DIR, see core.profiling and the aggregate_profiles command.
+PROFILING = os.environ.get('PROFILING') == '1'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/recipe-api-profiles')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.01))
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 1000))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+PROFILE_MAX_PER_MINUTE = int(os.environ.get('PROFILE_MAX_PER_MINUTE', 10))
+
+# /metrics serves them in the Prometheus text format, see core.metrics. METRICS_DIR is a directory the worker
+# processes share their values through, /dev/shm keeps it in memory. Without it each process only reports its
+# own. With METRICS_TOKEN set, /metrics asks for it as a bearer token.
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
+# Connection reuse, see core.db.backends.postgresql:
+# DB_CONN_MAX_AGE keeps each thread's connection open for that many seconds across requests (0 closes it after
+# every request), DB_CONN_HEALTH_CHECKS pings a reused connection before its first query in a request.
+# DB_POOL_MAX_SIZE > 0 switches to an in-process pool of at most that many connections per process instead,
+# DB_POOL_TIMEOUT is how long a request waits for a free one and DB_POOL_MAX_LIFETIME when they get replaced.
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 0))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'core.db.backends.postgresql',
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        # The pool takes the place of persistent connections, each request hands its connection back at the end
+        'CONN_MAX_AGE': 0 if DB_POOL_MAX_SIZE else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        'POOL': {
+            'MAX_SIZE': DB_POOL_MAX_SIZE,
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'MAX_LIFETIME': float(os.environ.get('DB_POOL_MAX_LIFETIME', 30 * 60)),
+        },
     }
 }
 
+# DB_ENGINE=sqlite runs against a local SQLite file, e.g. for tests without a Postgres server.
+# PostgreSQL only features like the recipe search ranking fall back to simpler queries there.
+if os.environ.get('DB_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME') or BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# ASYNC_VIEWS=1 routes the recipe, tag and ingredient endpoints to the async viewsets in recipe.async_views,
+# for running under ASGI. Their independent queries go out at the same time, each from a worker thread with its
+# own connection, unless ASYNC_CONCURRENT_QUERIES=0 runs them one after the other on the request's thread.
+# With concurrent queries a request can hold a few connections at once, size DB_POOL_MAX_SIZE accordingly.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+ASYNC_CONCURRENT_QUERIES = os.environ.get('ASYNC_CONCURRENT_QUERIES', '1') == '1'
+
+# JSON goes through orjson when it is installed, see core.renderers. The browsable API only renders with
+# BROWSABLE_API=1, which DEBUG turns on. Prices come out as strings like "5.00", whichever renderer runs.
+BROWSABLE_API = os.environ.get('BROWSABLE_API', '1' if DEBUG else '0') == '1'
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.JSONRenderer',
+    ] + (['rest_framework.renderers.BrowsableAPIRenderer'] if BROWSABLE_API else []),
+    'DEFAULT_PARSER_CLASSES': [
+        'core.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'COERCE_DECIMAL_TO_STRING': True,
+}
+
+# FAST_READ_SERIALIZATION=0 serializes the recipe list and detail with the model serializers again instead of
+# building them from values() rows, see recipe.serializers.RecipeRowSerializer.
+FAST_READ_SERIALIZATION = os.environ.get('FAST_READ_SERIALIZATION', '1') == '1'
+
+# Caches. The 'api' cache holds the per user responses of the recipe endpoints (see recipe.cache).
+# Point API_CACHE_BACKEND/API_CACHE_LOCATION at a shared cache in production, e.g.
+# django_redis.cache.RedisCache with redis://redis:6379/1, so every worker sees the same versions.
+# MAX_ENTRIES bounds the local memory cache, Redis evicts according to its own maxmemory-policy.
+API_CACHE_ALIAS = 'api'
+API_CACHE_TIMEOUT = int(os.environ.get('API_CACHE_TIMEOUT', 300))
+# The collection versions behind the cache keys and ETags expire too, which bounds how long a lost invalidation
+# can keep serving stale responses.
+API_CACHE_VERSION_TIMEOUT = int(os.environ.get('API_CACHE_VERSION_TIMEOUT', 300))
+API_CACHE_BACKEND = os.environ.get('API_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+
+# How many server processes answer requests, gunicorn.conf.py sets it to its number of workers.
+# A write only invalidates the cached responses and ETags of the process it ran in when each process has a
+# cache of its own, so with more than one process the response cache and the ETags stay off unless the
+# 'api' cache is shared.
+SERVER_PROCESSES = int(os.environ.get('SERVER_PROCESSES', 1))
+API_CACHE_ENABLED = SERVER_PROCESSES == 1 or API_CACHE_BACKEND not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    API_CACHE_ALIAS: {
+        'BACKEND': API_CACHE_BACKEND,
+        'LOCATION': os.environ.get('API_CACHE_LOCATION', 'recipe-api'),
+        'TIMEOUT': API_CACHE_TIMEOUT,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('API_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+}
+
+# In-process cache of API tokens used by core.authentication.CachedTokenAuthentication.
+# The TTL bounds how long another worker process may keep accepting a deleted token.
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get('TOKEN_CACHE_MAX_SIZE', 10000))
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 60))
+
+# Recipe image uploads are queued as core.models.ImageJob rows and processed by a pool of worker threads
+# in each server process (core.jobs), `manage.py process_image_jobs` drains the queue from outside.
+# IMAGE_JOBS_EAGER processes them inline instead, which is what the tests use.
+IMAGE_JOBS_EAGER = os.environ.get('IMAGE_JOBS_EAGER') == '1'
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+# Jobs processing for IMAGE_JOB_STALE_AFTER seconds are taken for lost, e.g. their worker process was recycled or
+# killed. Every IMAGE_JOB_RECOVERY_INTERVAL seconds (0 never) each gunicorn worker requeues those and picks up the
+# jobs left pending for as long.
+IMAGE_JOB_STALE_AFTER = int(os.environ.get('IMAGE_JOB_STALE_AFTER', 600))
+IMAGE_JOB_RECOVERY_INTERVAL = int(os.environ.get('IMAGE_JOB_RECOVERY_INTERVAL', 60))
+IMAGE_MAX_UPLOAD_BYTES = int(os.environ.get('IMAGE_MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 50000000))
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', 2048))
+# Widths and formats of the resized copies made of every recipe image, e.g. IMAGE_VARIANT_WIDTHS=200,400,800
+IMAGE_VARIANT_WIDTHS = [int(width) for width in os.environ.get('IMAGE_VARIANT_WIDTHS', '200,400,800').split(',')]
+IMAGE_VARIANT_FORMATS = os.environ.get('IMAGE_VARIANT_FORMATS', 'webp,jpeg').split(',')
+
+# Text search configuration used to build and query the recipe search documents
+RECIPE_SEARCH_CONFIG = os.environ.get('RECIPE_SEARCH_CONFIG', 'english')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -132,4 +280,14 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT ='/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# How long clients may cache media and static files, in seconds. Content addressed images are cached for a year
+# whatever this says since their content never changes, see core.media.
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 60 * 60))
+STATIC_CACHE_MAX_AGE = int(os.environ.get('STATIC_CACHE_MAX_AGE', 24 * 60 * 60))
+# Hand media downloads to the web server in front instead of streaming them from Python:
+# 'x-accel-redirect' for nginx, with an internal location at MEDIA_SENDFILE_PREFIX aliased to MEDIA_ROOT,
+# or 'x-sendfile' for Apache and lighttpd. Empty serves the files from Django.
+MEDIA_SENDFILE_BACKEND = os.environ.get('MEDIA_SENDFILE_BACKEND', '')
+MEDIA_SENDFILE_PREFIX = os.environ.get('MEDIA_SENDFILE_PREFIX', '/protected-media/')
+
 AUTH_USER_MODEL = 'core.User'
\ No newline at end of file
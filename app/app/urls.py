@@ -15,11 +15,23 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf.urls.static import static
 from django.conf import settings
 
+from core import media
+from core.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('metrics', metrics_view, name='metrics'),
+    # Unlike django.conf.urls.static these also work with DEBUG off, with ranges, validators and sendfile
+    path(f'{settings.MEDIA_URL.lstrip("/")}<path:path>', media.serve, {
+        'document_root': settings.MEDIA_ROOT,
+        'sendfile': True,
+    }),
+    path(f'{settings.STATIC_URL.lstrip("/")}<path:path>', media.serve, {
+        'document_root': settings.STATIC_ROOT,
+        'max_age': settings.STATIC_CACHE_MAX_AGE,
+    }),
+]
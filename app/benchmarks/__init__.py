@@ -0,0 +1,6 @@
+"""
+Benchmarks for the recipe API.
+
+Run them from the app directory, e.g. `python -m benchmarks.bench_filtering`.
+Each one builds its own throwaway test database and prints its results as JSON.
+"""
@@ -0,0 +1,404 @@
+"""
+Latency, throughput and queries per request of the main API workloads, for tracking regressions.
+
+    python -m benchmarks.bench_api [--users 5] [--recipes 200] [--tags 20] [--ingredients 50]
+                                   [--threads 4] [--requests 100] [--workloads list detail ...]
+                                   [--url http://localhost:8000] [--output results.json]
+
+Without --url the benchmark starts a server of its own on a throwaway test database, fills it with
+--users users that each have --recipes recipes over --tags tags and --ingredients ingredients, and
+counts the queries every request runs. With --url it creates the same data through the API of a
+running server instead and reads the query counts from the Server-Timing header of its responses,
+they are reported as null when the server doesn't send it.
+
+The workloads:
+  - list: first page of the recipe list
+  - detail: a random recipe with its tags and ingredients
+  - create: a recipe with a few existing tags and ingredients
+  - upload: a small JPEG for a random recipe, which answers once the image job is queued
+  - token: a token for a user's email and password
+
+Failed requests are counted by status and left out of the latencies. On SQLite concurrent writes
+fail with "database is locked" now and then, run the write workloads against PostgreSQL.
+
+Every thread sends its requests over one keep-alive connection, as one of the users. The JSON report
+comes with the parameters and the environment of the run; compare two reports with benchmarks.compare.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import re
+import socket
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+from benchmarks.bench_http import Client
+from benchmarks.utils import setup_django, test_database, percentile, report
+
+WORKLOADS = ('list', 'detail', 'create', 'upload', 'token')
+
+# Set on responses by the local server, see QueryCountingApp
+QUERY_COUNT_HEADER = 'X-Bench-Queries'
+
+# The query count core.middleware.InstrumentationMiddleware puts in the Server-Timing header
+SERVER_TIMING_QUERIES = re.compile(r'\bdb;[^,]*desc="(\d+) queries"')
+
+
+class QueryCountingApp:
+    """
+    WSGI wrapper that counts the queries each request runs and reports them in a response header
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        from django.db import connection
+
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        started = []
+
+        # Hold the status line back until the view is done, when the count is known
+        def delay_start_response(status, headers, exc_info=None):
+            started[:] = [status, headers, exc_info]
+
+        with connection.execute_wrapper(count):
+            result = self.application(environ, delay_start_response)
+            body = b''.join(result)
+            if hasattr(result, 'close'):
+                result.close()
+
+        status, headers, exc_info = started
+        start_response(status, headers + [(QUERY_COUNT_HEADER, str(queries))], exc_info)
+        return [body]
+
+
+def start_local_server():
+    """
+    Serve the project from a thread of this process, return the server and its URL
+    """
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+    from django.core.wsgi import get_wsgi_application
+
+    class QuietRequestHandler(WSGIRequestHandler):
+
+        def setup(self):
+            super().setup()
+            # The status line, headers and body go out in separate writes, with Nagle's algorithm each small write
+            # after the first waits for the client's delayed ACK, some 40 ms a response
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False)
+    server.set_app(QueryCountingApp(get_wsgi_application()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def seed_over_http(url, users, recipes, tags, ingredients, per_recipe, seed):
+    """
+    Create the same data as benchmarks.data.create_dataset through the API of a running server
+    """
+    from recipe.views import BULK_MAX_ITEMS
+
+    rng = random.Random(seed)
+    run_id = uuid.uuid4().hex[:8]
+    dataset = []
+    for i in range(users):
+        email = f'bench-{run_id}-{i}@amadora.com'
+        Client(url).request('POST', '/api/user/create/', {'email': email, 'password': 'benchpass', 'name': 'Bench'})
+        token = Client(url).request('POST', '/api/user/token/', {'email': email, 'password': 'benchpass'})['token']
+        client = Client(url, token)
+
+        # Related objects are given by name, the API creates each one the first time it sees it
+        created = []
+        for offset in range(0, recipes, BULK_MAX_ITEMS):
+            created.extend(client.request('POST', '/api/recipe/recipes/bulk/', [
+                {
+                    'title': f'Recipe {n}',
+                    'time_minutes': rng.randint(5, 120),
+                    'price': f'{rng.randint(1, 999) / 10:.2f}',
+                    'tags': [f'Tag {k}' for k in rng.sample(range(tags), min(per_recipe, tags))],
+                    'ingredients': [f'Ingredient {k}' for k in rng.sample(range(ingredients), min(per_recipe, ingredients))],
+                }
+                for n in range(offset, min(offset + BULK_MAX_ITEMS, recipes))
+            ]))
+
+        dataset.append({
+            'email': email,
+            'password': 'benchpass',
+            'recipe_ids': [recipe['id'] for recipe in created],
+            'tag_ids': sorted({pk for recipe in created for pk in recipe['tags']}),
+            'ingredient_ids': sorted({pk for recipe in created for pk in recipe['ingredients']}),
+        })
+
+    return dataset
+
+
+def sample_image():
+    """
+    Return a small JPEG, the same bytes for every upload
+    """
+    from PIL import Image
+
+    data = io.BytesIO()
+    Image.new('RGB', (64, 64), color='orange').save(data, format='JPEG')
+    return data.getvalue()
+
+
+def multipart(field, filename, data):
+    """
+    Encode a file as multipart/form-data, return the body and its content type
+    """
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'.encode(),
+        b'Content-Type: image/jpeg\r\n\r\n',
+        data,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def build_request(workload, user, rng, image):
+    """
+    Return the method, path, body and content type of one request of a workload
+    """
+    if workload == 'list':
+        return 'GET', '/api/recipe/recipes/', None, None
+    elif workload == 'detail':
+        return 'GET', f'/api/recipe/recipes/{rng.choice(user["recipe_ids"])}/', None, None
+    elif workload == 'create':
+        body = {
+            'title': 'Benchmark recipe',
+            'time_minutes': rng.randint(5, 120),
+            'price': '9.99',
+            'tags': rng.sample(user['tag_ids'], min(3, len(user['tag_ids']))),
+            'ingredients': rng.sample(user['ingredient_ids'], min(3, len(user['ingredient_ids']))),
+        }
+        return 'POST', '/api/recipe/recipes/', json.dumps(body), None
+    elif workload == 'upload':
+        body, content_type = multipart('image', 'bench.jpg', image)
+        return 'POST', f'/api/recipe/recipes/{rng.choice(user["recipe_ids"])}/upload-image/', body, content_type
+    elif workload == 'token':
+        return 'POST', '/api/user/token/', json.dumps({'email': user['email'], 'password': user['password']}), None
+
+    raise ValueError(f'Unknown workload {workload}')
+
+
+def query_count(response):
+    """
+    Return the number of queries a response says its request ran, None when it doesn't say
+    """
+    queries = response.getheader(QUERY_COUNT_HEADER)
+    if queries is not None:
+        return int(queries)
+
+    match = SERVER_TIMING_QUERIES.search(response.getheader('Server-Timing', ''))
+    return int(match.group(1)) if match else None
+
+
+def load(url, workload, user, requests, seed, image, samples, lock):
+    """
+    Send the requests of one thread, recording (latency in ms, status, queries) for each
+    """
+    rng = random.Random(seed)
+    # The token workload is what clients without a token do
+    client = Client(url, None if workload == 'token' else user['token'])
+    recorded = []
+    for _ in range(requests):
+        method, path, body, content_type = build_request(workload, user, rng, image)
+        start = time.perf_counter()
+        response, _ = client.send(method, path, body, content_type)
+        elapsed = (time.perf_counter() - start) * 1000
+        recorded.append((elapsed, response.status, query_count(response)))
+
+    with lock:
+        samples.extend(recorded)
+
+
+def summarize(workload, samples, elapsed, threads):
+    """
+    Turn the samples of a workload into its report entry
+    """
+    latencies = [sample[0] for sample in samples if sample[1] < 400]
+    queries = [sample[2] for sample in samples if sample[2] is not None]
+    result = {
+        'workload': workload,
+        'requests': len(samples),
+        'errors': len(samples) - len(latencies),
+        'error_statuses': dict(Counter(str(sample[1]) for sample in samples if sample[1] >= 400)),
+        'threads': threads,
+        'requests_per_second': round(len(samples) / elapsed, 1),
+        'p50_ms': None,
+        'p95_ms': None,
+        'p99_ms': None,
+        'mean_ms': None,
+        'queries_per_request': round(statistics.mean(queries), 2) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
+    if latencies:
+        result.update(
+            p50_ms=round(statistics.median(latencies), 3),
+            p95_ms=round(percentile(latencies, 0.95), 3),
+            p99_ms=round(percentile(latencies, 0.99), 3),
+            mean_ms=round(statistics.mean(latencies), 3),
+        )
+
+    return result
+
+
+def run(url, dataset, workloads, threads, requests, seed):
+    for user in dataset:
+        user['token'] = Client(url).request(
+            'POST', '/api/user/token/', {'email': user['email'], 'password': user['password']}
+        )['token']
+    image = sample_image()
+
+    results = []
+    for workload in workloads:
+        # A short warmup so the first requests don't pay for imports and empty caches
+        load(url, workload, dataset[0], min(requests, 5), seed, image, [], threading.Lock())
+
+        samples = []
+        lock = threading.Lock()
+        workers = [
+            threading.Thread(target=load, args=(
+                url, workload, dataset[i % len(dataset)], requests, seed + i, image, samples, lock
+            ))
+            for i in range(threads)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        results.append(summarize(workload, samples, time.perf_counter() - start, threads))
+
+    return results
+
+
+def environment(args, database):
+    """
+    Describe the run, so reports taken on different machines or revisions can be told apart
+    """
+    import django
+
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'revision': revision,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'database': database,
+        'url': args.url,
+        'parameters': {
+            'users': args.users,
+            'recipes': args.recipes,
+            'tags': args.tags,
+            'ingredients': args.ingredients,
+            'per_recipe': args.per_recipe,
+            'threads': args.threads,
+            'requests': args.requests,
+            'seed': args.seed,
+            'cache': not args.no_cache,
+        },
+    }
+
+
+def run_local(args):
+    """
+    Run the workloads against a server of this process, on a test database and a throwaway media root
+    """
+    from django.db import connection
+    from django.test.utils import override_settings
+
+    from benchmarks.data import create_dataset
+    from core.jobs import get_executor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Requests run on the server's threads, which need a database they can all open
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmp, 'bench.sqlite3')
+        overrides = {
+            'MEDIA_ROOT': os.path.join(tmp, 'media'),
+            # The test environment allows only the hosts of ALLOWED_HOSTS and testserver, not the local server
+            'ALLOWED_HOSTS': ['127.0.0.1', 'localhost'],
+        }
+        if args.no_cache:
+            overrides['API_CACHE_TIMEOUT'] = 0
+
+        with test_database(), override_settings(**overrides):
+            dataset = create_dataset(
+                args.users, args.recipes, args.tags, args.ingredients, args.per_recipe, args.seed
+            )
+            server, url = start_local_server()
+            try:
+                results = run(url, dataset, args.workloads, args.threads, args.requests, args.seed)
+            finally:
+                server.shutdown()
+                server.server_close()
+                # Let the image jobs of the upload workload finish before their database goes away
+                get_executor().shutdown(wait=True)
+
+            return results, f'{connection.vendor} (test database)'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='A running server, instead of one started on a test database')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--recipes', type=int, default=200, help='Recipes per user')
+    parser.add_argument('--tags', type=int, default=20, help='Tags per user')
+    parser.add_argument('--ingredients', type=int, default=50, help='Ingredients per user')
+    parser.add_argument('--per-recipe', type=int, default=3, help='Tags and ingredients per recipe')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=100, help='Requests per thread and workload')
+    parser.add_argument('--workloads', nargs='+', choices=WORKLOADS, default=list(WORKLOADS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-cache', action='store_true', help='Turn the response cache off, local server only')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    setup_django()
+    if args.url:
+        dataset = seed_over_http(
+            args.url, args.users, args.recipes, args.tags, args.ingredients, args.per_recipe, args.seed
+        )
+        results = run(args.url, dataset, args.workloads, args.threads, args.requests, args.seed)
+        database = None
+    else:
+        results, database = run_local(args)
+
+    report('api', results, meta=environment(args, database), output=args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Latency of the filtered recipe list as the number of recipes grows.
+
+    python -m benchmarks.bench_filtering [--sizes 1000 10000 50000]
+
+With EXISTS filters over indexed through tables the p50 should stay about flat across the sizes,
+since every page is an index walk that stops after page_size matches. The rarer the matches the more
+recipes one page has to walk, so the combined filter only flattens out once the table has enough
+matches to fill a page.
+"""
+import argparse
+
+from benchmarks.utils import setup_django, test_database, measure, report
+
+
+def run(sizes, repeat):
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+
+    from core.models import Recipe
+    from benchmarks.data import create_user, create_recipes
+
+    url = reverse('recipe:recipe-list')
+    results = []
+    for size in sizes:
+        user = create_user(f'bench{size}@amadora.com')
+        _, tag_ids, ingredient_ids = create_recipes(user, size)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        workloads = {
+            'tags': {'tags': ','.join(str(pk) for pk in tag_ids[:2])},
+            'tags_and_ingredients': {
+                'tags': ','.join(str(pk) for pk in tag_ids[:2]),
+                'ingredients': str(ingredient_ids[0]),
+            },
+        }
+        for name, params in workloads.items():
+            stats = measure(lambda: client.get(url, params), repeat=repeat)
+            stats.update(recipes=size, workload=name)
+            results.append(stats)
+
+        Recipe.objects.filter(user=user).delete()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 100000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    with test_database():
+        report('recipe_filtering', run(args.sizes, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
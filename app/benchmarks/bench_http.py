@@ -0,0 +1,130 @@
+"""
+Throughput of a running server on the recipe endpoints, e.g. to compare process models.
+
+    python -m benchmarks.bench_http --url http://localhost:8000 [--threads 16] [--requests 200]
+
+Signs up a throwaway user through the API, gives it some recipes and then has every thread send its
+requests over one keep-alive connection. Unlike the other benchmarks this one needs nothing but the
+standard library and a server to talk to, so it measures the whole stack the way clients see it.
+"""
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from benchmarks.utils import percentile, report
+
+
+class Client:
+    """
+    Minimal JSON client over one persistent connection
+    """
+
+    def __init__(self, url, token=None):
+        parts = urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=60)
+        self.headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        if token:
+            self.headers['Authorization'] = f'Token {token}'
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body) if body is not None else None
+        response, payload = self.send(method, path, data)
+        if response.status >= 400:
+            raise RuntimeError(f'{method} {path} answered {response.status}: {payload[:200]!r}')
+
+        return json.loads(payload) if payload else None
+
+    def send(self, method, path, data=None, content_type=None):
+        """
+        Send a raw body and return the response with its payload, whatever the status
+        """
+        headers = self.headers
+        if content_type is not None:
+            headers = dict(headers, **{'Content-Type': content_type})
+        self.connection.request(method, path, body=data, headers=headers)
+        response = self.connection.getresponse()
+
+        return response, response.read()
+
+
+def prepare(url, recipes):
+    """
+    Create a user with some recipes, return its token and the id of one recipe
+    """
+    email = f'bench-{uuid.uuid4().hex[:12]}@amadora.com'
+    client = Client(url)
+    client.request('POST', '/api/user/create/', {'email': email, 'password': 'benchpass', 'name': 'Bench'})
+    token = client.request('POST', '/api/user/token/', {'email': email, 'password': 'benchpass'})['token']
+
+    client = Client(url, token)
+    payload = [
+        {'title': f'Recipe {i}', 'time_minutes': 10, 'price': '5.00', 'tags': ['Dinner'], 'ingredients': ['Salt']}
+        for i in range(recipes)
+    ]
+    created = client.request('POST', '/api/recipe/recipes/bulk/', payload)
+
+    return token, created[0]['id']
+
+
+def load(url, token, path, requests, samples):
+    client = Client(url, token)
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.request('GET', path)
+        samples.append((time.perf_counter() - start) * 1000)
+
+
+def run(url, threads, requests, recipes):
+    token, recipe_id = prepare(url, recipes)
+    paths = {
+        'recipe_list': '/api/recipe/recipes/',
+        'recipe_detail': f'/api/recipe/recipes/{recipe_id}/',
+        'tag_list': '/api/recipe/tags/',
+    }
+
+    results = []
+    for name, path in paths.items():
+        samples = []
+        workers = [
+            threading.Thread(target=load, args=(url, token, path, requests, samples))
+            for _ in range(threads)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            'endpoint': name,
+            'requests_per_second': round(len(samples) / elapsed, 1),
+            'p50_ms': round(statistics.median(samples), 3),
+            'p95_ms': round(percentile(samples, 0.95), 3),
+            'p99_ms': round(percentile(samples, 0.99), 3),
+            'requests': len(samples),
+            'threads': threads,
+        })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per thread and endpoint')
+    parser.add_argument('--recipes', type=int, default=100)
+    args = parser.parse_args()
+
+    report('http_throughput', run(args.url, args.threads, args.requests, args.recipes))
+
+
+if __name__ == '__main__':
+    main()
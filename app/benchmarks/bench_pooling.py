@@ -0,0 +1,109 @@
+"""
+Requests per second of the recipe list endpoint with and without connection reuse.
+
+    python -m benchmarks.bench_pooling [--threads 8] [--requests 200]
+
+Runs the same concurrent load three times:
+  - no_reuse: CONN_MAX_AGE=0, a new database connection for every request
+  - persistent: CONN_MAX_AGE with health checks, one connection per thread kept across requests
+  - pool: the in-process pool of core.db.backends.postgresql, sized to the number of threads
+
+Only meaningful against PostgreSQL, where opening a connection means a TCP handshake, authentication and
+a new backend process. The pool run is skipped on other databases.
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from benchmarks.utils import setup_django, test_database, percentile, report
+
+MODES = {
+    'no_reuse': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'POOL': {}},
+    'persistent': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True, 'POOL': {}},
+    'pool': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': True, 'POOL': {'MAX_SIZE': None, 'TIMEOUT': 10}},
+}
+
+
+def load(user, url, requests, samples):
+    """
+    Send requests to url one after the other, recording their latency in milliseconds
+    """
+    from django.db import connections
+    from rest_framework.test import APIClient
+
+    client = APIClient()
+    client.force_authenticate(user)
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(url)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.status_code
+    connections.close_all()
+
+
+def run(threads, requests, recipes):
+    from django.db import connection, connections
+    from django.test.utils import override_settings
+    from django.urls import reverse
+
+    from benchmarks.data import create_user, create_recipes
+
+    user = create_user()
+    create_recipes(user, recipes)
+    url = reverse('recipe:recipe-list')
+
+    results = []
+    for mode, options in MODES.items():
+        if mode == 'pool' and connection.vendor != 'postgresql':
+            continue
+        options = dict(options, POOL=dict(options['POOL']))
+        if 'MAX_SIZE' in options['POOL']:
+            options['POOL']['MAX_SIZE'] = threads
+        connections.close_all()
+        connection.settings_dict.update(options)
+
+        samples = []
+        workers = [
+            threading.Thread(target=load, args=(user, url, requests, samples))
+            for _ in range(threads)
+        ]
+        # Without the response cache every request goes to the database
+        with override_settings(API_CACHE_TIMEOUT=0):
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+
+        if mode == 'pool':
+            from core.db.backends.postgresql.base import close_pools
+            close_pools()
+
+        results.append({
+            'mode': mode,
+            'requests_per_second': round(len(samples) / elapsed, 1),
+            'p50_ms': round(statistics.median(samples), 3),
+            'p95_ms': round(percentile(samples, 0.95), 3),
+            'requests': len(samples),
+            'threads': threads,
+        })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per thread')
+    parser.add_argument('--recipes', type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_django()
+    with test_database():
+        report('connection_pooling', run(args.threads, args.requests, args.recipes))
+
+
+if __name__ == '__main__':
+    main()
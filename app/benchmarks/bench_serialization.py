@@ -0,0 +1,103 @@
+"""
+Serializing recipes with the model serializers against RecipeRowSerializer.
+
+    python -m benchmarks.bench_serialization [--sizes 1000 10000] [--repeat 10]
+
+For each size it times turning all the user's recipes into data, queries included, for the list and the
+detail representation, and rendering that data to JSON. The model path is what the views did before:
+a prefetching queryset through RecipeSerializer / RecipeDetailSerializer. The rows path reads values()
+rows and the related (recipe id, id, name) tuples. Both have to render the same bytes, or the run stops.
+
+It then times rendering the whole list to JSON, and parsing it back, with DRF's JSON renderer and parser
+against core.renderers / core.parsers, which use orjson when it is installed.
+"""
+import argparse
+from io import BytesIO
+
+from benchmarks.utils import setup_django, test_database, measure, report
+
+
+def run(sizes, repeat):
+    from django.db.models import Prefetch
+    from rest_framework import parsers, renderers
+
+    from core.parsers import JSONParser
+    from core.renderers import JSONRenderer
+
+    from core.models import Recipe, Tag, Ingredient
+    from recipe import serializers
+    from recipe.views import RECIPE_READ_COLUMNS
+    from benchmarks.data import create_user, create_recipes
+
+    renderer = renderers.JSONRenderer()
+    results = []
+    for size in sizes:
+        user = create_user(f'bench{size}@amadora.com')
+        create_recipes(user, size)
+        recipes = Recipe.objects.filter(user=user).order_by('-id')
+
+        for detail, related_columns in ((False, ('id',)), (True, ('id', 'name'))):
+            def model_path():
+                queryset = recipes.only(*RECIPE_READ_COLUMNS).prefetch_related(
+                    Prefetch('ingredients', queryset=Ingredient.objects.only(*related_columns)),
+                    Prefetch('tags', queryset=Tag.objects.only(*related_columns)),
+                )
+                serializer_class = serializers.RecipeDetailSerializer if detail else serializers.RecipeSerializer
+                return renderer.render(serializer_class(queryset, many=True).data)
+
+            def rows_path():
+                rows = serializers.RecipeRowSerializer.recipe_rows(recipes)
+                return renderer.render(serializers.RecipeRowSerializer(rows, many=True, detail=detail).data)
+
+            if model_path() != rows_path():
+                raise SystemExit(f'The row serializer output differs at {size} recipes, detail={detail}')
+
+            stats = {}
+            for name, func in (('model', model_path), ('rows', rows_path)):
+                stats[name] = measure(func, repeat=repeat, warmup=1)
+                stats[name].update(recipes=size, workload='detail' if detail else 'list', path=name)
+                results.append(stats[name])
+            results.append({
+                'recipes': size,
+                'workload': 'detail' if detail else 'list',
+                'speedup_p50': round(stats['model']['p50_ms'] / stats['rows']['p50_ms'], 2),
+            })
+
+        data = serializers.RecipeRowSerializer(serializers.RecipeRowSerializer.recipe_rows(recipes), many=True).data
+        body = renderer.render(data)
+        for workload, paths in (
+            ('render', (('drf', lambda: renderer.render(data)), ('core', lambda: JSONRenderer().render(data)))),
+            ('parse', (
+                ('drf', lambda: parsers.JSONParser().parse(BytesIO(body))),
+                ('core', lambda: JSONParser().parse(BytesIO(body))),
+            )),
+        ):
+            stats = {}
+            for name, func in paths:
+                stats[name] = measure(func, repeat=repeat, warmup=1)
+                stats[name].update(recipes=size, workload=workload, path=name)
+                results.append(stats[name])
+            results.append({
+                'recipes': size,
+                'workload': workload,
+                'speedup_p50': round(stats['drf']['p50_ms'] / stats['core']['p50_ms'], 2),
+            })
+
+        Recipe.objects.filter(user=user).delete()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    setup_django()
+    with test_database():
+        report('recipe_serialization', run(args.sizes, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Compare two JSON reports of the same benchmark and flag the regressions.
+
+    python -m benchmarks.compare baseline.json current.json [--threshold 0.1]
+
+Results are matched on their workload (or endpoint). A result regresses when its p95 latency grows or
+its throughput drops or its mean queries per request grow by more than the threshold, or when its
+slowest request runs more queries than before at all. Growing from a baseline of zero, e.g. queries
+where there were none, is always a regression, its change is reported as null.
+Exits with status 1 when anything regressed, so it can gate a release.
+"""
+import argparse
+import json
+import sys
+
+# Metric, whether higher is better
+METRICS = (
+    ('p95_ms', False),
+    ('requests_per_second', True),
+    ('queries_per_request', False),
+    ('max_queries', False),
+)
+
+
+def result_key(result):
+    return result.get('workload') or result.get('endpoint')
+
+
+def compare(baseline, current, threshold):
+    """
+    Return a row per workload and metric found in both reports
+    """
+    previous = {result_key(result): result for result in baseline['results']}
+    rows = []
+    for result in current['results']:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        for metric, higher_is_better in METRICS:
+            before, after = old.get(metric), result.get(metric)
+            if before is None or after is None:
+                continue
+            if before:
+                change = (after - before) / before
+            else:
+                # Nothing is a relative change from zero, any growth from it is too large to put a number on
+                change = 0.0 if after == before else None
+            if metric == 'max_queries':
+                # The most queries a request ran doesn't vary from run to run, unlike the mean which moves with
+                # the share of cached responses: any extra query is a change in the code
+                regressed = after > before
+            elif change is None:
+                # Throughput can only have grown from zero, anything else growing from zero, e.g. queries, regressed
+                regressed = not higher_is_better
+            elif higher_is_better:
+                regressed = change < -threshold
+            else:
+                regressed = change > threshold
+            rows.append({
+                'workload': result_key(result),
+                'metric': metric,
+                'baseline': before,
+                'current': after,
+                'change': round(change, 4) if change is not None else None,
+                'regressed': regressed,
+            })
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative change tolerated, 0.1 is 10%%')
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    if baseline.get('benchmark') != current.get('benchmark'):
+        parser.error(f'{args.baseline} and {args.current} are reports of different benchmarks')
+
+    rows = compare(baseline, current, args.threshold)
+    print(json.dumps({'benchmark': current['benchmark'], 'threshold': args.threshold, 'comparison': rows}, indent=2))
+    sys.exit(1 if any(row['regressed'] for row in rows) else 0)
+
+
+if __name__ == '__main__':
+    main()
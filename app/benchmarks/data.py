@@ -0,0 +1,66 @@
+import random
+
+from django.contrib.auth import get_user_model
+
+from core.models import Tag, Ingredient, Recipe
+
+
+def create_user(email='bench@amadora.com'):
+    """
+    Create the user the benchmark data belongs to
+    """
+    return get_user_model().objects.create_user(email, 'benchpass')
+
+
+def create_recipes(user, recipes, tags=20, ingredients=50, per_recipe=3, seed=0):
+    """
+    Bulk create recipes for the user, each with a few random tags and ingredients
+    """
+    rng = random.Random(seed)
+    Tag.objects.bulk_create([Tag(user=user, name=f'Tag {i}') for i in range(tags)])
+    Ingredient.objects.bulk_create([
+        Ingredient(user=user, name=f'Ingredient {i}') for i in range(ingredients)
+    ])
+    tag_ids = list(Tag.objects.filter(user=user).values_list('id', flat=True))
+    ingredient_ids = list(Ingredient.objects.filter(user=user).values_list('id', flat=True))
+
+    Recipe.objects.bulk_create([
+        Recipe(user=user, title=f'Recipe {i}', time_minutes=rng.randint(5, 120), price=rng.randint(1, 999) / 10)
+        for i in range(recipes)
+    ], batch_size=1000)
+    recipe_ids = list(Recipe.objects.filter(user=user).values_list('id', flat=True))
+
+    tag_rows = []
+    ingredient_rows = []
+    for recipe_id in recipe_ids:
+        for tag_id in rng.sample(tag_ids, min(per_recipe, len(tag_ids))):
+            tag_rows.append(Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id))
+        for ingredient_id in rng.sample(ingredient_ids, min(per_recipe, len(ingredient_ids))):
+            ingredient_rows.append(Recipe.ingredients.through(recipe_id=recipe_id, ingredient_id=ingredient_id))
+    Recipe.tags.through.objects.bulk_create(tag_rows, batch_size=1000)
+    Recipe.ingredients.through.objects.bulk_create(ingredient_rows, batch_size=1000)
+
+    return recipe_ids, tag_ids, ingredient_ids
+
+
+def create_dataset(users, recipes, tags=20, ingredients=50, per_recipe=3, seed=0):
+    """
+    Create users with recipes, tags and ingredients of their own.
+    Returns a dict per user with its credentials and the ids of its objects.
+    """
+    dataset = []
+    for i in range(users):
+        email = f'bench{i}@amadora.com'
+        user = create_user(email)
+        recipe_ids, tag_ids, ingredient_ids = create_recipes(
+            user, recipes, tags=tags, ingredients=ingredients, per_recipe=per_recipe, seed=seed + i
+        )
+        dataset.append({
+            'email': email,
+            'password': 'benchpass',
+            'recipe_ids': recipe_ids,
+            'tag_ids': tag_ids,
+            'ingredient_ids': ingredient_ids,
+        })
+
+    return dataset
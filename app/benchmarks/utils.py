@@ -0,0 +1,76 @@
+import json
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    """
+    Configure Django for a standalone benchmark script
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """
+    Create a throwaway test database for the benchmark and drop it afterwards
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def percentile(samples, fraction):
+    """
+    Return the sample at the given fraction of the sorted samples
+    """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(func, repeat=50, warmup=5):
+    """
+    Call func repeatedly and return its latency stats in milliseconds
+    """
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(percentile(samples, 0.95), 3),
+        'mean_ms': round(statistics.mean(samples), 3),
+        'runs': repeat,
+    }
+
+
+def report(name, results, meta=None, output=None):
+    """
+    Print the results of a benchmark as JSON, and write them to output when given
+    """
+    document = {'benchmark': name, 'results': results}
+    if meta is not None:
+        document['meta'] = meta
+    text = json.dumps(document, indent=2)
+    print(text)
+    if output:
+        with open(output, 'w') as file:
+            file.write(text + '\n')
@@ -3,3 +3,15 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # Connect the receivers that keep the recipe search documents up to date
+        from core import signals  # noqa: F401
+
+        # Time the queries of every connection for the request instrumentation and the metrics
+        from django.conf import settings
+        from django.db.backends.signals import connection_created
+        from core import metrics
+        from core.instrumentation import instrument_connection
+        connection_created.connect(instrument_connection, dispatch_uid='core.instrumentation')
+        metrics.configure(settings.METRICS_DIR)
@@ -0,0 +1,27 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+
+def _run_and_release(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Like at the end of a request: the connection of this worker thread is closed, or handed back to the
+        # pool, unless CONN_MAX_AGE keeps it around
+        close_old_connections()
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Run blocking code, ORM queries in particular, from an async view.
+
+    With ASYNC_CONCURRENT_QUERIES every call runs on a worker thread of its own with its own database
+    connection, so calls gathered together query at the same time. Without it the calls run one after the
+    other on the request's thread, exactly like in a sync view, which is also what TestCase needs since
+    its data is only visible inside its own transaction.
+    """
+    if settings.ASYNC_CONCURRENT_QUERIES:
+        return await sync_to_async(_run_and_release, thread_sensitive=False)(func, args, kwargs)
+
+    return await sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
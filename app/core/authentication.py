@@ -0,0 +1,91 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from rest_framework.authentication import TokenAuthentication
+
+from core import metrics
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of token key to (user, token), with entries expiring after a TTL
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, user, token = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+
+        return user, token
+
+    def set(self, key, user, token):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, user, token)
+            self._keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def _remove(self, key):
+        _, user, _ = self._entries.pop(key)
+        keys = self._keys_by_user.get(user.pk)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user.pk]
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_MAX_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that remembers recently seen tokens instead of querying them on every request
+    """
+    # The cache lives in each worker process. Deleting a token or saving its user evicts it in the process
+    # that made the change (see core.signals), other processes pick the change up within TOKEN_CACHE_TTL.
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        metrics.CACHE_REQUESTS.inc(cache='token', result='miss' if cached is None else 'hit')
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user, token)
+        else:
+            user, token = cached
+
+        # Every request gets its own copy, so nothing a view does to request.user leaks into the cache
+        return copy.copy(user), token
@@ -0,0 +1,139 @@
+"""
+PostgreSQL backend with connection health checks and an optional in-process connection pool.
+
+Configured through extra keys of the DATABASES entry, see app/settings.py:
+
+    'CONN_HEALTH_CHECKS': True,
+    'POOL': {'MAX_SIZE': 10, 'TIMEOUT': 10, 'MAX_LIFETIME': 1800},
+
+With a pool, Django's usual close at the end of each request hands the connection back to the pool
+instead of closing it, so CONN_MAX_AGE should be 0.
+"""
+import os
+import threading
+import time
+
+from django.db.backends.postgresql import base
+
+from core import metrics
+from core.db.backends.postgresql.creation import DatabaseCreation
+from core.db.pool import ConnectionPool, PoolTimeout
+
+# (pid, database name, connection parameters) -> ConnectionPool
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def ping(connection):
+    """
+    Tell whether a raw psycopg2 connection still answers
+    """
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except base.Database.Error:
+        return False
+
+    return True
+
+
+def close_pools(database_name=None):
+    """
+    Close the idle connections of this process's pools, e.g. before dropping their database
+    """
+    with _pools_lock:
+        for key in list(_pools):
+            if database_name is None or key[1] == database_name:
+                _pools.pop(key).close()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, settings_dict, alias=base.DEFAULT_DB_ALIAS):
+        settings_dict.setdefault('CONN_HEALTH_CHECKS', False)
+        settings_dict.setdefault('POOL', {})
+        super().__init__(settings_dict, alias)
+        # Whether the connection was checked since the current request started, see ensure_connection
+        self.health_check_done = False
+        self.pool = None
+
+    @property
+    def pooled(self):
+        return self.settings_dict['POOL'].get('MAX_SIZE', 0) > 0
+
+    def get_pool(self, conn_params):
+        """
+        Return the pool this process shares between all its connections to the same database
+        """
+        # The pid keeps a forked worker away from the sockets of its parent
+        key = (os.getpid(), conn_params.get('database'), repr(sorted(conn_params.items())))
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                options = self.settings_dict['POOL']
+                pool = _pools[key] = ConnectionPool(
+                    lambda: base.DatabaseWrapper.get_new_connection(self, conn_params),
+                    max_size=options['MAX_SIZE'],
+                    timeout=options.get('TIMEOUT', 10),
+                    max_lifetime=options.get('MAX_LIFETIME'),
+                    check=ping if self.settings_dict['CONN_HEALTH_CHECKS'] else None,
+                )
+
+            return pool
+
+    def get_new_connection(self, conn_params):
+        if not self.pooled:
+            return super().get_new_connection(conn_params)
+
+        self.pool = self.get_pool(conn_params)
+        start = time.perf_counter()
+        try:
+            connection = self.pool.acquire()
+        except PoolTimeout as exc:
+            self.pool = None
+            metrics.DB_POOL_TIMEOUTS.inc(alias=self.alias)
+            raise base.Database.OperationalError(str(exc)) from exc
+        metrics.DB_POOL_WAIT.observe(time.perf_counter() - start, alias=self.alias)
+        # Normally set while opening the connection, which may have happened on another wrapper
+        self.isolation_level = self.settings_dict['OPTIONS'].get('isolation_level', connection.isolation_level)
+
+        return connection
+
+    def connect(self):
+        super().connect()
+        # A connection that was just opened or checked out doesn't need checking again
+        self.health_check_done = True
+
+    def ensure_connection(self):
+        # Check a persistent connection before its first use in a request, the server may have dropped it
+        # while it sat idle. Inside a transaction that would only hide the error, so leave it be there.
+        if (
+            self.connection is not None
+            and not self.health_check_done
+            and self.settings_dict['CONN_HEALTH_CHECKS']
+            and not self.in_atomic_block
+        ):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.close()
+        super().ensure_connection()
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # Runs at the start and end of every request, the next use gets checked again
+        self.health_check_done = False
+
+    def _close(self):
+        if self.pool is None or self.connection is None:
+            return super()._close()
+
+        connection, self.pool, pool = self.connection, None, self.pool
+        try:
+            # Never hand out a connection in the middle of someone else's transaction
+            if not connection.closed and not connection.autocommit:
+                connection.rollback()
+        except base.Database.Error:
+            pool.release(connection, discard=True)
+        else:
+            pool.release(connection, discard=bool(connection.closed))
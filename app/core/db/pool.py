@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of open DB-API connections, shared by the threads of one process.
+
+    At most max_size connections exist at a time, idle or in use. When all of them are in use acquire()
+    waits up to timeout seconds for one to come back. Connections older than max_lifetime are closed
+    instead of reused, so the database gets to rebalance and free their memory now and then.
+    """
+
+    def __init__(self, connect, max_size, timeout=10.0, max_lifetime=None, check=None):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        # Called on every idle connection handed out, returns whether it still works
+        self.check = check
+        self._idle = deque()
+        self._created_at = {}
+        self._size = 0
+        self._condition = threading.Condition()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def _expired(self, connection):
+        return (
+            self.max_lifetime is not None
+            and time.monotonic() - self._created_at[id(connection)] >= self.max_lifetime
+        )
+
+    def _discard(self, connection):
+        """
+        Close a connection and give its slot back, the condition must be held
+        """
+        self._forget(connection)
+        self._close(connection)
+
+    def _forget(self, connection):
+        """
+        Give the slot of a connection back, the condition must be held
+        """
+        self._created_at.pop(id(connection), None)
+        self._size -= 1
+        self._condition.notify()
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """
+        Return an open connection, reusing an idle one when there is one
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._condition:
+                connection = self._take(deadline)
+                if connection is None:
+                    break
+                expired = self._expired(connection)
+
+            # The check is a round trip to the database, don't hold up the other threads meanwhile.
+            # The connection still counts towards the size, nobody else can take it or its slot.
+            try:
+                usable = not expired and (self.check is None or self.check(connection))
+            except BaseException:
+                usable = False
+                raise
+            finally:
+                if not usable:
+                    self._close(connection)
+                    with self._condition:
+                        self._forget(connection)
+            if usable:
+                return connection
+
+        # Connecting is slow, don't hold up the other threads meanwhile
+        try:
+            connection = self.connect()
+        except BaseException:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._created_at[id(connection)] = time.monotonic()
+
+        return connection
+
+    def _take(self, deadline):
+        """
+        Take an idle connection, or reserve the slot of a new one and return None, the condition must be held
+        """
+        while True:
+            if self._idle:
+                # The most recently used connection is the most likely to still be alive and warm
+                return self._idle.pop()
+            if self._size < self.max_size:
+                self._size += 1
+                return None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PoolTimeout(
+                    f'All {self.max_size} connections are in use, none came back within {self.timeout} seconds.'
+                )
+            self._condition.wait(remaining)
+
+    def release(self, connection, discard=False):
+        """
+        Hand a connection back to the pool, or close it for good with discard
+        """
+        with self._condition:
+            if discard or self._expired(connection):
+                self._discard(connection)
+            else:
+                self._idle.append(connection)
+                self._condition.notify()
+
+    def close(self):
+        """
+        Close every idle connection, the ones in use are closed when they are released
+        """
+        with self._condition:
+            while self._idle:
+                self._discard(self._idle.pop())
+            # Every connection still in use is now past its lifetime, so release() closes it
+            self.max_lifetime = 0
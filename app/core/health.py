@@ -0,0 +1,32 @@
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+
+# Aliases whose migrations were found fully applied. That can't change while the process runs, so it is only
+# checked until it is true once.
+_migrated = set()
+
+
+def check_database(alias=DEFAULT_DB_ALIAS):
+    """
+    Open a connection if there is none and run a trivial query on it, raising whatever the database raises
+    """
+    connection = connections[alias]
+    connection.ensure_connection()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+
+
+def pending_migrations(alias=DEFAULT_DB_ALIAS):
+    """
+    Return the migrations that still have to be applied to a database
+    """
+    if alias in _migrated:
+        return []
+
+    executor = MigrationExecutor(connections[alias])
+    plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    if not plan:
+        _migrated.add(alias)
+
+    return [migration for migration, _ in plan]
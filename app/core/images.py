@@ -0,0 +1,72 @@
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def read_image_header(source, max_pixels):
+    """
+    Return the format and size of an image reading only its header, rejecting images with too many pixels
+    """
+    # Image.open is lazy: it parses the header and leaves the pixel data alone until something loads it
+    with Image.open(source) as image:
+        width, height = image.size
+        if width * height > max_pixels:
+            raise ImageTooLarge(f'Images can have at most {max_pixels} pixels, this one has {width * height}.')
+
+        return image.format, (width, height)
+
+
+def normalize_image(source, max_dimension, max_pixels, quality=85):
+    """
+    Decode an upload, undo its EXIF rotation, shrink it to fit max_dimension and re-encode it as JPEG
+    """
+    with Image.open(source) as image:
+        width, height = image.size
+        if width * height > max_pixels:
+            raise ImageTooLarge(f'Images can have at most {max_pixels} pixels, this one has {width * height}.')
+
+        # For JPEGs draft() lets the decoder skip straight to a smaller scale, so a phone photo
+        # never gets decoded at full resolution just to be shrunk afterwards
+        image.draft('RGB', (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        output = BytesIO()
+        image.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+
+    output.seek(0)
+    return output
+
+
+# Variant formats we can produce, with their Pillow encoder and media type
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+def make_variants(source, widths, formats, quality=80):
+    """
+    Yield (width, format, data) for every width narrower than the image, in every format
+    """
+    with Image.open(source) as image:
+        image.load()
+        # Work down from the widest variant, each one is resized from the previous one instead of the
+        # full image, which is a lot less work for the small sizes
+        current = image
+        for width in sorted(set(widths), reverse=True):
+            if width >= image.width:
+                continue
+            height = max(1, round(image.height * width / image.width))
+            current = current.resize((width, height), Image.LANCZOS)
+            for name in formats:
+                output = BytesIO()
+                current.save(output, format=VARIANT_FORMATS[name][0], quality=quality)
+                output.seek(0)
+                yield width, name, output
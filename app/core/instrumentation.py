@@ -0,0 +1,120 @@
+import heapq
+import time
+from contextvars import ContextVar
+
+from rest_framework.fields import empty
+
+from core import metrics
+
+# The measurements of the request being handled. A context variable rather than a thread local, so the
+# queries async views run on worker threads still count towards their request.
+_current = ContextVar('request_metrics', default=None)
+
+# Enough of a statement to recognize it in the slow request log
+MAX_SQL_LENGTH = 500
+
+
+class RequestMetrics:
+    """
+    Where the time of one request goes
+    """
+
+    def __init__(self, top_queries=0):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.top_queries = top_queries
+        # Min-heap of the slowest (duration, sql) so far, at most top_queries of them
+        self.slowest = []
+        self.serializing = False
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        if self.top_queries:
+            if len(self.slowest) < self.top_queries:
+                heapq.heappush(self.slowest, (duration, sql))
+            elif duration > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (duration, sql))
+
+    def slowest_queries(self):
+        """
+        Return the slowest queries, slowest first, as (duration in seconds, sql)
+        """
+        return [(duration, sql[:MAX_SQL_LENGTH]) for duration, sql in sorted(self.slowest, reverse=True)]
+
+
+def start_request(top_queries=0):
+    """
+    Start measuring a request, return its metrics and the token to end it with
+    """
+    metrics = RequestMetrics(top_queries)
+    return metrics, _current.set(metrics)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def current_metrics():
+    return _current.get()
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper timing every query, for the metrics and the request being measured if any
+    """
+    alias = context['connection'].alias
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    except Exception:
+        metrics.DB_QUERY_ERRORS.inc(alias=alias)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        metrics.DB_QUERIES.inc(alias=alias)
+        metrics.DB_QUERY_DURATION.observe(duration, alias=alias)
+        request_metrics = _current.get()
+        if request_metrics is not None:
+            request_metrics.record_query(sql, duration)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """
+    connection_created receiver counting connections and adding record_query to them, in whatever thread
+    """
+    metrics.DB_CONNECTIONS.inc(alias=connection.alias)
+    # The wrapper list belongs to the connection object, which survives reconnecting
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def timed_serialization(method, *args):
+    """
+    Call a serializer method, counting its time towards the request's serializer time.
+    Only the outermost call is timed, nested and listed serializers are part of its time.
+    """
+    metrics = _current.get()
+    if metrics is None or metrics.serializing:
+        return method(*args)
+
+    metrics.serializing = True
+    start = time.perf_counter()
+    try:
+        return method(*args)
+    finally:
+        metrics.serializer_time += time.perf_counter() - start
+        metrics.serializing = False
+
+
+class InstrumentedSerializerMixin:
+    """
+    Count the time spent serializing and validating towards the request's serializer time
+    """
+
+    def to_representation(self, instance):
+        return timed_serialization(super().to_representation, instance)
+
+    def run_validation(self, data=empty):
+        return timed_serialization(super().run_validation, data)
@@ -0,0 +1,261 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from core import metrics
+from core.images import make_variants, normalize_image, read_image_header
+from core.models import ImageJob
+from core.storage import content_name, image_storage
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Return the pool of image workers of this process, starting it on first use
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                thread_name_prefix='image-worker'
+            )
+
+    return _executor
+
+
+def enqueue_image_job(job):
+    """
+    Hand a saved job to the workers once the transaction that created it commits
+    """
+    if settings.IMAGE_JOBS_EAGER:
+        # Handy for tests and scripts: process the job right away in this thread
+        process_image_job(job.pk)
+        return
+
+    transaction.on_commit(lambda: _submit(job.pk))
+
+
+def _submit(job_id):
+    if settings.IMAGE_JOBS_EAGER:
+        process_image_job(job_id)
+    else:
+        get_executor().submit(_run_in_worker, job_id)
+
+
+def _run_in_worker(job_id):
+    # Worker threads keep their own connection, drop it if it went stale between jobs
+    close_old_connections()
+    try:
+        process_image_job(job_id)
+    except Exception:
+        logger.exception('Image job %s crashed', job_id)
+    finally:
+        close_old_connections()
+
+
+def claim_job(job_id):
+    """
+    Move a pending job to processing, return False if another worker got it first
+    """
+    return ImageJob.objects.filter(pk=job_id, status=ImageJob.PENDING).update(
+        status=ImageJob.PROCESSING,
+        updated_at=timezone.now()
+    ) == 1
+
+
+def process_image_job(job_id):
+    """
+    Normalize the upload of a job and store it as the image of its recipe
+    """
+    if not claim_job(job_id):
+        return
+
+    start = time.perf_counter()
+    # Whatever goes wrong, the job has to end up failed, or its client would poll it forever
+    try:
+        job = ImageJob.objects.select_related('recipe').get(pk=job_id)
+        try:
+            with job.upload.open('rb') as upload:
+                image = normalize_image(
+                    upload,
+                    max_dimension=settings.IMAGE_MAX_DIMENSION,
+                    max_pixels=settings.IMAGE_MAX_PIXELS
+                )
+        except Exception as exc:
+            # The upload is not a usable image, the client gets to know why
+            fail_job(job_id, str(exc) or exc.__class__.__name__, start)
+            return
+
+        save_recipe_image(job.recipe, image.getvalue())
+
+        job.upload.delete(save=False)
+        job.status = ImageJob.DONE
+        job.save(update_fields=['upload', 'status', 'updated_at'])
+    except Exception:
+        logger.exception('Image job %s failed', job_id)
+        fail_job(job_id, 'The image could not be stored, upload it again.', start)
+        return
+
+    metrics.IMAGE_JOB_DURATION.observe(time.perf_counter() - start, status=ImageJob.DONE)
+
+
+def fail_job(job_id, error, start):
+    """
+    Record that a job failed and delete its upload, nobody is going to process it anymore.
+    Updates with an UPDATE so it works whatever state the job object was left in.
+    """
+    job = ImageJob.objects.filter(pk=job_id).first()
+    if job is not None and job.upload:
+        try:
+            job.upload.delete(save=False)
+        except OSError:
+            # The failure gets recorded all the same, only the file is left behind
+            logger.exception('Could not delete the upload of failed image job %s', job_id)
+    ImageJob.objects.filter(pk=job_id).update(
+        status=ImageJob.FAILED,
+        error=error,
+        upload='',
+        updated_at=timezone.now()
+    )
+    metrics.IMAGE_JOB_DURATION.observe(time.perf_counter() - start, status=ImageJob.FAILED)
+
+
+def requeue_stale_jobs(stale_after):
+    """
+    Put the jobs processing for longer than stale_after seconds back in the queue, e.g. after their worker died.
+    Returns how many there were.
+    """
+    stale = timezone.now() - timedelta(seconds=stale_after)
+
+    return ImageJob.objects.filter(status=ImageJob.PROCESSING, updated_at__lt=stale).update(
+        status=ImageJob.PENDING,
+        updated_at=timezone.now()
+    )
+
+
+def recover_jobs(stale_after):
+    """
+    Hand the jobs nobody is working on to this process's workers: the stale ones and the ones pending for longer
+    than stale_after seconds, whose worker process was recycled or killed before it got to them.
+    Claiming is a conditional UPDATE, so a job that is only slow to be picked up still runs once.
+    """
+    requeue_stale_jobs(stale_after)
+    waiting = timezone.now() - timedelta(seconds=stale_after)
+    job_ids = list(
+        ImageJob.objects.filter(status=ImageJob.PENDING, created_at__lt=waiting)
+        .order_by('created_at').values_list('pk', flat=True)
+    )
+    for job_id in job_ids:
+        _submit(job_id)
+
+    return job_ids
+
+
+_recovery_thread = None
+
+
+def start_job_recovery():
+    """
+    Recover lost jobs now and every IMAGE_JOB_RECOVERY_INTERVAL seconds, from a thread of this process.
+    gunicorn.conf.py starts it in each worker.
+    """
+    global _recovery_thread
+    with _executor_lock:
+        if _recovery_thread is not None or not settings.IMAGE_JOB_RECOVERY_INTERVAL:
+            return
+        _recovery_thread = threading.Thread(target=_recover_forever, name='image-job-recovery', daemon=True)
+        _recovery_thread.start()
+
+
+def _recover_forever():
+    while True:
+        try:
+            recover_jobs(settings.IMAGE_JOB_STALE_AFTER)
+        except Exception:
+            logger.exception('Recovering image jobs failed')
+        finally:
+            close_old_connections()
+        time.sleep(settings.IMAGE_JOB_RECOVERY_INTERVAL)
+
+
+def save_recipe_image(recipe, data):
+    """
+    Store a processed image on a recipe together with its resized variants.
+    Identical images share one file, named after their content.
+
+    The files the recipe used before are left to collect_image_garbage: another recipe may be taking them
+    up at this very moment, and only the collector can tell, from the modification time the storage
+    refreshes whenever a file is reused.
+    """
+    recipe.image.name = image_storage.save(content_name(data, 'jpg'), ContentFile(data))
+    recipe.image_variants = generate_variants(recipe.image.name, data)
+    recipe.save(update_fields=['image', 'image_variants', 'updated_at'])
+
+
+def generate_variants(name, data):
+    """
+    Write the variants of an image next to it and return their paths as {format: {width: path}}
+    """
+    stem = os.path.splitext(name)[0]
+    _, (image_width, _) = read_image_header(ContentFile(data), settings.IMAGE_MAX_PIXELS)
+    variants = {}
+    for width in settings.IMAGE_VARIANT_WIDTHS:
+        if width < image_width:
+            for fmt in settings.IMAGE_VARIANT_FORMATS:
+                # JSON object keys are strings, store them that way from the start
+                variants.setdefault(fmt, {})[str(width)] = f'{stem}_{width}w.{fmt}'
+
+    paths = [path for paths in variants.values() for path in paths.values()]
+    if all([image_storage.touch(path) for path in paths]):
+        # Another recipe with the same image already has them, skip decoding and resizing altogether
+        return variants
+
+    for width, fmt, output in make_variants(
+        ContentFile(data), settings.IMAGE_VARIANT_WIDTHS, settings.IMAGE_VARIANT_FORMATS
+    ):
+        image_storage.save(variants[fmt][str(width)], ContentFile(output.getvalue()))
+
+    return variants
+
+
+def regenerate_variants(recipe):
+    """
+    Rebuild the variants of a recipe's current image, e.g. after the configured sizes changed.
+    Variants of sizes no longer configured are left to collect_image_garbage, like replaced images.
+    """
+    with recipe.image.open('rb') as image:
+        recipe.image_variants = generate_variants(recipe.image.name, image.read())
+    recipe.save(update_fields=['image_variants', 'updated_at'])
+
+
+def process_pending_jobs(limit=None, workers=1):
+    """
+    Process the pending jobs oldest first, e.g. the ones left behind by a restart. Return how many were handled.
+    """
+    job_ids = ImageJob.objects.filter(status=ImageJob.PENDING).order_by('created_at').values_list('pk', flat=True)
+    if limit is not None:
+        job_ids = job_ids[:limit]
+    job_ids = list(job_ids)
+
+    if workers > 1:
+        # Claiming a job is a conditional UPDATE, so several workers or processes never take the same one
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-worker') as executor:
+            list(executor.map(_run_in_worker, job_ids))
+    else:
+        for job_id in job_ids:
+            process_image_job(job_id)
+
+    return len(job_ids)
@@ -0,0 +1,69 @@
+import os
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.profiling import read_collapsed, write_collapsed
+
+
+class Command(BaseCommand):
+    """Django command to merge the request profiles of each route and show where their time goes"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Where the profiles are, PROFILE_DIR by default')
+        parser.add_argument('--route', action='append', help='Only this route, e.g. recipe:recipe-list. Repeatable.')
+        parser.add_argument('--since', type=float, help='Only profiles written in the last this many hours')
+        parser.add_argument('--output', help='Write the merged profile of each route to <output>/<route>.folded')
+        parser.add_argument('--top', type=int, default=10, help='Functions listed per route')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.PROFILE_DIR
+        if not os.path.isdir(directory):
+            raise CommandError(f'No profiles in {directory}')
+
+        routes = {route.replace(':', '.') for route in options['route'] or ()}
+        cutoff = time.time() - options['since'] * 3600 if options['since'] is not None else None
+        if options['output']:
+            os.makedirs(options['output'], exist_ok=True)
+
+        for route in sorted(os.listdir(directory)):
+            route_directory = os.path.join(directory, route)
+            if not os.path.isdir(route_directory) or (routes and route not in routes):
+                continue
+
+            stacks = Counter()
+            profiles = 0
+            with os.scandir(route_directory) as entries:
+                for entry in entries:
+                    if not entry.name.endswith('.folded') or (cutoff and entry.stat().st_mtime < cutoff):
+                        continue
+                    stacks.update(read_collapsed(entry.path))
+                    profiles += 1
+            if not profiles:
+                continue
+
+            if options['output']:
+                write_collapsed(os.path.join(options['output'], f'{route}.folded'), stacks)
+            self.report(route, profiles, stacks, options['top'])
+
+    def report(self, route, profiles, stacks, top):
+        """
+        Print the functions a route spends the most samples in, on their own and with what they call
+        """
+        total = sum(stacks.values())
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            # A recursive function counts once per sample
+            for frame in set(frames):
+                inclusive[frame] += count
+
+        self.stdout.write(self.style.SUCCESS(f'{route}: {profiles} profiles, {total} samples'))
+        for frame, count in own.most_common(top):
+            self.stdout.write(
+                f'  {count / total:6.1%} self  {inclusive[frame] / total:6.1%} total  {frame}'
+            )
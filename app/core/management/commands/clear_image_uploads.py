@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import ImageUpload
+from core.uploads import delete_upload
+
+
+class Command(BaseCommand):
+    """Django command to delete chunked image uploads that were never finished"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=24 * 60 * 60,
+            help='Delete uploads that got no chunk for this many seconds'
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options['older_than'])
+        count = 0
+        for upload in ImageUpload.objects.filter(updated_at__lt=cutoff).iterator():
+            delete_upload(upload)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} abandoned image uploads'))
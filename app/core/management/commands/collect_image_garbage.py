@@ -0,0 +1,110 @@
+import os
+import re
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from core.images import VARIANT_FORMATS
+from core.models import Recipe
+from core.storage import RECIPE_IMAGE_DIR
+
+# Resized copies are named <stem of the original>_<width>w.<format>, see core.jobs.generate_variants
+VARIANT_NAME = re.compile(r'^(?P<stem>.+)_\d+w\.(%s)$' % '|'.join(VARIANT_FORMATS))
+
+# Extensions an original may have, older uploads kept whatever the client sent
+ORIGINAL_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tif', 'tiff')
+
+
+class Command(BaseCommand):
+    """Django command to delete recipe image files that no recipe uses anymore"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Check and delete this many files at a time')
+        parser.add_argument(
+            '--grace', type=int, default=60 * 60,
+            help='Leave files touched in the last this many seconds alone, they may belong to a job in progress'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+
+    def handle(self, *args, **options):
+        directory = default_storage.path(RECIPE_IMAGE_DIR)
+        if not os.path.isdir(directory):
+            self.stdout.write('No recipe images stored yet')
+            return
+
+        cutoff = time.time() - options['grace']
+        deleted = freed = 0
+        batch = []
+        # scandir streams the directory, so even millions of files never sit in memory at once
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if stat.st_mtime > cutoff:
+                    continue
+                batch.append((entry.name, stat.st_size))
+                if len(batch) >= options['batch_size']:
+                    count, size = self.collect(batch, cutoff, options['dry_run'])
+                    deleted, freed, batch = deleted + count, freed + size, []
+        if batch:
+            count, size = self.collect(batch, cutoff, options['dry_run'])
+            deleted, freed = deleted + count, freed + size
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {deleted} unused image files, {freed} bytes'))
+
+    def collect(self, batch, cutoff, dry_run):
+        """
+        Delete the files of a batch that no recipe refers to, return how many and their total size
+        """
+        # Originals are used when a recipe points at them, variants when a recipe points at their original
+        originals_of = {}
+        for filename, _ in batch:
+            match = VARIANT_NAME.match(filename)
+            if match is None:
+                originals_of[filename] = [filename]
+            else:
+                originals_of[filename] = [f'{match.group("stem")}.{ext}' for ext in ORIGINAL_EXTENSIONS]
+
+        candidates = {f'{RECIPE_IMAGE_DIR}/{name}' for names in originals_of.values() for name in names}
+        used = {
+            os.path.basename(name)
+            for name in Recipe.objects.filter(image__in=candidates).values_list('image', flat=True)
+        }
+
+        count = size = 0
+        for filename, file_size in batch:
+            if used.intersection(originals_of[filename]):
+                continue
+            if not dry_run and not self.delete_untouched(f'{RECIPE_IMAGE_DIR}/{filename}', cutoff):
+                continue
+            count += 1
+            size += file_size
+
+        return count, size
+
+    def delete_untouched(self, name, cutoff):
+        """
+        Delete a file unless it was touched after cutoff, return whether it was deleted.
+
+        An upload of the same content may take the file up between the query above and now. The storage
+        touches a file before a recipe points at it, so the file is moved out of the way first and then
+        checked: touched before the move, it is put back; touched after, the touch found no file and the
+        upload wrote a fresh copy.
+        """
+        path = default_storage.path(name)
+        trash_path = f'{path}.trash'
+        try:
+            os.rename(path, trash_path)
+        except FileNotFoundError:
+            return False
+
+        if os.stat(trash_path).st_mtime > cutoff:
+            # os.replace, in case the upload already wrote a copy: it has the same content
+            os.replace(trash_path, path)
+            return False
+        os.unlink(trash_path)
+
+        return True
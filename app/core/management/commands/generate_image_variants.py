@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core.jobs import regenerate_variants
+from core.models import Recipe
+
+
+class Command(BaseCommand):
+    """Django command to build the resized variants of existing recipe images"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rebuild recipes that already have variants too')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').exclude(image=None)
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+
+        count = 0
+        for recipe in recipes.iterator():
+            try:
+                regenerate_variants(recipe)
+            except Exception as exc:
+                self.stderr.write(f'Recipe {recipe.pk}: {exc}')
+                continue
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Generated variants for {count} recipes'))
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.jobs import process_pending_jobs, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    """Django command to drain the queue of recipe image jobs"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new jobs')
+        parser.add_argument('--workers', type=int, default=1, help='Process this many jobs at a time')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls with --loop')
+        parser.add_argument(
+            '--stale-after', type=int, default=settings.IMAGE_JOB_STALE_AFTER,
+            help='Requeue jobs stuck in processing for this many seconds, e.g. after a worker died'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = requeue_stale_jobs(options['stale_after'])
+            if requeued:
+                self.stdout.write(f'Requeued {requeued} stale image jobs')
+
+            handled = process_pending_jobs(workers=options['workers'])
+            if handled:
+                self.stdout.write(self.style.SUCCESS(f'Processed {handled} image jobs'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
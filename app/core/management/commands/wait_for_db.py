@@ -1,22 +1,47 @@
-  
+import random
 import time
 
-from django.db import connections
+from django.db import DEFAULT_DB_ALIAS
 from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+
+from core.health import check_database, pending_migrations
 
 
 class Command(BaseCommand):
     """Django command to pause execution until database is available"""
 
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to wait for')
+        parser.add_argument('--timeout', type=float, default=60.0, help='Give up after this many seconds')
+        parser.add_argument('--initial-delay', type=float, default=0.1, help='Seconds to wait after the first failure')
+        parser.add_argument('--max-delay', type=float, default=5.0, help='Longest wait between two attempts')
+        parser.add_argument(
+            '--check-migrations', action='store_true',
+            help='Also wait until every migration is applied, e.g. by another container running migrate'
+        )
+
     def handle(self, *args, **options):
         self.stdout.write('Waiting for database...')
-        db_conn = None
-        while not db_conn:
+        deadline = time.monotonic() + options['timeout']
+        attempt = 0
+        while True:
             try:
-                db_conn = connections['default']
-            except OperationalError:
-                self.stdout.write('Database unavailable, waiting 1 second...')
-                time.sleep(1)
+                # Actually connect and query, getting hold of the connection object alone proves nothing
+                check_database(options['database'])
+                pending = pending_migrations(options['database']) if options['check_migrations'] else []
+                if not pending:
+                    break
+                reason = f'{len(pending)} migrations not applied yet'
+            except OperationalError as exc:
+                reason = str(exc).strip() or 'Database unavailable'
+
+            # Exponential backoff, with full jitter so a fleet of containers doesn't retry in lockstep
+            delay = random.uniform(0, min(options['max_delay'], options['initial_delay'] * 2 ** attempt))
+            if time.monotonic() + delay > deadline:
+                raise CommandError(f'Database not ready after {options["timeout"]} seconds: {reason}')
+            self.stdout.write(f'{reason}, waiting {delay:.2f} seconds...')
+            time.sleep(delay)
+            attempt += 1
 
-        self.stdout.write(self.style.SUCCESS('Database available!'))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS('Database available!'))
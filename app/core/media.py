@@ -0,0 +1,184 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+# Files named after the SHA-256 of their content, or of the original they were resized from, see core.storage.
+# Their content can never change, so clients may keep them forever.
+CONTENT_ADDRESSED_NAME = re.compile(r'^(?P<digest>[0-9a-f]{64})(_\d+w)?\.[a-z0-9]+$')
+
+RANGE_HEADER = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class RangeFile:
+    """
+    File object that stops reading at the end of a byte range.
+    It keeps fileno() so servers like gunicorn can still hand the range to sendfile().
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def file_etag(filename, stat):
+    """
+    Return a strong ETag for a file: its content hash when the name carries one, its mtime and size otherwise
+    """
+    match = CONTENT_ADDRESSED_NAME.match(filename)
+    if match is not None:
+        # Variants share the hash of their original, the width tells them apart
+        return '"%s"' % os.path.splitext(filename)[0]
+
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+
+def parse_range(header, size):
+    """
+    Return the (start, end) of a single byte range header, end included. None means serve the whole file,
+    a ValueError means the range can't be satisfied.
+    """
+    match = RANGE_HEADER.match(header.strip())
+    if match is None:
+        # Multiple ranges or another unit: the whole file is a valid answer to those
+        return None
+
+    start, end = match.group('start'), match.group('end')
+    if not start:
+        if not end:
+            return None
+        # bytes=-500 asks for the last 500 bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+
+    return start, end
+
+
+def sendfile_response(path, document_root):
+    """
+    Let the web server in front of us send the file, so no worker is busy with it at all
+    """
+    response = HttpResponse()
+    # The web server decides the content type from the file it ends up sending
+    del response['Content-Type']
+    if settings.MEDIA_SENDFILE_BACKEND == 'x-accel-redirect':
+        # nginx maps this internal location back onto document_root
+        response['X-Accel-Redirect'] = settings.MEDIA_SENDFILE_PREFIX + path
+    else:
+        response['X-Sendfile'] = safe_join(document_root, path)
+
+    return response
+
+
+@require_safe
+def serve(request, path, document_root, max_age=None, sendfile=False):
+    """
+    Serve a file below document_root with validators, long lived caching and byte ranges.
+
+    The file object goes to FileResponse untouched, so WSGI servers with a file_wrapper (gunicorn does)
+    stream it with sendfile() instead of reading it through Python. With sendfile=True and
+    MEDIA_SENDFILE_BACKEND set, the web server in front sends the file instead.
+    """
+    try:
+        fullpath = safe_join(document_root, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    try:
+        stat = os.stat(fullpath)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Not found')
+    if not os.path.isfile(fullpath):
+        raise Http404('Not found')
+
+    filename = os.path.basename(fullpath)
+    etag = file_etag(filename, stat)
+    if CONTENT_ADDRESSED_NAME.match(filename):
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    else:
+        cache_control = f'public, max-age={settings.MEDIA_CACHE_MAX_AGE if max_age is None else max_age}'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        not_modified = if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+    else:
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        not_modified = since is not None and int(stat.st_mtime) <= since
+    if not_modified:
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    if sendfile and settings.MEDIA_SENDFILE_BACKEND:
+        response = sendfile_response(path, document_root)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    # If-Range asks for the range only if the file is still the one the client has the start of
+    if range_header and request.method == 'GET' and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        try:
+            byte_range = parse_range(range_header, stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    if request.method == 'HEAD':
+        # Nothing to send, don't even open the file
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = stat.st_size
+    elif byte_range is None:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = FileResponse(RangeFile(open(fullpath, 'rb'), start, length), content_type=content_type, status=206)
+        response['Content-Length'] = length
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    for header, value in headers.items():
+        response[header] = value
+
+    return response
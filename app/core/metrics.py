@@ -0,0 +1,460 @@
+"""
+Counters and histograms in the Prometheus text exposition format, for /metrics (see core.views).
+
+Values are kept in memory by each process. With METRICS_DIR set, every process also mirrors its values
+into a memory mapped file of its own in that directory, and a scrape adds up the files of all the
+processes, e.g. all the workers gunicorn forked. Recording a value takes the metric's lock for a few
+instructions, reading it back never blocks the processes that record.
+"""
+import bisect
+import fcntl
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+
+# Prometheus' default buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Set by configure() when the values are shared between processes
+STORE = None
+
+
+class Metric:
+    """
+    A named family of values, one per combination of label values
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        # Held for the few instructions of an update, never while doing anything else
+        self._lock = threading.Lock()
+        # Storage keys by label values and index, building them is the slow part of a write
+        self._store_keys = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _store(self, key, index, value):
+        """
+        Mirror one value to the shared store, the lock must be held
+        """
+        store_key = self._store_keys.get((key, index))
+        if store_key is None:
+            store_key = self._store_keys[(key, index)] = json.dumps([self.name, key, index])
+        STORE.write(store_key, value)
+
+    def labelsets(self):
+        """
+        Return the label values of every value recorded so far
+        """
+        with self._lock:
+            return [dict(zip(self.labelnames, key)) for key in self._values]
+
+    def empty(self):
+        raise NotImplementedError
+
+    def collect(self):
+        """
+        Return a copy of the values of this process, by label values
+        """
+        with self._lock:
+            return {key: list(values) for key, values in self._values.items()}
+
+    def samples(self, values):
+        """
+        Return the (name, labels, value) samples of some values as returned by collect()
+        """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def empty(self):
+        return [0]
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0]
+            values[0] += amount
+            if STORE is not None:
+                self._store(key, 0, values[0])
+
+    def value(self, **labels):
+        with self._lock:
+            return (self._values.get(self._key(labels)) or [0])[0]
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value[0]
+
+
+class Histogram(Metric):
+    """
+    Counts of the observed values per bucket, with their sum
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def empty(self):
+        # Non cumulative, one count per bucket plus one past the last bound, then the sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = self.empty()
+            values[index] += 1
+            values[-1] += value
+            if STORE is not None:
+                self._store(key, index, values[index])
+                self._store(key, -1, values[-1])
+
+    def value(self, **labels):
+        """
+        Return the cumulative bucket counts, the count and the sum of the values observed for some labels
+        """
+        with self._lock:
+            values = list(self._values.get(self._key(labels)) or self.empty())
+
+        return self._cumulative(values)
+
+    def _cumulative(self, values):
+        cumulative = []
+        total = 0
+        for count in values[:-1]:
+            total += count
+            cumulative.append(total)
+        return {
+            'buckets': dict(zip(self.buckets + (float('inf'),), cumulative)),
+            'count': total,
+            'sum': values[-1],
+        }
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            histogram = self._cumulative(value)
+            for bound, count in histogram['buckets'].items():
+                yield f'{self.name}_bucket', dict(labels, le=format_value(float(bound))), count
+            yield f'{self.name}_sum', labels, histogram['sum']
+            yield f'{self.name}_count', labels, histogram['count']
+
+
+class MmapValues:
+    """
+    A file of key -> float64 entries, memory mapped for writing by one process and read whole by others.
+
+    The file starts with the number of bytes used, then every entry is a 4 byte key length, the UTF-8 key
+    padded to 8 bytes and its value. Entries are only ever added, and the used size is written after the
+    entry, so a reader never sees half of one.
+    """
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(self.INITIAL_SIZE)
+        self._capacity = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), self._capacity)
+        self._used = struct.unpack_from('q', self._map, 0)[0]
+        if self._used == 0:
+            self._used = 8
+            struct.pack_into('q', self._map, 0, self._used)
+        self._positions = {key: position for key, value, position in self._entries(self._map, self._used)}
+
+    @staticmethod
+    def _entries(data, used):
+        position = 8
+        while position < used:
+            length = struct.unpack_from('i', data, position)[0]
+            key = bytes(data[position + 4:position + 4 + length]).decode()
+            position += 4 + length
+            position += -position % 8
+            yield key, struct.unpack_from('d', data, position)[0], position
+            position += 8
+
+    @classmethod
+    def read(cls, path):
+        """
+        Return the entries of a file as a dict, without mapping it
+        """
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < 8:
+            return {}
+
+        return {key: value for key, value, _ in cls._entries(data, struct.unpack_from('q', data, 0)[0])}
+
+    def get(self, key):
+        position = self._positions.get(key)
+        return 0.0 if position is None else struct.unpack_from('d', self._map, position)[0]
+
+    def write(self, key, value):
+        position = self._positions.get(key)
+        if position is None:
+            position = self._append(key)
+        struct.pack_into('d', self._map, position, value)
+
+    def _append(self, key):
+        encoded = key.encode()
+        header = struct.pack('i', len(encoded)) + encoded
+        header += b'\0' * (-len(header) % 8)
+        needed = self._used + len(header) + 8
+        if needed > self._capacity:
+            capacity = self._capacity
+            while capacity < needed:
+                capacity *= 2
+            self._map.close()
+            self._file.truncate(capacity)
+            self._capacity = capacity
+            self._map = mmap.mmap(self._file.fileno(), capacity)
+
+        self._map[self._used:self._used + len(header)] = header
+        position = self._used + len(header)
+        struct.pack_into('d', self._map, position, 0.0)
+        self._used = position + 8
+        struct.pack_into('q', self._map, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class MultiProcessStore:
+    """
+    The values of every process, one file each, in a directory
+    """
+    ARCHIVE = 'archive.db'
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._values = None
+        self._pid = None
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'metrics_{pid}.db')
+
+    def write(self, key, value):
+        # Metrics have a lock each, the file they share needs one of its own: adding a key may remap it
+        with _store_lock:
+            if self._values is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._values = MmapValues(self._path(self._pid))
+            self._values.write(key, value)
+
+    def reset(self):
+        """
+        Forget the file of the parent process, in a forked child
+        """
+        self._values = None
+        self._pid = None
+
+    def _locked(self):
+        lock = open(os.path.join(self.directory, 'lock'), 'a+b')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def mark_process_dead(self, pid):
+        """
+        Fold the values of a process that exited into the archive, so the files don't pile up
+        """
+        path = self._path(pid)
+        with self._locked():
+            if not os.path.exists(path):
+                return
+            archive = MmapValues(os.path.join(self.directory, self.ARCHIVE))
+            try:
+                for key, value in MmapValues.read(path).items():
+                    archive.write(key, archive.get(key) + value)
+            finally:
+                archive.close()
+            os.unlink(path)
+
+    def collect(self):
+        """
+        Return the sum of every value over all processes, by store key
+        """
+        for path in glob.glob(self._path('*')):
+            pid = int(os.path.basename(path)[len('metrics_'):-len('.db')])
+            if not pid_alive(pid):
+                self.mark_process_dead(pid)
+
+        totals = {}
+        with self._locked():
+            for path in glob.glob(os.path.join(self.directory, '*.db')):
+                try:
+                    entries = MmapValues.read(path)
+                except FileNotFoundError:
+                    continue
+                for key, value in entries.items():
+                    totals[key] = totals.get(key, 0) + value
+
+        return totals
+
+
+_store_lock = threading.Lock()
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def configure(directory):
+    """
+    Share the values between the processes using directory, or keep them in this process with None
+    """
+    global STORE
+    STORE = MultiProcessStore(directory) if directory else None
+
+
+def _after_fork():
+    # A forked child starts from nothing, the parent's values stay counted in the parent's file
+    for metric in REGISTRY:
+        metric._lock = threading.Lock()
+        metric._values = {}
+    if STORE is not None:
+        STORE.reset()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return f'{value:.1f}'
+
+    return repr(value)
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def collect_values():
+    """
+    Return the values of every metric, of all processes when they are shared, by metric name
+    """
+    if STORE is None:
+        return {metric.name: metric.collect() for metric in REGISTRY}
+
+    by_name = {metric.name: metric for metric in REGISTRY}
+    values = {metric.name: {} for metric in REGISTRY}
+    for store_key, value in STORE.collect().items():
+        name, key, index = json.loads(store_key)
+        metric = by_name.get(name)
+        if metric is None:
+            continue
+        entry = values[name].setdefault(tuple(key), metric.empty())
+        entry[index] = value
+
+    return values
+
+
+def exposition():
+    """
+    Return every metric in the Prometheus text format
+    """
+    values = collect_values()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, labels, value in metric.samples(values[metric.name]):
+            if labels:
+                label_text = ','.join(f'{label}="{escape_label(str(text))}"' for label, text in labels.items())
+                lines.append(f'{name}{{{label_text}}} {format_value(value)}')
+            else:
+                lines.append(f'{name} {format_value(value)}')
+
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = []
+
+
+# Recorded for every request by core.middleware.InstrumentationMiddleware. The route is the URL name and
+# the action the viewset action, e.g. recipe:recipe-list with GET is list and with POST create.
+REQUEST_LABELS = ('route', 'method', 'action')
+
+REQUESTS = Counter('http_requests_total', 'Requests answered', REQUEST_LABELS + ('status',))
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Time to answer a request', REQUEST_LABELS
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries run by a request', REQUEST_LABELS, buckets=QUERY_COUNT_BUCKETS
+)
+REQUEST_DB_DURATION = Histogram(
+    'http_request_db_duration_seconds', 'Time a request spent in database queries', REQUEST_LABELS
+)
+REQUEST_SERIALIZER_DURATION = Histogram(
+    'http_request_serializer_duration_seconds', 'Time a request spent in serializers', REQUEST_LABELS
+)
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Size of a response body', REQUEST_LABELS, buckets=SIZE_BUCKETS
+)
+
+# Database, see core.instrumentation and core.db.backends.postgresql
+DB_CONNECTIONS = Counter(
+    'db_connections_total', 'Database connections opened, or checked out of the pool', ('alias',)
+)
+DB_QUERIES = Counter('db_queries_total', 'Database queries run', ('alias',))
+DB_QUERY_ERRORS = Counter('db_query_errors_total', 'Database queries that raised an error', ('alias',))
+DB_QUERY_DURATION = Histogram(
+    'db_query_duration_seconds', 'Time a database query took', ('alias',), buckets=QUERY_DURATION_BUCKETS
+)
+DB_POOL_WAIT = Histogram(
+    'db_pool_wait_seconds', 'Time spent waiting for a connection from the pool', ('alias',)
+)
+DB_POOL_TIMEOUTS = Counter(
+    'db_pool_timeouts_total', 'Requests for a pooled connection that gave up waiting', ('alias',)
+)
+
+# Images, see recipe.views, core.uploads and core.jobs
+IMAGE_UPLOAD_SIZE = Histogram(
+    'image_upload_size_bytes', 'Size of the images handed to the image workers', ('source',), buckets=SIZE_BUCKETS
+)
+IMAGE_JOB_DURATION = Histogram(
+    'image_job_duration_seconds', 'Time the image workers took to process a job', ('status',)
+)
+
+# Caches, hits over hits and misses is the hit ratio. The api cache also answers not_modified, see
+# recipe.cache, and the token cache is core.authentication.token_cache.
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups by result', ('cache', 'result'))
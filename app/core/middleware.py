@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+
+from core import metrics
+from core.health import check_database, pending_migrations
+from core.instrumentation import end_request, start_request
+from core.profiling import RequestProfiler
+
+logger = logging.getLogger(__name__)
+
+
+class DualModeMiddleware:
+    """
+    Base for middleware that runs in the mode of the handler it wraps: call() under WSGI, acall() under ASGI.
+
+    Django runs a sync only middleware under ASGI on the one thread it keeps for sync code, which serializes
+    every request of the process behind it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Makes asyncio.iscoroutinefunction() true for the instance, so Django awaits it, like
+            # django.utils.deprecation.MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+
+        return self.call(request)
+
+    def call(self, request):
+        raise NotImplementedError
+
+    async def acall(self, request):
+        raise NotImplementedError
+
+
+class HealthCheckMiddleware(DualModeMiddleware):
+    """
+    Answer the load balancer's probes before any other middleware, authentication or URL resolving runs.
+
+    /healthz says the process is up and serving, it touches nothing else.
+    /readyz also checks the database, and with READYZ_CHECK_MIGRATIONS that its migrations are applied.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.checks = {
+            settings.HEALTHZ_PATH: self.healthz,
+            settings.READYZ_PATH: self.readyz,
+        }
+
+    def call(self, request):
+        check = self.checks.get(request.path_info)
+        if check is None:
+            return self.get_response(request)
+
+        return self.no_store(check())
+
+    async def acall(self, request):
+        check = self.checks.get(request.path_info)
+        if check is None:
+            return await self.get_response(request)
+
+        # The readiness check queries the database, which only sync code may do
+        return self.no_store(await sync_to_async(check)())
+
+    def no_store(self, response):
+        # Probes must always reach us, never a cache in between
+        response['Cache-Control'] = 'no-store'
+        return response
+
+    def healthz(self):
+        return JsonResponse({'status': 'ok'})
+
+    def readyz(self):
+        checks = {}
+        try:
+            check_database()
+            checks['database'] = 'ok'
+            if settings.READYZ_CHECK_MIGRATIONS:
+                pending = pending_migrations()
+                checks['migrations'] = f'{len(pending)} pending' if pending else 'ok'
+        except Exception as exc:
+            logger.warning('Readiness check failed: %s', exc)
+            checks['database'] = 'unavailable'
+
+        ready = all(value == 'ok' for value in checks.values())
+        return JsonResponse(
+            {'status': 'ok' if ready else 'unavailable', 'checks': checks},
+            status=200 if ready else 503
+        )
+
+
+class InstrumentationMiddleware(DualModeMiddleware):
+    """
+    Measure every request: wall time, database queries and their time, serializer time and response size.
+
+    The numbers go to the per route histograms of core.metrics and, with SERVER_TIMING_HEADER, to a
+    Server-Timing header browsers show in their network panel. Requests slower than SLOW_REQUEST_MS
+    are logged with their slowest queries.
+    """
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def call(self, request):
+        request_metrics, token = start_request(settings.SLOW_REQUEST_TOP_QUERIES)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+
+        return self.record(request, response, time.perf_counter() - start, request_metrics)
+
+    async def acall(self, request):
+        # The metrics are a context variable, the queries sync_to_async runs on other threads still count
+        request_metrics, token = start_request(settings.SLOW_REQUEST_TOP_QUERIES)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+
+        return self.record(request, response, time.perf_counter() - start, request_metrics)
+
+    def record(self, request, response, duration, request_metrics):
+        """
+        Record the measurements of a finished request and add its Server-Timing header
+        """
+        # The URL name, e.g. recipe:recipe-list, keeps the number of routes bounded whatever the paths
+        match = request.resolver_match
+        labels = {
+            'route': match.view_name if match is not None else 'unmatched',
+            'method': request.method,
+            # Viewsets map each method of a route to an action, other views have none
+            'action': getattr(match.func, 'actions', {}).get(request.method.lower(), '') if match is not None else '',
+        }
+        size = self.response_size(response)
+
+        metrics.REQUESTS.inc(status=response.status_code, **labels)
+        metrics.REQUEST_DURATION.observe(duration, **labels)
+        metrics.REQUEST_QUERIES.observe(request_metrics.queries, **labels)
+        metrics.REQUEST_DB_DURATION.observe(request_metrics.db_time, **labels)
+        metrics.REQUEST_SERIALIZER_DURATION.observe(request_metrics.serializer_time, **labels)
+        if size is not None:
+            metrics.RESPONSE_SIZE.observe(size, **labels)
+
+        if settings.SERVER_TIMING_HEADER:
+            timings = ', '.join([
+                f'db;dur={request_metrics.db_time * 1000:.1f};desc="{request_metrics.queries} queries"',
+                f'serializer;dur={request_metrics.serializer_time * 1000:.1f}',
+                f'total;dur={duration * 1000:.1f}',
+            ])
+            response['Server-Timing'] = (
+                f'{response["Server-Timing"]}, {timings}' if response.has_header('Server-Timing') else timings
+            )
+
+        if settings.SLOW_REQUEST_MS and duration * 1000 >= settings.SLOW_REQUEST_MS:
+            self.log_slow_request(request, response, labels['route'], duration, size, request_metrics)
+
+        return response
+
+    def response_size(self, response):
+        """
+        Return the size of a response body, None for a stream of unknown length
+        """
+        if not response.streaming:
+            return len(response.content)
+        if response.has_header('Content-Length'):
+            return int(response['Content-Length'])
+
+        return None
+
+    def log_slow_request(self, request, response, route, duration, size, request_metrics):
+        lines = [
+            f'{duration * 1000:.1f} ms {sql}' for duration, sql in request_metrics.slowest_queries()
+        ]
+        logger.warning(
+            'Slow request %s %s (%s) %s in %.1f ms: %d queries in %.1f ms, serializers %.1f ms, %s bytes%s',
+            request.method, request.get_full_path(), route, response.status_code, duration * 1000,
+            request_metrics.queries, request_metrics.db_time * 1000, request_metrics.serializer_time * 1000,
+            size if size is not None else 'unknown', ''.join(f'\n  {line}' for line in lines)
+        )
+
+
+class ProfilingMiddleware(DualModeMiddleware):
+    """
+    Sample the stacks of some requests and write them as collapsed stack profiles under PROFILE_DIR,
+    one directory per route. Off unless PROFILING is set, see core.profiling.
+
+    Only the thread running the middleware is sampled. Under ASGI that is the event loop's, which runs
+    the code of every request in turn, so its samples belong to no request in particular and requests
+    pass through unprofiled.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.profiler = RequestProfiler(
+            settings.PROFILE_DIR,
+            sample_rate=settings.PROFILE_SAMPLE_RATE,
+            slow_seconds=settings.PROFILE_SLOW_MS / 1000 if settings.PROFILE_SLOW_MS else None,
+            interval=settings.PROFILE_INTERVAL_MS / 1000,
+            max_per_minute=settings.PROFILE_MAX_PER_MINUTE,
+        )
+
+    async def acall(self, request):
+        return await self.get_response(request)
+
+    def call(self, request):
+        profile = self.profiler.start()
+        if profile is None:
+            return self.get_response(request)
+
+        try:
+            response = self.get_response(request)
+        finally:
+            match = request.resolver_match
+            try:
+                self.profiler.finish(profile, match.view_name if match is not None else 'unmatched', request.method)
+            except OSError as exc:
+                logger.warning('Could not write a profile: %s', exc)
+
+        return response
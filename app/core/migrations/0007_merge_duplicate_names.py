@@ -0,0 +1,45 @@
+# Generated by Django 3.1.14 on 2026-10-18 04:02
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_names(apps, schema_editor):
+    """
+    Merge the tags and ingredients a user has under the same name into the oldest one
+    """
+    Recipe = apps.get_model('core', 'Recipe')
+    for model_name, relation, column in (('Tag', 'tags', 'tag_id'), ('Ingredient', 'ingredients', 'ingredient_id')):
+        model = apps.get_model('core', model_name)
+        through = getattr(Recipe, relation).through
+        duplicates = (
+            model.objects.values('user_id', 'name')
+            .annotate(keep=Min('id'), total=Count('id'))
+            .filter(total__gt=1)
+        )
+        for duplicate in duplicates:
+            others = list(
+                model.objects.filter(user_id=duplicate['user_id'], name=duplicate['name'])
+                .exclude(id=duplicate['keep']).values_list('id', flat=True)
+            )
+            # Point the recipes at the kept row, without linking a recipe to it twice
+            linked = set(through.objects.filter(**{column: duplicate['keep']}).values_list('recipe_id', flat=True))
+            for row in through.objects.filter(**{column + '__in': others}):
+                if row.recipe_id in linked:
+                    row.delete()
+                else:
+                    setattr(row, column, duplicate['keep'])
+                    row.save()
+                    linked.add(row.recipe_id)
+            model.objects.filter(id__in=others).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_names, migrations.RunPython.noop),
+    ]
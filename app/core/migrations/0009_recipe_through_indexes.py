@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Index the recipe through tables from the tag and ingredient side.
+    The auto-created tables only have (recipe_id, tag_id) unique plus single column indexes, so filtering
+    recipes by tag or finding the tags used by a recipe can't be answered from one index.
+    """
+
+    dependencies = [
+        ('core', '0008_unique_user_names'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX core_recipe_tags_tag_recipe_idx ON core_recipe_tags (tag_id, recipe_id)',
+            'DROP INDEX core_recipe_tags_tag_recipe_idx',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX core_recipe_ingr_ingr_recipe_idx ON core_recipe_ingredients (ingredient_id, recipe_id)',
+            'DROP INDEX core_recipe_ingr_ingr_recipe_idx',
+        ),
+    ]
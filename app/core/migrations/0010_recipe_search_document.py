@@ -0,0 +1,69 @@
+# Generated by Django 3.1.14 on 2026-10-18 04:07
+
+import core.models
+from django.conf import settings
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Index the search documents with GIN on PostgreSQL, other databases scan them with LIKE
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX core_recipe_search_document_gin ON core_recipe USING GIN (search_document)'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX core_recipe_search_document_gin')
+
+
+# The names of the tags or ingredients of the recipe on the current row, {concat} aggregates them
+RELATED_NAMES_SQL = (
+    "COALESCE((SELECT {concat} FROM {table} r JOIN core_recipe_{relation} t ON t.{column} = r.id "
+    "WHERE t.recipe_id = core_recipe.id), '')"
+)
+
+
+def build_search_documents(apps, schema_editor):
+    """
+    Fill in the search document of the existing recipes, the way core.search built them when this was written
+    """
+    def related_names(relation, column, concat):
+        return RELATED_NAMES_SQL.format(table=f'core_{column}', relation=relation, column=f'{column}_id', concat=concat)
+
+    if schema_editor.connection.vendor == 'postgresql':
+        config = settings.RECIPE_SEARCH_CONFIG
+        schema_editor.execute(
+            'UPDATE core_recipe SET search_document = '
+            "setweight(to_tsvector(%s::regconfig, title), 'A') || "
+            f"setweight(to_tsvector(%s::regconfig, {related_names('tags', 'tag', 'string_agg(r.name, %s)')}), 'B') || "
+            f"setweight(to_tsvector(%s::regconfig, {related_names('ingredients', 'ingredient', 'string_agg(r.name, %s)')}), 'B')",
+            [config, config, ' ', config, ' ']
+        )
+    else:
+        schema_editor.execute(
+            'UPDATE core_recipe SET search_document = LOWER(title || %s || '
+            f"{related_names('tags', 'tag', 'GROUP_CONCAT(r.name, %s)')} || %s || "
+            f"{related_names('ingredients', 'ingredient', 'GROUP_CONCAT(r.name, %s)')})",
+            [' ', ' ', ' ', ' ']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_recipe_through_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_document',
+            field=core.models.SearchDocumentField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(build_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_imagejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
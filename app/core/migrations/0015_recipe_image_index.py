@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_imageupload'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['image'], name='core_recipe_image_idx'),
+        ),
+    ]
@@ -8,7 +8,8 @@ from django.conf import settings
 # Create your models here.
 def recipe_image_file_path(instance, filename):
     """
-    Generate file path for new recipe image
+    Generate file path for new recipe image. Images processed by the image workers are named after
+    their content instead, see core.storage.
     """
     # Im separting the filename with its extension through this notation
     ext = filename.split('.')[-1]
@@ -40,6 +41,41 @@ class UserManager(BaseUserManager):
         return user
 
 
+class SearchDocumentField(models.TextField):
+    """
+    Stored search document, a tsvector on PostgreSQL and plain text on other databases
+    """
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'tsvector'
+        return super().db_type(connection)
+
+
+class UserNamedObjectManager(models.Manager):
+    """
+    Manager for objects a user names, like tags and ingredients
+    """
+
+    def get_or_create_by_names(self, user, names):
+        """
+        Return a dict of name to object for the names, creating the missing ones with one INSERT
+        """
+        names = set(names)
+        if not names:
+            return {}
+
+        objects = {obj.name: obj for obj in self.filter(user=user, name__in=names)}
+        missing = names - set(objects)
+        if missing:
+            # Another request may create the same names at the same time. The unique (user, name) constraint
+            # makes the losing INSERT skip those rows, and the SELECT after it picks up whoever won.
+            self.bulk_create([self.model(user=user, name=name) for name in missing], ignore_conflicts=True)
+            objects.update((obj.name, obj) for obj in self.filter(user=user, name__in=missing))
+
+        return objects
+
+
 class User(AbstractBaseUser, PermissionsMixin):
     # custom user model that supports creation with email instead of username.
     email = models.EmailField(max_length=255, unique=True)
@@ -64,6 +100,21 @@ class Tag(models.Model):
         # This setting makes sure thatwhen the user is deleted. The tag related to the user is also deleted.
         on_delete=models.CASCADE,
     )
+    # Drives the Last-Modified of the API responses, together with the version in recipe.cache
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = UserNamedObjectManager()
+
+    class Meta:
+        # The list endpoint pages through a user's tags by (name, id), this index lets every page be a single seek.
+        indexes = [
+            models.Index(fields=['user', '-name', '-id'], name='core_tag_user_name_id_idx'),
+        ]
+        # Recipes can reference tags by name, so a name has to point at a single tag
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='core_tag_user_name_unique'),
+        ]
+
     # This function is overriding the string representation of the tag. Instead of converting to string, we just want it to send the name.
     def __str__(self):
         return self.name
@@ -78,6 +129,17 @@ class Ingredient(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = UserNamedObjectManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-name', '-id'], name='core_ingr_user_name_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='core_ingr_user_name_unique'),
+        ]
 
     def __str__(self):
         return self.name
@@ -100,6 +162,95 @@ class Recipe(models.Model):
     tags = models.ManyToManyField('Tag')
     # Im not calling the function, rather im passing the name of the function and by rules of python im returning its address.
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # Resized copies of the image as {format: {width: path}}, written by core.jobs
+    image_variants = models.JSONField(default=dict, blank=True)
+    # Kept up to date from the title, tag names and ingredient names by core.signals, see core.search
+    search_document = SearchDocumentField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-id'], name='core_recipe_user_id_idx'),
+            # Image files are shared between recipes, this is how we find out whether one is still used
+            models.Index(fields=['image'], name='core_recipe_image_idx'),
+        ]
+
+    def __str__(self):
+        return self.title
+
+
+def image_job_file_path(instance, filename):
+    """
+    Generate file path for an upload waiting to be processed
+    """
+    ext = filename.split('.')[-1]
+    filename = f'{uuid.uuid4()}.{ext}'
+    return os.path.join('uploads/pending/', filename)
+
+
+class ImageJob(models.Model):
+    """
+    A recipe image upload waiting for, or done with, processing by the image workers
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE)
+    # The untouched upload, removed once the job is done
+    upload = models.FileField(upload_to=image_job_file_path, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # The workers claim the oldest pending jobs first
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='core_imagejob_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id} {self.status}'
+
+
+
+def image_upload_file_path():
+    """
+    Generate file path for an image that is still being uploaded in chunks
+    """
+    return os.path.join('uploads/partial/', f'{uuid.uuid4()}.part')
+
+
+class ImageUpload(models.Model):
+    """
+    A recipe image sent in chunks, see core.uploads. Finalizing it turns it into an ImageJob.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE)
+    # Storage name of the file the chunks are appended to
+    path = models.CharField(max_length=255, default=image_upload_file_path, editable=False)
+    # Total size announced by the client and how much of it has arrived so far
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return f'{self.recipe_id} {self.offset}/{self.size}'
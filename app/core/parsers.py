@@ -0,0 +1,28 @@
+from io import BytesIO
+
+from django.conf import settings
+
+from rest_framework.parsers import JSONParser as BaseJSONParser
+
+from core.renderers import JSONRenderer, orjson
+
+
+class JSONParser(BaseJSONParser):
+    """
+    DRF's JSONParser, decoding UTF-8 bodies with orjson when it is installed, see core.renderers
+    """
+    renderer_class = JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # Invalid JSON gets DRF's error message, and what orjson refuses but json accepts
+            # (integers over 64 bits, NaN without STRICT_JSON) still parses
+            return super().parse(BytesIO(body), media_type, parser_context)
@@ -0,0 +1,210 @@
+"""
+Sampling profiler for requests, see core.middleware.ProfilingMiddleware.
+
+A single background thread looks at the stacks of the request threads being profiled every few
+milliseconds through sys._current_frames(), so the profiled code runs unmodified and the cost is one
+stack walk per sample. Profiles are written in the collapsed stack format flamegraph.pl and speedscope
+read: one line per distinct stack, frames from the outermost in separated by semicolons, then a count.
+"""
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+# Routes become directory names
+UNSAFE_NAME = re.compile(r'[^A-Za-z0-9_.-]+')
+
+# Stops a runaway recursion from turning every sample into a huge line
+MAX_DEPTH = 200
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f'{frame.f_globals.get("__name__", "?")}:{getattr(code, "co_qualname", code.co_name)}'
+
+
+def collapse(frame):
+    """
+    Return the stack of a frame as one collapsed line, outermost frame first
+    """
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+
+    return ';'.join(reversed(names))
+
+
+class Profile:
+    """
+    The samples of one request thread, taken from sample_from on
+    """
+
+    def __init__(self, thread_id, started, sample_from):
+        self.thread_id = thread_id
+        self.started = started
+        self.sample_from = sample_from
+        self.stacks = Counter()
+
+
+class Sampler:
+    """
+    Background thread sampling the stacks of the registered profiles every interval seconds
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._profiles = {}
+        self._condition = threading.Condition()
+        self._pid = None
+
+    def start(self, profile):
+        with self._condition:
+            # Threads don't survive a fork, a forked worker needs its own
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='profiler', daemon=True).start()
+            self._profiles[profile.thread_id] = profile
+            self._condition.notify()
+
+    def stop(self, profile):
+        with self._condition:
+            self._profiles.pop(profile.thread_id, None)
+
+        return profile
+
+    def _run(self):
+        while True:
+            # Sampling under the lock means a stopped profile never gets another sample
+            with self._condition:
+                # Sleep for good while no request is being profiled
+                while not self._profiles:
+                    self._condition.wait()
+
+                now = time.perf_counter()
+                due = [profile for profile in self._profiles.values() if profile.sample_from <= now]
+                if due:
+                    frames = sys._current_frames()
+                    for profile in due:
+                        frame = frames.get(profile.thread_id)
+                        if frame is not None:
+                            profile.stacks[collapse(frame)] += 1
+                    del frames
+            time.sleep(self.interval)
+
+
+class RateLimiter:
+    """
+    Token bucket allowing per_minute events a minute, in bursts of up to per_minute
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self._tokens = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.per_minute, self._tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def available(self):
+        with self._lock:
+            self._refill()
+            return self._tokens >= 1
+
+    def take(self):
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RequestProfiler:
+    """
+    Decide which requests get profiled and write their profiles.
+
+    A sample_rate fraction of the requests is profiled from start to end. Every other request is profiled
+    once it has run for slow_seconds, and kept if it ends up at least that slow. At most max_per_minute
+    profiles a minute are written, per process.
+    """
+
+    def __init__(self, directory, sample_rate=0.0, slow_seconds=None, interval=0.005, max_per_minute=10):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.sampler = Sampler(interval)
+        self.limiter = RateLimiter(max_per_minute)
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start profiling the current thread's request if it may be profiled, return the profile or None
+        """
+        # Nothing is sampled while no profile could be written anyway
+        if not self.limiter.available():
+            return None
+
+        start = time.perf_counter()
+        if self.sample_rate and random.random() < self.sample_rate:
+            sample_from = start
+        elif self.slow_seconds is not None:
+            sample_from = start + self.slow_seconds
+        else:
+            return None
+
+        profile = Profile(threading.get_ident(), start, sample_from)
+        self.sampler.start(profile)
+        return profile
+
+    def finish(self, profile, route, method):
+        """
+        Stop a profile, and write it if it has samples. Returns the path written or None.
+        """
+        self.sampler.stop(profile)
+        duration = time.perf_counter() - profile.started
+        if not profile.stacks or not self.limiter.take():
+            return None
+
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        directory = os.path.join(self.directory, UNSAFE_NAME.sub('_', route.replace(':', '.')))
+        os.makedirs(directory, exist_ok=True)
+        name = f'{method}-{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}-{sequence}-{duration * 1000:.0f}ms.folded'
+        path = os.path.join(directory, name)
+        write_collapsed(path, profile.stacks)
+
+        return path
+
+
+def write_collapsed(path, stacks):
+    """
+    Write stack counts in the collapsed format, through a temporary file so readers never see half of it
+    """
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        for stack, count in sorted(stacks.items(), key=lambda item: item[1], reverse=True):
+            file.write(f'{stack} {count}\n')
+    os.replace(tmp_path, path)
+
+
+def read_collapsed(path):
+    """
+    Return the stack counts of a collapsed file
+    """
+    stacks = Counter()
+    with open(path) as file:
+        for line in file:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+
+    return stacks
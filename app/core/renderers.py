@@ -0,0 +1,52 @@
+"""
+JSON rendering through orjson when it is installed, DRF's json based renderer otherwise.
+
+orjson writes the bytes directly in one pass, where json.dumps builds a str that is then searched for
+U+2028/U+2029 and encoded. Everything orjson can't write the way DRF would falls back to DRF's renderer,
+so both give the same bytes for the same data, NaN and infinite floats aside (see JSONRenderer).
+"""
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer as BaseJSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Escaped by DRF so the output is also valid JavaScript
+LINE_SEPARATORS = ('\u2028'.encode(), b'\\u2028'), ('\u2029'.encode(), b'\\u2029')
+
+
+class JSONRenderer(BaseJSONRenderer):
+    """
+    DRF's JSONRenderer, writing compact UTF-8 output with orjson when it can.
+
+    Types orjson doesn't know, like Decimal, lazy strings or querysets, go through DRF's JSONEncoder.default,
+    and datetimes too since orjson formats them differently. The only difference left: NaN and infinite
+    floats come out as null instead of failing like with STRICT_JSON. Spotting them would take a walk over
+    the whole data in Python, which is the cost orjson is here to avoid, and the API has no float fields.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=JSONEncoder().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+        except orjson.JSONEncodeError:
+            # e.g. integers over 64 bits or types the default can't handle either, DRF reports those its own way
+            return super().render(data, accepted_media_type, renderer_context)
+
+        for separator, escaped in LINE_SEPARATORS:
+            if separator in ret:
+                ret = ret.replace(separator, escaped)
+
+        return ret
@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, When, Value, IntegerField, Q
+from django.db.models.expressions import RawSQL
+
+from core.models import Tag, Ingredient, Recipe
+
+
+def _related_names_sql(model, relation, concat):
+    """
+    SQL subquery returning the names of the tags or ingredients of the recipe on the current row
+    """
+    through = getattr(Recipe, relation).through
+    column = through._meta.get_field(model._meta.model_name).column
+    return (
+        f'COALESCE((SELECT {concat} FROM {model._meta.db_table} r '
+        f'JOIN {through._meta.db_table} t ON t.{column} = r.id '
+        f'WHERE t.recipe_id = {Recipe._meta.db_table}.id), \'\')'
+    )
+
+
+def update_search_documents(recipe_ids=None):
+    """
+    Rebuild the search document of the given recipes, or of every recipe, with one UPDATE
+    """
+    if recipe_ids is not None:
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+
+    table = Recipe._meta.db_table
+    if connection.vendor == 'postgresql':
+        # The title weighs more than the names of the tags and ingredients when ranking
+        config = settings.RECIPE_SEARCH_CONFIG
+        sql = (
+            f'UPDATE {table} SET search_document = '
+            f"setweight(to_tsvector(%s::regconfig, title), 'A') || "
+            f"setweight(to_tsvector(%s::regconfig, {_related_names_sql(Tag, 'tags', 'string_agg(r.name, %s)')}), 'B') || "
+            f"setweight(to_tsvector(%s::regconfig, {_related_names_sql(Ingredient, 'ingredients', 'string_agg(r.name, %s)')}), 'B')"
+        )
+        params = [config, config, ' ', config, ' ']
+        if recipe_ids is not None:
+            sql += ' WHERE id = ANY(%s)'
+            params.append(recipe_ids)
+    else:
+        # Everywhere else the document is the lowercased text, matched with LIKE
+        sql = (
+            f'UPDATE {table} SET search_document = LOWER(title || %s || '
+            f"{_related_names_sql(Tag, 'tags', 'GROUP_CONCAT(r.name, %s)')} || %s || "
+            f"{_related_names_sql(Ingredient, 'ingredients', 'GROUP_CONCAT(r.name, %s)')})"
+        )
+        params = [' ', ' ', ' ', ' ']
+        if recipe_ids is not None:
+            sql += f' WHERE id IN ({", ".join(["%s"] * len(recipe_ids))})'
+            params.extend(recipe_ids)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def search_recipes(queryset, query):
+    """
+    Filter recipes matching the search query and order them by relevance
+    """
+    if connection.vendor == 'postgresql':
+        config = settings.RECIPE_SEARCH_CONFIG
+        document = f'{Recipe._meta.db_table}.search_document'
+        # The @@ match goes through the GIN index, ts_rank only scores the rows that matched
+        return queryset.extra(
+            where=[f'{document} @@ websearch_to_tsquery(%s::regconfig, %s)'],
+            params=[config, query],
+        ).annotate(
+            rank=RawSQL(f'ts_rank({document}, websearch_to_tsquery(%s::regconfig, %s))', (config, query))
+        ).order_by('-rank', '-id')
+
+    terms = query.lower().split()
+    if not terms:
+        return queryset.none()
+    # Without a real ranking function, recipes whose title has every term come first
+    title_match = Q()
+    for term in terms:
+        queryset = queryset.filter(search_document__contains=term)
+        title_match &= Q(title__icontains=term)
+
+    return queryset.annotate(
+        rank=Case(When(title_match, then=Value(1)), default=Value(0), output_field=IntegerField())
+    ).order_by('-rank', '-id')
@@ -0,0 +1,97 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from core.authentication import token_cache
+from core.models import Tag, Ingredient, Recipe
+from core.search import update_search_documents
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """
+    Stop accepting a deleted token straight away
+    """
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def user_changed(sender, instance, **kwargs):
+    """
+    Forget the cached tokens of a user that changed, e.g. deactivated or with a new password
+    """
+    token_cache.delete_user(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, update_fields=None, **kwargs):
+    """
+    Rebuild the search document when the title of a recipe may have changed
+    """
+    if update_fields is None or 'title' in update_fields:
+        update_search_documents([instance.pk])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_related_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Rebuild the search documents of the recipes whose tags or ingredients changed
+    """
+    if action == 'pre_clear' and reverse:
+        # Clearing from the tag side doesn't say which recipes lose the tag, so remember them first
+        instance._cleared_recipe_ids = list(
+            sender.objects.filter(**{sender_column(sender, instance): instance.pk}).values_list('recipe_id', flat=True)
+        )
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            update_search_documents([instance.pk])
+        elif action == 'post_clear':
+            update_search_documents(getattr(instance, '_cleared_recipe_ids', []))
+        else:
+            update_search_documents(pk_set)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def related_renamed(sender, instance, created, **kwargs):
+    """
+    Rebuild the search documents of the recipes using a renamed tag or ingredient
+    """
+    if not created:
+        update_search_documents(linked_recipe_ids(sender, instance))
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def related_deleting(sender, instance, **kwargs):
+    """
+    Remember the recipes of a tag or ingredient before the delete cascades to the through table
+    """
+    instance._linked_recipe_ids = linked_recipe_ids(sender, instance)
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def related_deleted(sender, instance, **kwargs):
+    update_search_documents(getattr(instance, '_linked_recipe_ids', []))
+
+
+def sender_column(through, instance):
+    """
+    Return the through table column pointing at the tag or ingredient
+    """
+    return through._meta.get_field(instance._meta.model_name).attname
+
+
+def linked_recipe_ids(model, instance):
+    """
+    Return the ids of the recipes using a tag or ingredient
+    """
+    through = Recipe.tags.through if model is Tag else Recipe.ingredients.through
+    return list(
+        through.objects.filter(**{sender_column(through, instance): instance.pk}).values_list('recipe_id', flat=True)
+    )
@@ -0,0 +1,64 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+# Where recipe images and their variants live, next to the older uuid named ones
+RECIPE_IMAGE_DIR = 'uploads/recipe'
+
+
+def content_name(data, ext, directory=RECIPE_IMAGE_DIR):
+    """
+    Return the storage name of some bytes, derived from their SHA-256 so identical files get the same name
+    """
+    return f'{directory}/{hashlib.sha256(data).hexdigest()}.{ext}'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage for names derived from the file content.
+    Saving a name that already exists keeps the one file instead of writing a copy.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The same name means the same content, there is no clash to avoid
+        return name
+
+    def touch(self, name):
+        """
+        Refresh the modification time of a file so the garbage collector's grace period starts over.
+        Returns whether the file exists.
+        """
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        if self.touch(name):
+            return name
+
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # Write under a temporary name and rename it into place, so nobody ever sees half a file.
+        # Two workers saving the same content at once just replace one identical file with another.
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in content.chunks():
+                    tmp.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        return name
+
+
+image_storage = ContentAddressedStorage()
@@ -0,0 +1,160 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.authentication import CachedTokenAuthentication, TokenCache
+
+ME_URL = reverse('user:me')
+
+
+class CachedTokenAuthenticationTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@amadora.com',
+            'testpass'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def token_queries(self):
+        """
+        Make a request and return the queries it ran against the token table
+        """
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        return [q for q in queries if 'authtoken_token' in q['sql']]
+
+    def test_warm_token_skips_query(self):
+        """
+        Test that only the first request with a token looks it up
+        """
+        self.assertEqual(len(self.token_queries()), 1)
+        self.assertEqual(len(self.token_queries()), 0)
+
+    def test_deleted_token_rejected(self):
+        """
+        Test that a deleted token stops working even when it was cached
+        """
+        self.client.get(ME_URL)
+        self.token.delete()
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_rejected(self):
+        """
+        Test that deactivating a user evicts their cached tokens
+        """
+        self.client.get(ME_URL)
+        self.user.is_active = False
+        self.user.save()
+
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_reloads_user(self):
+        """
+        Test that changing the password through the API evicts the cached user
+        """
+        self.client.get(ME_URL)
+        self.client.patch(ME_URL, {'password': 'newpassword'})
+
+        self.assertEqual(len(self.token_queries()), 1)
+
+    def test_cached_user_not_shared(self):
+        """
+        Test that each request gets its own copy of the cached user
+        """
+        auth = CachedTokenAuthentication()
+        first, _ = auth.authenticate_credentials(self.token.key)
+        first.name = 'Changed in place'
+
+        second, _ = auth.authenticate_credentials(self.token.key)
+
+        self.assertIsNot(first, second)
+        self.assertEqual(second.name, '')
+
+    def test_profile_update_keeps_changes_made_elsewhere(self):
+        """
+        Test that updating the profile through a warm cache doesn't write back a stale password or is_active
+        """
+        self.token_queries()
+        # As another process would: no signal reaches this process's cache
+        get_user_model().objects.filter(pk=self.user.pk).update(
+            password=make_password('changedpass'),
+            is_active=False
+        )
+
+        res = self.client.patch(ME_URL, {'name': 'New name'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'New name')
+        self.assertFalse(self.user.is_active)
+        self.assertTrue(self.user.check_password('changedpass'))
+        self.assertFalse(self.user.check_password('testpass'))
+
+
+class TokenCacheTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@amadora.com',
+            'testpass'
+        )
+
+    def test_least_recently_used_evicted(self):
+        """
+        Test that the cache drops the least recently used token when full
+        """
+        cache = TokenCache(max_size=2, ttl=60)
+        cache.set('a', self.user, None)
+        cache.set('b', self.user, None)
+        cache.get('a')
+        cache.set('c', self.user, None)
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+    @patch('core.authentication.time.monotonic')
+    def test_entries_expire(self, monotonic):
+        """
+        Test that tokens are looked up again after the TTL
+        """
+        monotonic.return_value = 100
+        cache = TokenCache(max_size=10, ttl=60)
+        cache.set('a', self.user, None)
+
+        monotonic.return_value = 159
+        self.assertIsNotNone(cache.get('a'))
+        monotonic.return_value = 161
+        self.assertIsNone(cache.get('a'))
+
+    def test_delete_user(self):
+        """
+        Test dropping every token of a user
+        """
+        cache = TokenCache(max_size=10, ttl=60)
+        cache.set('a', self.user, None)
+        cache.set('b', self.user, None)
+
+        cache.delete_user(self.user.pk)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
@@ -1,24 +1,154 @@
+import os
+from io import StringIO
 from unittest.mock import patch
 
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import OperationalError
 from django.test import TestCase
 
+from core.models import Recipe
+from core.storage import RECIPE_IMAGE_DIR, image_storage
+
 class CommandsTestCase(TestCase):
 
     def test_wait_for_db_ready(self):
         """Test waiting for db when db is available"""
-        
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
-            gi.return_value = True
-            call_command('wait_for_db')
-            self.assertEqual(gi.call_count, 1)
+
+        with patch('core.management.commands.wait_for_db.check_database') as check:
+            call_command('wait_for_db', stdout=StringIO())
+            self.assertEqual(check.call_count, 1)
 
     @patch('time.sleep', return_value=None)
     def test_wait_for_db(self, ts):
         """Test waiting for db"""
 
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
-            gi.side_effect = [OperationalError] * 5 + [True]
-            call_command('wait_for_db')
-            self.assertEqual(gi.call_count, 6)
\ No newline at end of file
+        with patch('core.management.commands.wait_for_db.check_database') as check:
+            check.side_effect = [OperationalError] * 5 + [None]
+            call_command('wait_for_db', stdout=StringIO())
+            self.assertEqual(check.call_count, 6)
+            self.assertEqual(ts.call_count, 5)
+
+    @patch('time.sleep', return_value=None)
+    def test_wait_for_db_backs_off(self, ts):
+        """Test that the waits grow exponentially up to the maximum delay"""
+
+        with patch('core.management.commands.wait_for_db.check_database') as check, \
+                patch('random.uniform', side_effect=lambda low, high: high):
+            check.side_effect = [OperationalError] * 6 + [None]
+            call_command('wait_for_db', '--initial-delay', '0.1', '--max-delay', '1', stdout=StringIO())
+
+        self.assertEqual([round(call.args[0], 2) for call in ts.call_args_list], [0.1, 0.2, 0.4, 0.8, 1.0, 1.0])
+
+    @patch('time.sleep', return_value=None)
+    def test_wait_for_db_deadline(self, ts):
+        """Test giving up once the deadline has passed"""
+
+        with patch('core.management.commands.wait_for_db.check_database', side_effect=OperationalError), \
+                patch('time.monotonic', side_effect=[0] + list(range(0, 1000, 10))):
+            with self.assertRaises(CommandError):
+                call_command('wait_for_db', '--timeout', '30', stdout=StringIO())
+
+    @patch('time.sleep', return_value=None)
+    def test_wait_for_db_migrations(self, ts):
+        """Test waiting for migrations to be applied"""
+
+        with patch('core.management.commands.wait_for_db.check_database'), \
+                patch('core.management.commands.wait_for_db.pending_migrations') as pending:
+            pending.side_effect = [['0001_initial'], []]
+            call_command('wait_for_db', '--check-migrations', stdout=StringIO())
+
+        self.assertEqual(pending.call_count, 2)
+
+    def test_wait_for_db_connects(self):
+        """Test that the test database really passes the check"""
+        call_command('wait_for_db', '--check-migrations', stdout=StringIO())
+
+
+class CollectImageGarbageTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('test@amadora.com', 'testpass')
+        self.recipe = Recipe.objects.create(user=user, title='Sample recipe', time_minutes=5, price=5.00)
+        self.files = []
+
+    def tearDown(self):
+        for name in self.files:
+            default_storage.delete(name)
+
+    def store(self, filename, age=2 * 60 * 60):
+        """Store a file in the recipe image directory, last touched age seconds ago"""
+        name = default_storage.save(f'{RECIPE_IMAGE_DIR}/{filename}', ContentFile(b'image'))
+        past = os.path.getmtime(default_storage.path(name)) - age
+        os.utime(default_storage.path(name), (past, past))
+        self.files.append(name)
+        return name
+
+    def test_collect_unused_files(self):
+        """Test that only files no recipe uses are deleted, variants going with their original"""
+        used = self.store('used.jpg')
+        used_variant = self.store('used_200w.webp')
+        orphan = self.store('orphan.jpg')
+        orphan_variant = self.store('orphan_200w.webp')
+        Recipe.objects.filter(pk=self.recipe.pk).update(image=used)
+
+        out = StringIO()
+        call_command('collect_image_garbage', '--batch-size', '2', stdout=out)
+
+        self.assertTrue(default_storage.exists(used))
+        self.assertTrue(default_storage.exists(used_variant))
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertFalse(default_storage.exists(orphan_variant))
+        self.assertIn('Deleted 2 unused image files', out.getvalue())
+
+    def test_recent_files_are_kept(self):
+        """Test that files within the grace period are left for the jobs that may be writing them"""
+        recent = self.store('recent.jpg', age=0)
+
+        call_command('collect_image_garbage', stdout=StringIO())
+
+        self.assertTrue(default_storage.exists(recent))
+
+    def test_file_taken_up_before_delete(self):
+        """Test that a file an upload takes up while it is being collected is kept"""
+        name = self.store('shared.jpg')
+        rename = os.rename
+
+        def upload_then_rename(source, destination):
+            # An upload of the same content reuses the file right after the collector found it unused
+            image_storage.save(name, ContentFile(b'image'))
+            Recipe.objects.filter(pk=self.recipe.pk).update(image=name)
+            rename(source, destination)
+
+        with patch('core.management.commands.collect_image_garbage.os.rename', side_effect=upload_then_rename):
+            call_command('collect_image_garbage', stdout=StringIO())
+
+        self.assertTrue(default_storage.exists(name))
+
+    def test_file_taken_up_after_move(self):
+        """Test that an upload finding the file already moved away stores it again"""
+        name = self.store('shared.jpg')
+        rename = os.rename
+
+        def rename_then_upload(source, destination):
+            rename(source, destination)
+            image_storage.save(name, ContentFile(b'image'))
+            Recipe.objects.filter(pk=self.recipe.pk).update(image=name)
+
+        with patch('core.management.commands.collect_image_garbage.os.rename', side_effect=rename_then_upload):
+            call_command('collect_image_garbage', stdout=StringIO())
+
+        self.assertTrue(default_storage.exists(name))
+
+    def test_dry_run(self):
+        """Test that a dry run deletes nothing"""
+        orphan = self.store('orphan.jpg')
+
+        out = StringIO()
+        call_command('collect_image_garbage', '--dry-run', stdout=out)
+
+        self.assertTrue(default_storage.exists(orphan))
+        self.assertIn('Would delete 1', out.getvalue())
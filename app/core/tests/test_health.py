@@ -0,0 +1,46 @@
+from unittest.mock import patch
+
+from django.db.utils import OperationalError
+from django.test import TestCase, override_settings
+
+
+class HealthCheckTests(TestCase):
+
+    def test_healthz(self):
+        """Test that the liveness probe answers without touching the database"""
+        with self.assertNumQueries(0):
+            res = self.client.get('/healthz')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), {'status': 'ok'})
+        self.assertEqual(res['Cache-Control'], 'no-store')
+
+    def test_healthz_skips_host_validation(self):
+        """Test that probes sent to the bare IP aren't rejected by ALLOWED_HOSTS"""
+        with override_settings(ALLOWED_HOSTS=['api.example.com']):
+            res = self.client.get('/healthz', HTTP_HOST='10.0.0.12')
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_readyz(self):
+        """Test that the readiness probe checks the database"""
+        res = self.client.get('/readyz')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['checks'], {'database': 'ok'})
+
+    @override_settings(READYZ_CHECK_MIGRATIONS=True)
+    def test_readyz_migrations(self):
+        """Test that the readiness probe can check the migrations too"""
+        res = self.client.get('/readyz')
+
+        self.assertEqual(res.json()['checks'], {'database': 'ok', 'migrations': 'ok'})
+
+    def test_readyz_database_down(self):
+        """Test that the readiness probe fails when the database is unreachable"""
+        with patch('core.middleware.check_database', side_effect=OperationalError('down')), \
+                self.assertLogs('core.middleware', 'WARNING'):
+            res = self.client.get('/readyz')
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.json()['checks'], {'database': 'unavailable'})
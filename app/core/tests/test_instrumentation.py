@@ -0,0 +1,121 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.test import APIClient
+
+from core import metrics
+from core.instrumentation import RequestMetrics, current_metrics
+from core.models import Recipe, Tag
+
+TAGS_URL = '/api/recipe/tags/'
+
+SERVER_TIMING = re.compile(
+    r'^db;dur=(?P<db>[\d.]+);desc="(?P<queries>\d+) queries", serializer;dur=(?P<serializer>[\d.]+), '
+    r'total;dur=(?P<total>[\d.]+)$'
+)
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class InstrumentationMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('test@amadora.com', 'testpass')
+        self.client.force_authenticate(self.user)
+        Tag.objects.create(user=self.user, name='Vegan')
+
+    def test_server_timing_header(self):
+        """Test that responses say how many queries they ran and where their time went"""
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(TAGS_URL)
+
+        timing = SERVER_TIMING.match(res['Server-Timing'])
+        self.assertIsNotNone(timing, res['Server-Timing'])
+        self.assertEqual(int(timing.group('queries')), len(queries))
+        self.assertGreater(float(timing.group('serializer')), 0)
+        self.assertGreaterEqual(float(timing.group('total')), float(timing.group('db')))
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_server_timing_header_disabled(self):
+        """Test that the timings can be kept out of the responses"""
+        res = self.client.get(TAGS_URL)
+
+        self.assertFalse(res.has_header('Server-Timing'))
+
+    def test_route_histograms(self):
+        """Test that requests are recorded per URL name, method and viewset action"""
+        labels = {'route': 'recipe:tag-list', 'method': 'GET', 'action': 'list'}
+        before = metrics.REQUEST_DURATION.value(**labels)['count']
+        requests_before = metrics.REQUESTS.value(status=200, **labels)
+
+        res = self.client.get(TAGS_URL)
+
+        self.assertEqual(metrics.REQUEST_DURATION.value(**labels)['count'], before + 1)
+        self.assertEqual(metrics.REQUESTS.value(status=200, **labels), requests_before + 1)
+        size = metrics.RESPONSE_SIZE.value(**labels)
+        self.assertGreaterEqual(size['sum'], len(res.content))
+
+    def test_unmatched_route(self):
+        """Test that unknown paths share one label instead of one per path"""
+        labels = {'route': 'unmatched', 'method': 'GET', 'action': '', 'status': 404}
+        before = metrics.REQUESTS.value(**labels)
+
+        self.client.get('/no/such/page/1234/')
+
+        self.assertEqual(metrics.REQUESTS.value(**labels), before + 1)
+
+    def test_health_probes_not_measured(self):
+        """Test that the probes, answered before the instrumentation, stay out of the metrics"""
+        res = self.client.get('/healthz')
+
+        self.assertFalse(res.has_header('Server-Timing'))
+
+    @override_settings(SLOW_REQUEST_MS=0.001, SLOW_REQUEST_TOP_QUERIES=2)
+    def test_slow_request_logged(self):
+        """Test that slow requests are logged with their slowest queries"""
+        Recipe.objects.create(user=self.user, title='Soup', time_minutes=10, price=5)
+        # The recipes and a prefetch each for their tags and ingredients
+        with self.assertLogs('core.middleware', 'WARNING') as logs:
+            self.client.get('/api/recipe/recipes/')
+
+        message = logs.output[0]
+        self.assertIn('Slow request GET /api/recipe/recipes/ (recipe:recipe-list) 200', message)
+        self.assertIn('3 queries', message)
+        self.assertEqual(message.count('\n  '), 2)
+        self.assertIn('SELECT', message)
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_request_log_disabled(self):
+        """Test that SLOW_REQUEST_MS=0 logs nothing"""
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('core.middleware', 'WARNING'):
+                self.client.get(TAGS_URL)
+
+    def test_queries_outside_requests(self):
+        """Test that queries outside of a request are left alone"""
+        self.assertIsNone(current_metrics())
+        self.assertEqual(Tag.objects.count(), 1)
+
+
+class RequestMetricsTests(TestCase):
+
+    def test_slowest_queries(self):
+        """Test that only the slowest queries are kept, slowest first"""
+        request_metrics = RequestMetrics(top_queries=2)
+        for duration, sql in ((0.1, 'a'), (0.3, 'b'), (0.2, 'c'), (0.05, 'd')):
+            request_metrics.record_query(sql, duration)
+
+        self.assertEqual(request_metrics.queries, 4)
+        self.assertAlmostEqual(request_metrics.db_time, 0.65)
+        self.assertEqual(request_metrics.slowest_queries(), [(0.3, 'b'), (0.2, 'c')])
+
+    def test_no_slowest_queries(self):
+        """Test that nothing is kept when the slow request log doesn't need it"""
+        request_metrics = RequestMetrics()
+        request_metrics.record_query('a', 0.1)
+
+        self.assertEqual(request_metrics.slowest_queries(), [])
@@ -0,0 +1,119 @@
+import hashlib
+import os
+import tempfile
+
+from django.http import Http404
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import resolve
+
+from core import media
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def media_url(path):
+    return f'/media/{path}'
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, MEDIA_CACHE_MAX_AGE=600, MEDIA_SENDFILE_BACKEND='')
+class MediaServingTests(TestCase):
+
+    def setUp(self):
+        self.content = bytes(range(256)) * 4
+        self.digest = hashlib.sha256(self.content).hexdigest()
+        self.names = []
+        self.hashed = self.write(f'{self.digest}.jpg')
+        self.plain = self.write('photo.jpg')
+
+    def tearDown(self):
+        for name in self.names:
+            os.remove(os.path.join(MEDIA_ROOT, name))
+
+    def write(self, name):
+        with open(os.path.join(MEDIA_ROOT, name), 'wb') as file:
+            file.write(self.content)
+        self.names.append(name)
+        return name
+
+    def serve(self, name, **headers):
+        """Call the view directly, the URL pattern was built from the real MEDIA_ROOT at import time"""
+        request = RequestFactory().get(media_url(name), **headers)
+        return media.serve(request, name, document_root=MEDIA_ROOT, sendfile=True)
+
+    def test_serve_file(self):
+        """Test serving a whole file with its validators"""
+        res = self.serve(self.plain)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), self.content)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['Cache-Control'], 'public, max-age=600')
+        self.assertEqual(res['Accept-Ranges'], 'bytes')
+        self.assertTrue(res['ETag'].startswith('"'))
+
+    def test_content_addressed_file_is_immutable(self):
+        """Test that files named after their hash are cached forever and tagged with the hash"""
+        res = self.serve(self.hashed)
+
+        self.assertEqual(res['ETag'], f'"{self.digest}"')
+        self.assertEqual(res['Cache-Control'], media.IMMUTABLE_CACHE_CONTROL)
+        res.close()
+
+    def test_if_none_match(self):
+        """Test that a matching ETag gets a 304 without the file"""
+        res = self.serve(self.hashed, HTTP_IF_NONE_MATCH=f'"{self.digest}"')
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res['ETag'], f'"{self.digest}"')
+
+    def test_range(self):
+        """Test that a byte range is answered with just those bytes"""
+        res = self.serve(self.plain, HTTP_RANGE='bytes=10-19')
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(b''.join(res.streaming_content), self.content[10:20])
+        self.assertEqual(res['Content-Length'], '10')
+        self.assertEqual(res['Content-Range'], f'bytes 10-19/{len(self.content)}')
+
+    def test_suffix_and_open_ranges(self):
+        """Test the last-n-bytes and until-the-end forms of a range"""
+        res = self.serve(self.plain, HTTP_RANGE='bytes=-24')
+        self.assertEqual(b''.join(res.streaming_content), self.content[-24:])
+
+        res = self.serve(self.plain, HTTP_RANGE='bytes=1000-')
+        self.assertEqual(b''.join(res.streaming_content), self.content[1000:])
+
+    def test_unsatisfiable_range(self):
+        """Test that a range past the end of the file gets a 416"""
+        res = self.serve(self.plain, HTTP_RANGE=f'bytes={len(self.content)}-')
+
+        self.assertEqual(res.status_code, 416)
+        self.assertEqual(res['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_if_range_mismatch(self):
+        """Test that the whole file is sent when it changed since the client got its start"""
+        res = self.serve(self.plain, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+
+        self.assertEqual(res.status_code, 200)
+        res.close()
+
+    def test_path_traversal(self):
+        """Test that files outside the media root can't be reached"""
+        with self.assertRaises(Http404):
+            self.serve('../../etc/passwd')
+
+    def test_sendfile_backend(self):
+        """Test handing the file to nginx instead of streaming it"""
+        with self.settings(MEDIA_SENDFILE_BACKEND='x-accel-redirect', MEDIA_SENDFILE_PREFIX='/protected/'):
+            res = self.serve(self.hashed)
+
+        self.assertEqual(res['X-Accel-Redirect'], f'/protected/{self.hashed}')
+        self.assertEqual(res.content, b'')
+
+    def test_media_url_routed(self):
+        """Test that MEDIA_URL is routed to the view, outside of DEBUG too"""
+        match = resolve(media_url('uploads/recipe/photo.jpg'))
+
+        self.assertEqual(match.func, media.serve)
+        self.assertEqual(match.kwargs['path'], 'uploads/recipe/photo.jpg')
+        self.assertTrue(match.kwargs['sendfile'])
@@ -0,0 +1,177 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from rest_framework.test import APIClient
+
+from core import metrics
+from core.models import Tag
+
+METRICS_URL = '/metrics'
+
+
+class MetricsEndpointTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('test@amadora.com', 'testpass')
+        self.client.force_authenticate(self.user)
+        Tag.objects.create(user=self.user, name='Vegan')
+
+    def test_exposition(self):
+        """Test that the metrics are served in the Prometheus text format"""
+        self.client.get('/api/recipe/tags/')
+
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], metrics.CONTENT_TYPE)
+        text = res.content.decode()
+        self.assertIn('# TYPE http_requests_total counter\n', text)
+        self.assertIn(
+            'http_requests_total{route="recipe:tag-list",method="GET",action="list",status="200"} ', text
+        )
+        self.assertIn(
+            'http_request_duration_seconds_bucket{route="recipe:tag-list",method="GET",action="list",le="+Inf"} ', text
+        )
+        self.assertIn('# TYPE db_queries_total counter\n', text)
+        self.assertIn('db_queries_total{alias="default"} ', text)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_token_required(self):
+        """Test that scrapers must send the token when one is set"""
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, 401)
+
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(res.status_code, 200)
+
+    @override_settings(API_CACHE_TIMEOUT=300)
+    def test_cache_hits_and_misses(self):
+        """Test that the response cache lookups are counted by result"""
+        caches[settings.API_CACHE_ALIAS].clear()
+        hits = metrics.CACHE_REQUESTS.value(cache='api', result='hit')
+        misses = metrics.CACHE_REQUESTS.value(cache='api', result='miss')
+
+        self.client.get('/api/recipe/tags/')
+        self.client.get('/api/recipe/tags/')
+
+        self.assertEqual(metrics.CACHE_REQUESTS.value(cache='api', result='miss'), misses + 1)
+        self.assertEqual(metrics.CACHE_REQUESTS.value(cache='api', result='hit'), hits + 1)
+
+
+class MetricTests(TestCase):
+
+    def setUp(self):
+        self.counter = metrics.Counter('test_events_total', 'Events', ('kind',))
+        self.histogram = metrics.Histogram('test_values', 'Values', ('kind',), buckets=(1, 5))
+        self.addCleanup(metrics.REGISTRY.remove, self.counter)
+        self.addCleanup(metrics.REGISTRY.remove, self.histogram)
+
+    def test_histogram(self):
+        """Test that values land in cumulative buckets"""
+        for value in (0.5, 1, 3, 10):
+            self.histogram.observe(value, kind='a')
+
+        self.assertEqual(self.histogram.value(kind='a'), {
+            'buckets': {1: 2, 5: 3, float('inf'): 4},
+            'count': 4,
+            'sum': 14.5,
+        })
+        self.assertEqual(self.histogram.value(kind='b')['count'], 0)
+
+    def test_exposition_format(self):
+        """Test the text format of counters and histograms, label values escaped"""
+        self.counter.inc(2, kind='say "hi"\n')
+        self.histogram.observe(3, kind='a')
+
+        text = metrics.exposition()
+
+        self.assertIn('# HELP test_events_total Events\n# TYPE test_events_total counter\n', text)
+        self.assertIn('test_events_total{kind="say \\"hi\\"\\n"} 2\n', text)
+        self.assertIn(
+            'test_values_bucket{kind="a",le="1.0"} 0\n'
+            'test_values_bucket{kind="a",le="5.0"} 1\n'
+            'test_values_bucket{kind="a",le="+Inf"} 1\n'
+            'test_values_sum{kind="a"} 3.0\n'
+            'test_values_count{kind="a"} 1\n',
+            text
+        )
+
+
+class MultiProcessStoreTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = metrics.MultiProcessStore(self.directory)
+        self.counter = metrics.Counter('test_events_total', 'Events', ('kind',))
+        self.histogram = metrics.Histogram('test_values', 'Values', ('kind',), buckets=(1, 5))
+        self.addCleanup(metrics.REGISTRY.remove, self.counter)
+        self.addCleanup(metrics.REGISTRY.remove, self.histogram)
+        patcher = patch.object(metrics, 'STORE', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_values_of_all_processes(self):
+        """Test that a scrape adds up the values every worker process recorded"""
+        self.counter.inc(kind='a')
+        self.histogram.observe(3, kind='a')
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                # The child starts from zero and records into a file of its own
+                self.counter.inc(kind='a')
+                self.counter.inc(kind='b')
+                self.histogram.observe(0.5, kind='a')
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        values = metrics.collect_values()
+        self.assertEqual(values['test_events_total'], {('a',): [2], ('b',): [1]})
+        self.assertEqual(values['test_values'], {('a',): [1, 1, 0, 3.5]})
+        # The child exited, its file was folded into the archive
+        self.assertEqual(sorted(os.listdir(self.directory)), ['archive.db', 'lock', f'metrics_{os.getpid()}.db'])
+
+        self.counter.inc(kind='a')
+        self.assertEqual(metrics.collect_values()['test_events_total'][('a',)], [3])
+
+    def test_mark_process_dead(self):
+        """Test that the values of exited processes are kept in the archive"""
+        dead_pid = 2 ** 30
+        for pid, value in ((dead_pid, 2), (dead_pid + 1, 3)):
+            values = metrics.MmapValues(os.path.join(self.directory, f'metrics_{pid}.db'))
+            values.write('["test_events_total", ["a"], 0]', value)
+            values.close()
+            self.store.mark_process_dead(pid)
+
+        self.assertEqual(
+            metrics.MmapValues.read(os.path.join(self.directory, 'archive.db')),
+            {'["test_events_total", ["a"], 0]': 5}
+        )
+        self.assertEqual(metrics.collect_values()['test_events_total'], {('a',): [5]})
+
+
+class MmapValuesTests(TestCase):
+
+    def test_grow(self):
+        """Test that the file grows past its initial size and reads back after reopening"""
+        path = os.path.join(tempfile.mkdtemp(), 'values.db')
+        values = metrics.MmapValues(path)
+        for i in range(5000):
+            values.write(f'key {i}', i / 2)
+        values.write('key 0', 42)
+        values.close()
+
+        self.assertGreater(os.path.getsize(path), metrics.MmapValues.INITIAL_SIZE)
+        reopened = metrics.MmapValues(path)
+        self.assertEqual(reopened.get('key 4999'), 2499.5)
+        self.assertEqual(reopened.get('key 0'), 42)
+        reopened.close()
+        self.assertEqual(len(metrics.MmapValues.read(path)), 5000)
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync
+from django.http import JsonResponse
+from django.test import AsyncClient, SimpleTestCase, override_settings
+from django.urls import path
+
+# How long the view below takes, long enough that requests queueing behind each other can't go unnoticed
+SLEEP = 0.5
+
+
+async def sleep_view(request):
+    await asyncio.sleep(SLEEP)
+    return JsonResponse({'slept': SLEEP})
+
+
+urlpatterns = [
+    path('sleep/', sleep_view),
+]
+
+
+@override_settings(
+    ROOT_URLCONF=__name__, INSTRUMENTATION=True, PROFILING=True, SERVER_TIMING_HEADER=True, SLOW_REQUEST_MS=0
+)
+class AsyncMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        self.client = AsyncClient()
+
+    def get_concurrently(self, path, count):
+        async def get_all():
+            return await asyncio.gather(*(self.client.get(path) for _ in range(count)))
+
+        return async_to_sync(get_all)()
+
+    def test_requests_run_concurrently(self):
+        """Test that under ASGI the middleware doesn't make requests wait for each other"""
+        start = time.perf_counter()
+        responses = self.get_concurrently('/sleep/', 4)
+        duration = time.perf_counter() - start
+
+        self.assertEqual([res.status_code for res in responses], [200] * 4)
+        self.assertLess(duration, SLEEP * 3)
+
+    def test_server_timing_header(self):
+        """Test that async requests are measured too"""
+        res = self.get_concurrently('/sleep/', 1)[0]
+
+        self.assertIn('total;dur=', res['Server-Timing'])
+
+    def test_health_check(self):
+        """Test that the probes are answered under ASGI"""
+        res = self.get_concurrently('/healthz', 1)[0]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Cache-Control'], 'no-store')
@@ -0,0 +1,35 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+class SearchDocumentMigrationTests(TransactionTestCase):
+
+    before = [('core', '0009_recipe_through_indexes')]
+    after = [('core', '0010_recipe_search_document')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_build_search_documents(self):
+        """Test that the migration fills in the search documents of the existing recipes"""
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        user = apps.get_model('core', 'User').objects.create(email='test@amadora.com', password='x')
+        recipe = apps.get_model('core', 'Recipe').objects.create(user=user, title='Soup', time_minutes=5, price=1)
+        recipe.tags.add(apps.get_model('core', 'Tag').objects.create(user=user, name='Vegan'))
+        recipe.ingredients.add(apps.get_model('core', 'Ingredient').objects.create(user=user, name='Salt'))
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+
+        apps = executor.loader.project_state(self.after).apps
+        document = apps.get_model('core', 'Recipe').objects.get(pk=recipe.pk).search_document
+        if connection.vendor == 'postgresql':
+            for lexeme in ("'soup':1A", "'vegan'", "'salt'"):
+                self.assertIn(lexeme, document)
+        else:
+            self.assertEqual(document, 'soup vegan salt')
@@ -70,6 +70,34 @@ class ModelTests(TestCase):
 
         self.assertEqual(str(ingredient), ingredient.name)
 
+    def test_get_or_create_tags_by_names(self):
+        """
+        Test that missing tag names are created and existing ones are reused
+        """
+        user = sample_user()
+        existing = models.Tag.objects.create(user=user, name='Vegan')
+
+        tags = models.Tag.objects.get_or_create_by_names(user, ['Vegan', 'Dessert', 'Dessert'])
+
+        self.assertEqual(tags['Vegan'], existing)
+        self.assertEqual(tags['Dessert'].name, 'Dessert')
+        self.assertEqual(models.Tag.objects.filter(user=user).count(), 2)
+
+    def test_get_or_create_by_names_scoped_to_user(self):
+        """
+        Test that another user's ingredient with the same name is not reused
+        """
+        user = sample_user()
+        other = models.Ingredient.objects.create(
+            user=sample_user('other@amadora.com'),
+            name='Lemon'
+        )
+
+        ingredients = models.Ingredient.objects.get_or_create_by_names(user, ['Lemon'])
+
+        self.assertNotEqual(ingredients['Lemon'], other)
+        self.assertEqual(ingredients['Lemon'].user, user)
+
     def test_recipe_str(self):
         """
         Test the recipe string representation
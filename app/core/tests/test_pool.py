@@ -0,0 +1,160 @@
+import threading
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from core.db.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.opened = []
+
+    def connect(self):
+        connection = FakeConnection()
+        self.opened.append(connection)
+        return connection
+
+    def test_reuses_released_connections(self):
+        """Test that a released connection is handed out again instead of opening a new one"""
+        pool = ConnectionPool(self.connect, max_size=2)
+
+        first = pool.acquire()
+        pool.release(first)
+        second = pool.acquire()
+
+        self.assertIs(first, second)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_waits_for_free_connection(self):
+        """Test that acquiring from a full pool waits until a connection comes back"""
+        pool = ConnectionPool(self.connect, max_size=1, timeout=5)
+        first = pool.acquire()
+        acquired = []
+
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+        waiter.start()
+        pool.release(first)
+        waiter.join(5)
+
+        self.assertEqual(acquired, [first])
+        self.assertEqual(len(self.opened), 1)
+
+    def test_timeout(self):
+        """Test that acquiring from a full pool gives up after the timeout"""
+        pool = ConnectionPool(self.connect, max_size=1, timeout=0.01)
+        pool.acquire()
+
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+
+    def test_discard(self):
+        """Test that a discarded connection is closed and frees its slot"""
+        pool = ConnectionPool(self.connect, max_size=1, timeout=0.01)
+        first = pool.acquire()
+
+        pool.release(first, discard=True)
+        second = pool.acquire()
+
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+
+    def test_failed_check_replaces_connection(self):
+        """Test that an idle connection failing its health check is replaced"""
+        pool = ConnectionPool(self.connect, max_size=1, check=lambda connection: False)
+        first = pool.acquire()
+        pool.release(first)
+
+        second = pool.acquire()
+
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.size, 1)
+
+    def test_check_runs_outside_lock(self):
+        """Test that other threads get connections while an idle one is being checked"""
+        checking, done = threading.Event(), threading.Event()
+
+        def slow_check(connection):
+            checking.set()
+            done.wait(5)
+            return True
+        pool = ConnectionPool(self.connect, max_size=2, check=slow_check)
+        first = pool.acquire()
+        pool.release(first)
+        checker = threading.Thread(target=pool.acquire)
+        checker.start()
+        checking.wait(5)
+
+        acquired = []
+        other = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+        other.start()
+        other.join(1)
+        acquired_while_checking = list(acquired)
+        done.set()
+        checker.join(5)
+        other.join(5)
+
+        self.assertEqual(len(acquired_while_checking), 1)
+        self.assertIsNot(acquired_while_checking[0], first)
+        self.assertEqual(pool.size, 2)
+
+    def test_check_error_frees_slot(self):
+        """Test that a health check raising closes the connection and gives its slot back"""
+        def check(connection):
+            raise RuntimeError('interrupted')
+        pool = ConnectionPool(self.connect, max_size=1, check=check)
+        first = pool.acquire()
+        pool.release(first)
+
+        with self.assertRaises(RuntimeError):
+            pool.acquire()
+
+        self.assertTrue(first.closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_max_lifetime(self):
+        """Test that connections past their lifetime are closed instead of reused"""
+        pool = ConnectionPool(self.connect, max_size=1, max_lifetime=60)
+        with patch('core.db.pool.time.monotonic', return_value=1000):
+            first = pool.acquire()
+            pool.release(first)
+        with patch('core.db.pool.time.monotonic', return_value=1061):
+            second = pool.acquire()
+
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+
+    def test_connect_failure_frees_slot(self):
+        """Test that a failed connection attempt doesn't use up the pool"""
+        def connect():
+            raise OSError('refused')
+        pool = ConnectionPool(connect, max_size=1, timeout=0.01)
+
+        for _ in range(3):
+            with self.assertRaises(OSError):
+                pool.acquire()
+        self.assertEqual(pool.size, 0)
+
+    def test_close(self):
+        """Test that closing the pool closes idle connections now and busy ones on release"""
+        pool = ConnectionPool(self.connect, max_size=2)
+        idle, busy = pool.acquire(), pool.acquire()
+        pool.release(idle)
+
+        pool.close()
+        self.assertTrue(idle.closed)
+        self.assertFalse(busy.closed)
+        pool.release(busy)
+        self.assertTrue(busy.closed)
+        self.assertEqual(pool.size, 0)
@@ -0,0 +1,142 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from rest_framework.test import APIClient
+
+from core.profiling import RateLimiter, RequestProfiler, collapse, read_collapsed, write_collapsed
+from recipe.views import TagViewSet
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def slow_get_queryset(original):
+    def get_queryset(self):
+        busy(0.1)
+        return original(self)
+    return get_queryset
+
+
+class ProfilerTests(TestCase):
+
+    def test_collapse(self):
+        """Test that a stack collapses to module:function frames, outermost first"""
+        def inner():
+            return collapse(sys._getframe())
+
+        stack = inner()
+
+        self.assertTrue(stack.endswith(
+            'core.tests.test_profiling:ProfilerTests.test_collapse;'
+            'core.tests.test_profiling:ProfilerTests.test_collapse.<locals>.inner'
+        ), stack)
+
+    def test_sampled_request(self):
+        """Test that a sampled request gets a profile of where it spent its time"""
+        directory = tempfile.mkdtemp()
+        profiler = RequestProfiler(directory, sample_rate=1.0, interval=0.001)
+
+        profile = profiler.start()
+        busy(0.1)
+        path = profiler.finish(profile, 'recipe:recipe-list', 'GET')
+
+        self.assertEqual(os.path.dirname(path), os.path.join(directory, 'recipe.recipe-list'))
+        stacks = read_collapsed(path)
+        self.assertTrue(any('core.tests.test_profiling:busy' in stack for stack in stacks))
+        self.assertGreater(sum(stacks.values()), 10)
+
+    def test_slow_threshold(self):
+        """Test that requests are only sampled once they run past the threshold"""
+        profiler = RequestProfiler(tempfile.mkdtemp(), slow_seconds=0.2, interval=0.001)
+
+        profile = profiler.start()
+        busy(0.05)
+
+        self.assertIsNone(profiler.finish(profile, 'recipe:tag-list', 'GET'))
+
+    def test_other_threads_not_sampled(self):
+        """Test that only the thread of the profiled request is sampled"""
+        profiler = RequestProfiler(tempfile.mkdtemp(), sample_rate=1.0, interval=0.001)
+        other = threading.Thread(target=busy, args=(0.1,))
+
+        profile = profiler.start()
+        other.start()
+        other.join()
+        path = profiler.finish(profile, 'recipe:tag-list', 'GET')
+
+        self.assertFalse(any('busy' in stack for stack in read_collapsed(path)))
+
+    def test_rate_limit(self):
+        """Test that no more profiles than the limit are written"""
+        limiter = RateLimiter(2)
+
+        self.assertEqual([limiter.take() for _ in range(3)], [True, True, False])
+        self.assertFalse(limiter.available())
+
+
+class ProfilingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user('test@amadora.com', 'testpass'))
+
+    def test_slow_requests_profiled(self):
+        """Test that slow requests are profiled per route, within the rate limit"""
+        with override_settings(
+            PROFILING=True, PROFILE_DIR=self.directory, PROFILE_SAMPLE_RATE=0, PROFILE_SLOW_MS=20,
+            PROFILE_INTERVAL_MS=1, PROFILE_MAX_PER_MINUTE=1
+        ), patch.object(TagViewSet, 'get_queryset', slow_get_queryset(TagViewSet.get_queryset)):
+            self.client.get('/api/recipe/tags/')
+            self.client.get('/api/recipe/tags/')
+
+        files = os.listdir(os.path.join(self.directory, 'recipe.tag-list'))
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith('GET-'))
+        stacks = read_collapsed(os.path.join(self.directory, 'recipe.tag-list', files[0]))
+        self.assertTrue(any('core.tests.test_profiling:busy' in stack for stack in stacks))
+
+    def test_disabled(self):
+        """Test that nothing is profiled unless PROFILING is on"""
+        with override_settings(PROFILE_DIR=self.directory, PROFILE_SAMPLE_RATE=1):
+            self.client.get('/api/recipe/tags/')
+
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class AggregateProfilesCommandTests(TestCase):
+
+    def test_aggregate(self):
+        """Test that the profiles of each route are merged and summarized"""
+        directory = tempfile.mkdtemp()
+        output = tempfile.mkdtemp()
+        os.makedirs(os.path.join(directory, 'recipe.recipe-list'))
+        os.makedirs(os.path.join(directory, 'user.token'))
+        write_collapsed(os.path.join(directory, 'recipe.recipe-list', 'GET-1.folded'), {'a;b;c': 3, 'a;b': 1})
+        write_collapsed(os.path.join(directory, 'recipe.recipe-list', 'GET-2.folded'), {'a;b;c': 2, 'a;d': 4})
+        write_collapsed(os.path.join(directory, 'user.token', 'POST-1.folded'), {'a;hash': 5})
+        out = StringIO()
+
+        call_command('aggregate_profiles', dir=directory, output=output, route=['recipe:recipe-list'], stdout=out)
+
+        self.assertEqual(os.listdir(output), ['recipe.recipe-list.folded'])
+        self.assertEqual(
+            read_collapsed(os.path.join(output, 'recipe.recipe-list.folded')),
+            {'a;b;c': 5, 'a;b': 1, 'a;d': 4}
+        )
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'recipe.recipe-list: 2 profiles, 10 samples')
+        self.assertEqual(lines[1].split(), ['50.0%', 'self', '50.0%', 'total', 'c'])
+        self.assertEqual(lines[2].split(), ['40.0%', 'self', '40.0%', 'total', 'd'])
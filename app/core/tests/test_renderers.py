@@ -0,0 +1,135 @@
+import datetime
+import decimal
+import uuid
+from collections import OrderedDict
+from io import BytesIO
+from unittest import skipIf
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.test import APIClient
+
+from core import renderers as core_renderers
+from core.models import Recipe, Tag
+from core.parsers import JSONParser
+from core.renderers import JSONRenderer
+from user.views import CreateTokenView
+
+SAMPLE = OrderedDict([
+    ('id', 1),
+    ('title', 'Crème brûlée   "quoted" \\ \n\t'),
+    ('price', decimal.Decimal('5.50')),
+    ('rating', 4.25),
+    ('tags', [1, 2, 3]),
+    ('nested', {'empty': [], 'none': None, 'flag': True, 3: 'int key'}),
+    ('uuid', uuid.UUID('12345678-1234-5678-1234-567812345678')),
+    ('created', datetime.datetime(2020, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc)),
+    ('naive', datetime.datetime(2020, 1, 2, 3, 4, 5)),
+    ('day', datetime.date(2020, 1, 2)),
+    ('time', datetime.time(3, 4, 5, 6)),
+    ('lazy', gettext_lazy('This field is required.')),
+])
+
+
+@skipIf(core_renderers.orjson is None, 'orjson is not installed')
+class JSONRendererTests(TestCase):
+
+    def test_same_bytes_as_drf(self):
+        """Test that the output matches DRF's renderer byte for byte"""
+        for data in (SAMPLE, [SAMPLE, SAMPLE], 'text', 12, [], {}):
+            self.assertEqual(JSONRenderer().render(data), renderers.JSONRenderer().render(data))
+
+    def test_unsupported_by_orjson(self):
+        """Test that what orjson can't write is rendered by DRF"""
+        data = {'huge': 2 ** 70}
+
+        self.assertEqual(JSONRenderer().render(data), b'{"huge":1180591620717411303424}')
+
+    def test_non_finite_floats(self):
+        """Test the one known difference with DRF: NaN and infinity are written as null instead of failing"""
+        data = {'nan': float('nan'), 'inf': float('inf')}
+
+        self.assertEqual(JSONRenderer().render(data), b'{"nan":null,"inf":null}')
+        with self.assertRaises(ValueError):
+            renderers.JSONRenderer().render(data)
+
+    def test_without_orjson(self):
+        """Test that DRF's renderer takes over when orjson is not installed"""
+        with patch.object(core_renderers, 'orjson', None):
+            self.assertEqual(JSONRenderer().render(SAMPLE), renderers.JSONRenderer().render(SAMPLE))
+
+    def test_indent(self):
+        """Test that indented output is left to DRF"""
+        self.assertEqual(
+            JSONRenderer().render(SAMPLE, 'application/json; indent=4'),
+            renderers.JSONRenderer().render(SAMPLE, 'application/json; indent=4')
+        )
+
+    def test_no_data(self):
+        self.assertEqual(JSONRenderer().render(None), b'')
+
+    def test_recipe_list(self):
+        """Test that a recipe list, with its prices, renders like DRF would"""
+        user = get_user_model().objects.create_user('test@amadora.com', 'testpass')
+        tag = Tag.objects.create(user=user, name='Végan')
+        for price in (5, '12.50', '0.99'):
+            Recipe.objects.create(user=user, title='Soup', time_minutes=10, price=price).tags.add(tag)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        res = client.get(reverse('recipe:recipe-list'))
+
+        self.assertIsInstance(res.accepted_renderer, JSONRenderer)
+        self.assertEqual([recipe['price'] for recipe in res.json()['results']], ['0.99', '12.50', '5.00'])
+        self.assertEqual(res.content, renderers.JSONRenderer().render(res.data))
+
+
+@skipIf(core_renderers.orjson is None, 'orjson is not installed')
+class JSONParserTests(TestCase):
+
+    def parse(self, parser, body, encoding='utf-8'):
+        return parser.parse(BytesIO(body), 'application/json', {'encoding': encoding})
+
+    def test_same_data_as_drf(self):
+        """Test that bodies parse to the same data as with DRF's parser"""
+        for body in (
+            b'{"title": "Cr\\u00e8me", "price": "5.50", "tags": [1, "Vegan", {"name": "2"}], "rating": 4.25}',
+            '{"title": "Crème brûlée"}'.encode(),
+            b'[]',
+            b'{"huge": 1180591620717411303424}',
+        ):
+            self.assertEqual(self.parse(JSONParser(), body), self.parse(parsers.JSONParser(), body))
+
+    def test_invalid(self):
+        """Test that invalid JSON is reported like DRF does"""
+        for body in (b'', b'{"title": ', b'{"rating": NaN}'):
+            with self.assertRaises(ParseError) as expected:
+                self.parse(parsers.JSONParser(), body)
+            with self.assertRaises(ParseError) as raised:
+                self.parse(JSONParser(), body)
+            self.assertEqual(raised.exception.detail, expected.exception.detail)
+
+    def test_other_encoding(self):
+        """Test that bodies in another encoding than UTF-8 are left to DRF"""
+        body = '{"title": "Crème"}'.encode('latin-1')
+
+        self.assertEqual(self.parse(JSONParser(), body, 'latin-1'), {'title': 'Crème'})
+
+    def test_token_view(self):
+        """Test that the token endpoint uses the configured renderers and parsers"""
+        get_user_model().objects.create_user('test@amadora.com', 'testpass')
+
+        res = APIClient().post(
+            reverse('user:token'), {'email': 'test@amadora.com', 'password': 'testpass'}, format='json'
+        )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIsInstance(res.accepted_renderer, JSONRenderer)
+        self.assertIn(JSONParser, CreateTokenView.parser_classes)
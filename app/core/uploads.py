@@ -0,0 +1,166 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, UnidentifiedImageError
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from core import metrics
+from core.images import read_image_header
+from core.models import ImageJob, ImageUpload
+
+# How much of a chunk is held in memory at once, whatever the size of the chunk or the image
+BLOCK_SIZE = 64 * 1024
+
+# Running hashes of the uploads this process is receiving, so a chunk only hashes its own bytes
+HASHER_CACHE_SIZE = 1000
+
+
+class UploadOffsetMismatch(ValueError):
+
+    def __init__(self, offset):
+        super().__init__(f'The upload continues at offset {offset}.')
+        self.offset = offset
+
+
+class IncompleteChunk(ValueError):
+    pass
+
+
+class UploadChecksumMismatch(ValueError):
+    pass
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+def _take_hasher(upload):
+    """
+    Return the running hash of everything received so far for an upload
+    """
+    with _hashers_lock:
+        entry = _hashers.pop(upload.pk, None)
+    if entry is not None and entry[0] == upload.offset:
+        return entry[1]
+
+    # The earlier chunks went to another process, or this one restarted: catch up from the file
+    hasher = hashlib.sha256()
+    if upload.offset:
+        with default_storage.open(upload.path, 'rb') as partial:
+            remaining = upload.offset
+            while remaining:
+                block = partial.read(min(BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                hasher.update(block)
+                remaining -= len(block)
+
+    return hasher
+
+
+def _keep_hasher(upload, hasher):
+    with _hashers_lock:
+        _hashers[upload.pk] = (upload.offset, hasher)
+        while len(_hashers) > HASHER_CACHE_SIZE:
+            _hashers.popitem(last=False)
+
+
+def _discard_hasher(upload_id):
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
+
+
+def append_chunk(upload_id, stream, offset, length):
+    """
+    Append length bytes read from stream to an upload that has received exactly offset bytes so far.
+    Returns the updated upload.
+    """
+    # The row lock keeps two requests from writing the same upload at the same time
+    with transaction.atomic():
+        upload = ImageUpload.objects.select_for_update().get(pk=upload_id)
+        if offset != upload.offset:
+            raise UploadOffsetMismatch(upload.offset)
+        if offset + length > upload.size:
+            raise IncompleteChunk(f'The upload is {upload.size} bytes, this chunk goes past its end.')
+
+        hasher = _take_hasher(upload)
+        path = default_storage.path(upload.path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as partial:
+            # Drops whatever an interrupted request left past the last confirmed offset
+            partial.seek(offset)
+            partial.truncate()
+            remaining = length
+            while remaining:
+                block = stream.read(min(BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                partial.write(block)
+                hasher.update(block)
+                remaining -= len(block)
+            if remaining:
+                # The client went away mid-chunk, keep the file in line with the stored offset
+                partial.seek(offset)
+                partial.truncate()
+                raise IncompleteChunk(f'The chunk ended {remaining} bytes short.')
+
+        upload.offset = offset + length
+        upload.save(update_fields=['offset', 'updated_at'])
+
+    _keep_hasher(upload, hasher)
+    return upload
+
+
+def finalize_upload(upload, sha256=None):
+    """
+    Check a complete upload and hand it to the image workers as a new ImageJob
+    """
+    if upload.offset != upload.size:
+        raise IncompleteChunk(f'Only {upload.offset} of {upload.size} bytes have been uploaded.')
+
+    digest = _take_hasher(upload).hexdigest()
+    if sha256 and sha256.lower() != digest:
+        _discard_hasher(upload.pk)
+        raise UploadChecksumMismatch(f'The upload has SHA-256 {digest}, not {sha256}.')
+
+    # Only the header is parsed, the pixels are left to the image workers
+    with default_storage.open(upload.path, 'rb') as partial:
+        # Only errors Pillow raises about the data count as a bad image, storage errors are ours
+        try:
+            read_image_header(partial, settings.IMAGE_MAX_PIXELS)
+        except (UnidentifiedImageError, Image.DecompressionBombError) as exc:
+            raise InvalidImage(str(exc)) from exc
+        except OSError as exc:
+            # Pillow reports some broken data, e.g. a truncated header, with a bare OSError. The errors of
+            # the disk itself come from the OS and carry an errno, those make a 500.
+            if exc.errno is not None:
+                raise
+            raise InvalidImage(str(exc)) from exc
+
+    upload_id = upload.pk
+    with transaction.atomic():
+        # The job takes the file over as it is, nothing gets copied
+        job = ImageJob.objects.create(user=upload.user, recipe=upload.recipe, upload=upload.path)
+        upload.delete()
+    _discard_hasher(upload_id)
+    metrics.IMAGE_UPLOAD_SIZE.observe(upload.size, source='chunked')
+
+    return job, digest
+
+
+def delete_upload(upload):
+    """
+    Delete an upload and the data received for it
+    """
+    _discard_hasher(upload.pk)
+    default_storage.delete(upload.path)
+    upload.delete()
@@ -0,0 +1,25 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_safe
+
+from core import metrics
+
+
+@never_cache
+@require_safe
+def metrics_view(request):
+    """
+    Serve the metrics of every worker in the Prometheus text format.
+    With METRICS_TOKEN set, scrapers have to send it as a bearer token.
+    """
+    if settings.METRICS_TOKEN:
+        expected = f'Bearer {settings.METRICS_TOKEN}'
+        if not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), expected):
+            response = HttpResponse(status=401)
+            response['WWW-Authenticate'] = 'Bearer'
+            return response
+
+    return HttpResponse(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,74 @@
+"""
+Gunicorn settings for serving the API in production, picked up automatically when gunicorn runs from this
+directory:
+
+    gunicorn app.wsgi
+
+Every setting can be overridden from the environment, see the README for what they do.
+"""
+import os
+import shutil
+
+
+def cpu_count():
+    """
+    Return the number of CPUs this process may run on, which in a container can be less than the host has
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Preforked worker processes. 2 x cores + 1 keeps every core busy while some workers wait on the database.
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 * cpu_count() + 1))
+# The app needs to know whether its process local caches are the only ones, see API_CACHE_ENABLED
+os.environ['SERVER_PROCESSES'] = str(workers)
+# Threads per worker, more than one switches to the gthread worker. Keep DB_POOL_MAX_SIZE at least this high
+# when the connection pool is on, or threads queue up for connections.
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread' if threads > 1 else 'sync')
+
+# Recycle each worker after this many requests, give or take the jitter so they don't all restart together.
+# Bounds the damage of slow leaks, e.g. fragmentation from decoding large images.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Kill workers silent for this long, and give workers this long to finish their requests on a restart.
+# kill -HUP on the master starts fresh workers with the new code and retires the old ones gracefully.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Loading the app in each worker rather than in the master is what lets a HUP reload pick up new code
+preload_app = False
+
+# Workers signal they are alive through a file, on Docker's overlay filesystem that can stall them
+worker_tmp_dir = os.environ.get('GUNICORN_WORKER_TMP_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+# The workers share their metrics through files in METRICS_DIR, see core.metrics
+metrics_dir = os.environ.setdefault(
+    'METRICS_DIR', '/dev/shm/recipe-api-metrics' if os.path.isdir('/dev/shm') else '/tmp/recipe-api-metrics'
+)
+
+
+def on_starting(server):
+    # The files of a previous run would be counted again
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def child_exit(server, worker):
+    # Fold the values of a worker that exited, e.g. recycled after max_requests, into the archive
+    from core.metrics import MultiProcessStore
+    MultiProcessStore(metrics_dir).mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # Jobs whose worker was recycled or killed halfway are picked up again, see core.jobs.recover_jobs
+    from core.jobs import start_job_recovery
+    start_job_recovery()
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class RecipeConfig(AppConfig):
     name = 'recipe'
+
+    def ready(self):
+        # Connect the receivers that invalidate the cached API responses
+        from recipe import signals  # noqa: F401
@@ -0,0 +1,195 @@
+"""
+Async versions of the recipe, tag and ingredient viewsets, used when ASYNC_VIEWS is on (see recipe/urls.py).
+
+Under ASGI a sync view holds a thread for as long as it waits on the database, and Django runs all sync views
+on one thread by default. These views only leave the event loop for the blocking parts (see core.async_db) and
+send the queries that don't depend on each other at the same time: the prefetches of a page, the recipe and
+its tags and ingredients on retrieve, and the tag and ingredient lookups of a recipe write.
+Actions without an async version, like update or the bulk endpoint, run their sync code on a worker thread.
+"""
+import asyncio
+
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.async_db import run_db
+
+from recipe.fields import BatchManyRelatedField
+from recipe.views import IngredientViewSet, RecipeViewSet, TagViewSet
+
+
+class AsyncViewSetMixin:
+    """
+    Dispatch a DRF viewset as an async view, awaiting async actions and running sync ones on a worker thread
+    """
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+
+        # DRF's view sets the viewset up and returns what dispatch returns, here a coroutine
+        async def async_view(request, *args, **kwargs):
+            return await view(request, *args, **kwargs)
+
+        # cls, initkwargs, actions and csrf_exempt, which the router and the CSRF middleware look at
+        async_view.__dict__.update(view.__dict__)
+        return async_view
+
+    async def dispatch(self, request, *args, **kwargs):
+        """
+        APIView.dispatch, awaiting the handler
+        """
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            # Authentication may have to look the token up
+            await run_db(self.initial, request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            if asyncio.iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await run_db(handler, request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def list(self, request, *args, **kwargs):
+        return await self.acached_response(self.alist, request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        """
+        Fetch a page, then all its prefetches at the same time
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        lookups = queryset._prefetch_related_lookups
+        queryset = queryset.prefetch_related(None)
+
+        def fetch_page():
+            page = self.paginate_queryset(queryset)
+            return list(queryset) if page is None else list(page)
+
+        objects = await run_db(fetch_page)
+        await self.aprefetch(objects, lookups)
+        data = await run_db(lambda: self.get_serializer(objects, many=True).data)
+
+        if self.paginator is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    async def aprefetch(self, objects, lookups):
+        """
+        Run the prefetch queries for some objects at the same time rather than one after the other
+        """
+        # Each prefetch adds its own entry, the dict has to exist before they start or one would replace another's
+        for obj in objects:
+            obj.__dict__.setdefault('_prefetched_objects_cache', {})
+        await asyncio.gather(*(run_db(prefetch_related_objects, objects, lookup) for lookup in lookups))
+
+    async def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        await self.apreload_related(serializer, request.data)
+
+        def save():
+            serializer.is_valid(raise_exception=True)
+            self.perform_create(serializer)
+            return serializer.data
+
+        data = await run_db(save)
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+
+    async def apreload_related(self, serializer, data):
+        """
+        Look up the related objects a write refers to, all relations at the same time.
+        Validation then finds them in the context instead of querying them one relation after the other.
+        """
+        if not isinstance(data, dict):
+            return
+
+        fields = [
+            field for field in serializer.fields.values()
+            if isinstance(field, BatchManyRelatedField) and not field.read_only
+            and isinstance(data.get(field.field_name), list)
+        ]
+        objects = await asyncio.gather(*(
+            run_db(field.child_relation.preload_many, data[field.field_name]) for field in fields
+        ))
+        serializer.context['preloaded_related'] = {
+            field.child_relation.get_queryset().model: preloaded for field, preloaded in zip(fields, objects)
+        }
+
+
+class AsyncTagViewSet(AsyncViewSetMixin, TagViewSet):
+    pass
+
+
+class AsyncIngredientViewSet(AsyncViewSetMixin, IngredientViewSet):
+    pass
+
+
+class AsyncRecipeViewSet(AsyncViewSetMixin, RecipeViewSet):
+
+    async def retrieve(self, request, *args, **kwargs):
+        return await self.acached_response(self.aretrieve, request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        # The row serializer's queries are few and cheap, they run one after the other on a worker thread
+        if settings.FAST_READ_SERIALIZATION:
+            return await run_db(self.list_rows, request, *args, **kwargs)
+
+        return await super().alist(request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        """
+        Fetch the recipe and its related objects at the same time, they are all found by the recipe's pk
+        """
+        if settings.FAST_READ_SERIALIZATION:
+            return await run_db(self.retrieve_rows, request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        lookups = queryset._prefetch_related_lookups
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        pk = self.kwargs[lookup_url_kwarg]
+
+        try:
+            related = [
+                lookup.queryset.filter(**{queryset.model._meta.get_field(lookup.prefetch_to).related_query_name(): pk})
+                for lookup in lookups
+            ]
+        except (TypeError, ValueError):
+            raise Http404
+
+        def fetch_object():
+            obj = get_object_or_404(queryset.prefetch_related(None), **{self.lookup_field: pk})
+            self.check_object_permissions(request, obj)
+            return obj
+
+        instance, *rows = await asyncio.gather(
+            run_db(fetch_object),
+            *(run_db(list, related_queryset) for related_queryset in related)
+        )
+
+        # Fill the prefetch cache the way prefetch_related would have
+        instance._prefetched_objects_cache = {}
+        for lookup, related_queryset, objects in zip(lookups, related, rows):
+            related_queryset._result_cache = objects
+            related_queryset._prefetch_done = True
+            instance._prefetched_objects_cache[lookup.prefetch_to] = related_queryset
+
+        data = await run_db(lambda: self.get_serializer(instance).data)
+        return Response(data)
@@ -0,0 +1,161 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Max
+from django.utils.http import http_date, parse_etags, quote_etag
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from core import metrics
+from core.async_db import run_db
+from core.models import Tag, Ingredient, Recipe
+
+
+def api_cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def _version_key(user_id):
+    return f'recipe-api:version:{user_id}'
+
+
+def _last_updated(user_id):
+    """
+    Return the timestamp of the user's most recently updated recipe, tag or ingredient
+    """
+    latest = [
+        model.objects.filter(user_id=user_id).aggregate(latest=Max('updated_at'))['latest']
+        for model in (Recipe, Tag, Ingredient)
+    ]
+    latest = [value.timestamp() for value in latest if value is not None]
+
+    return max(latest) if latest else time.time()
+
+
+def collection_version(user_id):
+    """
+    Return the (token, modified timestamp) pair that changes whenever any recipe, tag or ingredient of the user changes
+    """
+    cache = api_cache()
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        # Missing or evicted, start a new version. Responses cached under the old one just go stale.
+        # Deletes leave no updated_at behind, so this can only be a lower bound of the real change time.
+        version = (uuid.uuid4().hex, _last_updated(user_id))
+        cache.add(_version_key(user_id), version, timeout=settings.API_CACHE_VERSION_TIMEOUT)
+        version = cache.get(_version_key(user_id), version)
+
+    return version
+
+
+def bump_collection_version(user_id):
+    """
+    Invalidate every cached response of the user by moving them to a new version
+    """
+    def bump():
+        api_cache().set(
+            _version_key(user_id), (uuid.uuid4().hex, time.time()), timeout=settings.API_CACHE_VERSION_TIMEOUT
+        )
+
+    bump()
+    # Bump again once the write is committed, otherwise a read running in between could cache
+    # the old rows under the new version
+    transaction.on_commit(bump)
+
+
+class CachedResponseMixin:
+    """
+    Cache the list responses per user and query string, other read actions can go through cached_response.
+    The responses carry an ETag and Last-Modified taken from the collection version, so conditional
+    requests are answered with a 304 before any row is loaded. Off when API_CACHE_ENABLED is, see settings.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        """
+        Answer a conditional request, or return the cached data of the request, or run the view and cache its data
+        """
+        if not request.user.is_authenticated or not settings.API_CACHE_ENABLED:
+            return view(request, *args, **kwargs)
+
+        headers, key, response = self.cache_lookup(request, kwargs)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            self.cache_store(response, headers, key)
+
+        return response
+
+    async def acached_response(self, view, request, *args, **kwargs):
+        """
+        cached_response for async views, view is a coroutine function
+        """
+        if not request.user.is_authenticated or not settings.API_CACHE_ENABLED:
+            return await view(request, *args, **kwargs)
+
+        headers, key, response = await run_db(self.cache_lookup, request, kwargs)
+        if response is None:
+            response = await view(request, *args, **kwargs)
+            await run_db(self.cache_store, response, headers, key)
+
+        return response
+
+    def cache_lookup(self, request, kwargs):
+        """
+        Return the validator headers and cache key of a request, with the response when it can be answered
+        without running the view
+        """
+        token, modified = collection_version(request.user.pk)
+        fingerprint = self.request_fingerprint(request, kwargs)
+        headers = {
+            'ETag': quote_etag(f'{token[:16]}-{fingerprint[:16]}'),
+            'Last-Modified': http_date(modified),
+        }
+        if self.not_modified(request, headers['ETag']):
+            metrics.CACHE_REQUESTS.inc(cache='api', result='not_modified')
+            return headers, None, Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        key = f'recipe-api:response:{request.user.pk}:{token}:{fingerprint}'
+        if not settings.API_CACHE_TIMEOUT:
+            return headers, key, None
+        data = api_cache().get(key)
+        metrics.CACHE_REQUESTS.inc(cache='api', result='miss' if data is None else 'hit')
+        if data is not None:
+            return headers, key, Response(data, headers=headers)
+
+        return headers, key, None
+
+    def cache_store(self, response, headers, key):
+        """
+        Cache the data of a fresh response and give it its validators
+        """
+        if response.status_code == status.HTTP_200_OK:
+            if settings.API_CACHE_TIMEOUT:
+                api_cache().set(key, response.data, settings.API_CACHE_TIMEOUT)
+            for header, value in headers.items():
+                response[header] = value
+
+    def request_fingerprint(self, request, kwargs):
+        # The version goes in the cache key, so bumping it orphans every response cached before the write.
+        # The host is part of it because paginated responses carry absolute next/previous links.
+        params = sorted(request.query_params.lists())
+        renderer = getattr(request, 'accepted_media_type', None)
+
+        return hashlib.md5(
+            repr((request.get_host(), renderer, self.basename, self.action, kwargs.get('pk'), params)).encode()
+        ).hexdigest()
+
+    def not_modified(self, request, etag):
+        """
+        Return whether the client's copy is still current.
+        Only the ETag tells: If-Modified-Since has whole seconds, it would miss a second write within the same second.
+        """
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+
+        return if_none_match is not None and etag in parse_etags(if_none_match)
@@ -0,0 +1,170 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.storage import default_storage
+
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+
+class BatchManyRelatedField(serializers.ManyRelatedField):
+    """
+    Many related field that resolves all the submitted items at once
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        # DRF's ManyRelatedField asks the child for one item at a time, which means one SELECT per item
+        return self.child_relation.to_internal_value_many(data)
+
+
+class UserPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key related field limited to the objects of the requesting user
+    """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BatchManyRelatedField(**list_kwargs)
+
+    def get_queryset(self):
+        """
+        Only let users reference their own objects
+        """
+        queryset = super().get_queryset()
+        request = self.context.get('request')
+        if request is None:
+            return queryset
+
+        return queryset.filter(user=request.user)
+
+    def preload_many(self, data):
+        """
+        Resolve the primary keys of many lists at once, skipping the values that are not valid pks
+        """
+        queryset = self.get_queryset()
+        pk_field = queryset.model._meta.pk
+
+        pks = set()
+        for item in data:
+            try:
+                if not isinstance(item, bool):
+                    pks.add(pk_field.to_python(item))
+            except (TypeError, DjangoValidationError):
+                pass
+
+        return queryset.in_bulk(pks)
+
+    def to_internal_value_many(self, data):
+        """
+        Resolve a list of primary keys with a single IN query
+        """
+        queryset = self.get_queryset()
+        pk_field = queryset.model._meta.pk
+
+        errors = []
+        pks = []
+        for item in data:
+            if self.pk_field is not None:
+                item = self.pk_field.to_internal_value(item)
+            try:
+                if isinstance(item, bool):
+                    raise TypeError
+                pks.append(pk_field.to_python(item))
+            except (TypeError, DjangoValidationError):
+                errors.append(self.error_messages['incorrect_type'].format(data_type=type(item).__name__))
+        if errors:
+            raise serializers.ValidationError(errors, code='incorrect_type')
+
+        # Bulk writes resolve the pks of every item up front, see RecipeBulkListSerializer
+        objects = self.context.get('preloaded_related', {}).get(queryset.model)
+        if objects is None:
+            objects = queryset.in_bulk(set(pks))
+        # Report every missing pk together, with the same message DRF uses for a single one
+        missing = [pk for pk in dict.fromkeys(pks) if pk not in objects]
+        if missing:
+            raise serializers.ValidationError(
+                [self.error_messages['does_not_exist'].format(pk_value=pk) for pk in missing],
+                code='does_not_exist'
+            )
+
+        return [objects[pk] for pk in pks]
+
+
+class UserPrimaryKeyOrNameRelatedField(UserPrimaryKeyRelatedField):
+    """
+    Related field that also takes names, the serializer gets or creates the objects for them when it saves
+    """
+    default_error_messages = {
+        'invalid_name': 'Invalid name "{name}".',
+    }
+
+    def to_internal_value_many(self, data):
+        """
+        Resolve the pks with one query and return the names as they are
+        """
+        pks = []
+        names = []
+        errors = []
+        for item in data:
+            name = self.get_name(item)
+            if name is None:
+                pks.append(item)
+            elif not name or len(name) > self.name_max_length():
+                errors.append(self.error_messages['invalid_name'].format(name=name))
+            else:
+                names.append(name)
+        if errors:
+            raise serializers.ValidationError(errors, code='invalid_name')
+
+        return super().to_internal_value_many(pks) + list(dict.fromkeys(names))
+
+    def get_name(self, item):
+        """
+        Return the name an item refers to, or None when the item is a pk
+        """
+        # Numbers and numeric strings (form data sends everything as strings) are pks,
+        # other strings are names and {"name": ...} is a name even when it looks like a number
+        if isinstance(item, dict) and isinstance(item.get('name'), str):
+            return item['name'].strip()
+        if isinstance(item, str) and not item.strip().isdigit():
+            return item.strip()
+
+        return None
+
+    def name_max_length(self):
+        return self.get_queryset().model._meta.get_field('name').max_length
+
+
+
+def build_srcset(variants, request=None):
+    """
+    Turn stored image variants into a srcset string per format,
+    e.g. {"webp": "http://.../image_200w.webp 200w, http://.../image_400w.webp 400w"}
+    """
+    srcset = {}
+    for fmt, paths in (variants or {}).items():
+        candidates = []
+        for width, path in sorted(paths.items(), key=lambda item: int(item[0])):
+            url = default_storage.url(path)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            candidates.append(f'{url} {width}w')
+        srcset[fmt] = ', '.join(candidates)
+
+    return srcset
+
+
+class SrcsetField(serializers.ReadOnlyField):
+    """
+    Read only field for the srcset strings of the image variants
+    """
+
+    def to_representation(self, variants):
+        return build_srcset(variants, self.context.get('request'))
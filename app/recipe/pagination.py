@@ -0,0 +1,145 @@
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination that seeks on every ordering column instead of only the first one
+    """
+    # DRF's cursor only remembers the first ordering column and falls back to OFFSET for rows that tie on it.
+    # Here the cursor keeps the whole key, e.g. (name, id), so the last column breaks every tie
+    # and each page is a single index seek no matter how deep it is.
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('-id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (reverse, current_position) = (False, None)
+        else:
+            # Keys are unique so the offset part of the cursor is always 0
+            (_, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*self._reverse_ordering())
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            queryset = queryset.filter(self._position_filter(current_position, reverse, queryset.model))
+
+        # Fetch one extra row to know if there is a page after this one
+        results = list(queryset[:self.page_size + 1])
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            # The query ran in reverse so flip the rows back before returning them
+            self.page = list(reversed(self.page))
+            self.has_next = current_position is not None
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def _reverse_ordering(self):
+        """
+        Flip the direction of every ordering column
+        """
+
+        return tuple(
+            field[1:] if field.startswith('-') else '-' + field
+            for field in self.ordering
+        )
+
+    def _get_position_from_instance(self, instance, ordering):
+        """
+        Encode the values of all the ordering columns of a row as the cursor position
+        """
+
+        # Rows from values() are dicts
+        get = dict.get if isinstance(instance, dict) else getattr
+
+        return json.dumps([
+            get(instance, field.lstrip('-')) for field in ordering
+        ], default=str)
+
+    def _position_filter(self, position, reverse, model):
+        """
+        Build the filter for rows that come after the position, e.g. name < a OR (name = a AND id < b)
+        """
+
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        condition = Q()
+        equal_prefix = {}
+        for field, value in zip(self.ordering, values):
+            attr = field.lstrip('-')
+            # The cursor comes from the client, only values of the column's type may reach the query
+            model_field = model._meta.get_field(attr)
+            if isinstance(value, (list, dict)):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                value = model_field.to_python(value)
+            except (DjangoValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None and not model_field.null:
+                raise NotFound(self.invalid_cursor_message)
+            # Descending columns seek downwards, unless we're walking backwards to the previous page
+            lookup = '__lt' if field.startswith('-') != reverse else '__gt'
+            condition |= Q(**equal_prefix, **{attr + lookup: value})
+            equal_prefix[attr] = value
+
+        return condition
+
+
+class RecipePagination(KeysetCursorPagination):
+    """
+    Paginate recipes newest first
+    """
+    ordering = ('-id',)
+
+
+class NamePagination(KeysetCursorPagination):
+    """
+    Paginate tags and ingredients by name, using the id to break ties between equal names
+    """
+    ordering = ('-name', '-id')
@@ -1,8 +1,55 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
 from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from core.images import ImageTooLarge, read_image_header
+from core.instrumentation import InstrumentedSerializerMixin, timed_serialization
+from core.models import Tag, Ingredient, Recipe, ImageJob, ImageUpload
+from core.search import update_search_documents
+
+from recipe.fields import (
+    BatchManyRelatedField, SrcsetField, UserPrimaryKeyOrNameRelatedField, UserPrimaryKeyRelatedField, build_srcset
+)
+
+def get_or_create_named_related(user, items):
+    """
+    Swap the names in the ingredients and tags of validated recipes for objects, creating the missing ones
+    """
+    for name, model in (('ingredients', Ingredient), ('tags', Tag)):
+        # Gather the names of every recipe first so each model gets a single INSERT
+        names = [
+            value for attrs in items for value in attrs.get(name, []) if isinstance(value, str)
+        ]
+        if not names:
+            continue
+        objects = model.objects.get_or_create_by_names(user, names)
+        for attrs in items:
+            if name in attrs:
+                related = [objects[value] if isinstance(value, str) else value for value in attrs[name]]
+                # A name may have matched an object that was also submitted by id
+                attrs[name] = list(dict.fromkeys(related))
 
-from core.models import Tag, Ingredient, Recipe
 
-class TagSerializer(serializers.ModelSerializer):
+class UniqueNameMixin:
+    """
+    Reject a name the requesting user already uses, before the database constraint does
+    """
+
+    def validate_name(self, value):
+        request = self.context.get('request')
+        if request is not None:
+            queryset = self.Meta.model.objects.filter(user=request.user, name=value)
+            if self.instance is not None:
+                queryset = queryset.exclude(pk=self.instance.pk)
+            if queryset.exists():
+                raise serializers.ValidationError(f'You already have one named "{value}".')
+
+        return value
+
+class TagSerializer(InstrumentedSerializerMixin, UniqueNameMixin, serializers.ModelSerializer):
     """
     Serializer for tag objects
     """
@@ -13,7 +60,7 @@ class TagSerializer(serializers.ModelSerializer):
         # we want ID to be read only. We should dictate what ID gets assigned where.
         read_only_fields = ('id',)
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(InstrumentedSerializerMixin, UniqueNameMixin, serializers.ModelSerializer):
     """
     Serializer for ingredient objects
     """
@@ -23,21 +70,131 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name')
         read_only_fields = ('id',)
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeBulkListSerializer(serializers.ListSerializer):
+    """
+    List serializer that validates and writes many recipes in a handful of queries
+    """
+
+    # The M2M relations of a recipe and the name of the column pointing at the related object in their through table
+    related_fields = (
+        ('ingredients', 'ingredient_id'),
+        ('tags', 'tag_id'),
+    )
+
+    def to_internal_value(self, data):
+        """
+        Resolve the related ids of all the items up front so each item doesn't query them again
+        """
+        if isinstance(data, list):
+            preloaded = {}
+            for field in self.child.fields.values():
+                if isinstance(field, BatchManyRelatedField) and not field.read_only:
+                    values = []
+                    for item in data:
+                        if isinstance(item, dict) and isinstance(item.get(field.field_name), list):
+                            values.extend(item[field.field_name])
+                    preloaded[field.child_relation.get_queryset().model] = field.child_relation.preload_many(values)
+            self.context['preloaded_related'] = preloaded
+
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        """
+        Insert all the recipes with one statement and then all their related rows
+        """
+        if validated_data:
+            get_or_create_named_related(validated_data[0]['user'], validated_data)
+        related = [self._pop_related(attrs) for attrs in validated_data]
+        recipes = [Recipe(**attrs) for attrs in validated_data]
+
+        with transaction.atomic():
+            if transaction.get_connection().features.can_return_rows_from_bulk_insert:
+                recipes = Recipe.objects.bulk_create(recipes)
+            else:
+                # Without RETURNING (e.g. SQLite) bulk_create can't hand back the new ids, so insert one by one
+                for recipe in recipes:
+                    recipe.save(force_insert=True)
+            self._write_related(recipes, related)
+            # Bulk writes don't send the signals that keep the search documents up to date
+            update_search_documents(recipe.pk for recipe in recipes)
+
+        return recipes
+
+    def update(self, instances, validated_data):
+        """
+        Update the recipes, paired with the validated items by position, with one bulk UPDATE
+        """
+        if instances:
+            get_or_create_named_related(instances[0].user, validated_data)
+        related = [self._pop_related(attrs) for attrs in validated_data]
+        # bulk_update doesn't fill in auto_now fields by itself
+        now = timezone.now()
+        fields = {'updated_at'}
+        for recipe, attrs in zip(instances, validated_data):
+            for attr, value in attrs.items():
+                setattr(recipe, attr, value)
+            recipe.updated_at = now
+            fields.update(attrs)
+
+        with transaction.atomic():
+            Recipe.objects.bulk_update(instances, fields)
+            self._write_related(instances, related, replace=True)
+            update_search_documents(recipe.pk for recipe in instances)
+
+        return instances
+
+    def _pop_related(self, attrs):
+        """
+        Take the M2M values out of the validated data, None when a relation was not submitted
+        """
+        return {
+            name: attrs.pop(name) if name in attrs else None
+            for name, _ in self.related_fields
+        }
+
+    def _write_related(self, recipes, related, replace=False):
+        """
+        Write the through table rows of every recipe with one INSERT per relation
+        """
+        for name, column in self.related_fields:
+            through = getattr(Recipe, name).through
+            rows = []
+            replaced = []
+            for recipe, values in zip(recipes, related):
+                if values[name] is None:
+                    continue
+                replaced.append(recipe.pk)
+                # A related object submitted twice should only be linked once
+                for pk in dict.fromkeys(obj.pk for obj in values[name]):
+                    rows.append(through(recipe_id=recipe.pk, **{column: pk}))
+            if replace and replaced:
+                through.objects.filter(recipe_id__in=replaced).delete()
+            through.objects.bulk_create(rows)
+            # Nested serializers shouldn't read a stale prefetch after the write
+            for recipe in recipes:
+                getattr(recipe, '_prefetched_objects_cache', {}).pop(name, None)
+
+
+class RecipeSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for recipe objects
     """
 
-    ingredients = serializers.PrimaryKeyRelatedField(
+    # These resolve all the submitted ids with one query and only accept the user's own objects.
+    # They also take names, which are looked up or created when the recipe is saved.
+    ingredients = UserPrimaryKeyOrNameRelatedField(
         many = True,
         queryset = Ingredient.objects.all()
     )
 
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = UserPrimaryKeyOrNameRelatedField(
         many = True,
         queryset = Tag.objects.all()
     )
 
+    # The image is uploaded through its own endpoint, lists use the resized variants
+    srcset = SrcsetField(source='image_variants')
+
     class Meta:
         model = Recipe
         fields = (
@@ -47,9 +204,26 @@ class RecipeSerializer(serializers.ModelSerializer):
             'tags',
             'time_minutes',
             'price',
-            'link'
+            'link',
+            'image',
+            'srcset'
         )
-        read_only_fields = ('id',)
+        read_only_fields = ('id', 'image')
+        list_serializer_class = RecipeBulkListSerializer
+
+    def create(self, validated_data):
+        """
+        Create a recipe, creating the tags and ingredients it names
+        """
+        get_or_create_named_related(validated_data['user'], [validated_data])
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        """
+        Update a recipe, creating the tags and ingredients it names
+        """
+        get_or_create_named_related(instance.user, [validated_data])
+        return super().update(instance, validated_data)
 
 class RecipeDetailSerializer(RecipeSerializer):
     """
@@ -59,18 +233,194 @@ class RecipeDetailSerializer(RecipeSerializer):
     ingredients = IngredientSerializer(many=True, read_only=True)
     tags = TagSerializer(many=True, read_only=True)
 
-class RecipeImageSerializer(serializers.ModelSerializer):
+class RecipeRowSerializer:
+    """
+    Read only stand-in for RecipeSerializer (and RecipeDetailSerializer with detail=True) working on values() rows.
+
+    The model serializers build a tree of fields for every recipe and send each value through its field.
+    This takes the rows of recipe_rows() and the (recipe id, id, name) tuples of the tags and ingredients,
+    one query per relation, and builds the same dicts directly. The output has to stay identical to the
+    model serializers', the tests compare the rendered bytes.
+    """
+
+    # The recipe columns the representation reads
+    columns = ('id', 'title', 'time_minutes', 'price', 'link', 'image', 'image_variants')
+
+    relations = (
+        ('ingredients', Ingredient),
+        ('tags', Tag),
+    )
+
+    def __init__(self, rows, many=False, detail=False, context=None):
+        self.rows = rows
+        self.many = many
+        self.detail = detail
+        self.context = context or {}
+
+    @classmethod
+    def recipe_rows(cls, queryset):
+        """
+        Turn a recipe queryset into the rows this serializer takes
+        """
+        # values() can't prefetch, the relations are fetched by to_representation
+        return queryset.prefetch_related(None).values(*cls.columns)
+
+    @property
+    def data(self):
+        if not hasattr(self, '_data'):
+            self._data = timed_serialization(self.to_representation, self.rows)
+
+        return self._data
+
+    def to_representation(self, rows):
+        rows = list(rows) if self.many else [rows]
+        related = {name: self.related(model, [row['id'] for row in rows]) for name, model in self.relations}
+
+        request = self.context.get('request')
+        # Built per call since it reads COERCE_DECIMAL_TO_STRING and friends when formatting
+        price_field = serializers.DecimalField(**{
+            attr: getattr(Recipe._meta.get_field('price'), attr) for attr in ('max_digits', 'decimal_places')
+        })
+        image_url = self.image_url
+        data = [
+            {
+                'id': row['id'],
+                'title': row['title'],
+                'ingredients': related['ingredients'].get(row['id'], []),
+                'tags': related['tags'].get(row['id'], []),
+                'time_minutes': row['time_minutes'],
+                'price': price_field.to_representation(row['price']),
+                'link': row['link'],
+                'image': image_url(row['image'], request),
+                'srcset': build_srcset(row['image_variants'], request),
+            }
+            for row in rows
+        ]
+
+        return data if self.many else data[0]
+
+    def related(self, model, recipe_ids):
+        """
+        Return the related ids, or {'id', 'name'} dicts on detail, of every recipe by recipe id.
+        The query is the one prefetch_related runs, so they come in the same order.
+        """
+        related = {}
+        if not recipe_ids:
+            return related
+
+        queryset = model.objects.filter(recipe__in=recipe_ids)
+        if self.detail:
+            for recipe_id, pk, name in queryset.values_list('recipe', 'id', 'name'):
+                related.setdefault(recipe_id, []).append({'id': pk, 'name': name})
+        else:
+            for recipe_id, pk in queryset.values_list('recipe', 'id'):
+                related.setdefault(recipe_id, []).append(pk)
+
+        return related
+
+    @staticmethod
+    def image_url(name, request):
+        """
+        What serializers.ImageField returns for an image stored under name
+        """
+        if not name:
+            return None
+        if not api_settings.UPLOADED_FILES_USE_URL:
+            return name
+        url = Recipe._meta.get_field('image').storage.url(name)
+
+        return request.build_absolute_uri(url) if request is not None else url
+
+class RecipeImageSerializer(InstrumentedSerializerMixin, serializers.Serializer):
     """
     Serializer for uploading images to recipes
     """
+    # Only the header is checked here, decoding and re-encoding is left to the image workers
+    image = serializers.FileField()
+
+    default_error_messages = {
+        'invalid_image': 'Upload a valid image. The file you uploaded was either not an image or a corrupted image.',
+    }
+
+    def validate_image(self, value):
+        if value.size > settings.IMAGE_MAX_UPLOAD_BYTES:
+            raise serializers.ValidationError(
+                f'Images can be at most {settings.IMAGE_MAX_UPLOAD_BYTES} bytes.'
+            )
+        try:
+            read_image_header(value, settings.IMAGE_MAX_PIXELS)
+        except ImageTooLarge as exc:
+            raise serializers.ValidationError(str(exc))
+        except Exception:
+            self.fail('invalid_image')
+        value.seek(0)
+
+        return value
+
+class ImageJobSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
+    """
+    Serializer for the status of a recipe image upload
+    """
+    image = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
-        model = Recipe
-        fields = ('id', 'image')
-        read_only_fields = ('id',)
+        model = ImageJob
+        fields = ('id', 'recipe', 'status', 'error', 'image', 'srcset', 'created_at', 'updated_at')
+        read_only_fields = fields
+
+    def get_image(self, job):
+        """
+        Return the URL of the processed image once the job is done
+        """
+        if job.status != ImageJob.DONE or not job.recipe.image:
+            return None
+        request = self.context.get('request')
+        url = job.recipe.image.url
+
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def get_srcset(self, job):
+        """
+        Return the resized variants once the job is done
+        """
+        if job.status != ImageJob.DONE:
+            return None
+
+        return build_srcset(job.recipe.image_variants, self.context.get('request'))
+
+class ImageUploadSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
+    """
+    Serializer for starting a chunked image upload and reporting how far it got
+    """
+    recipe = UserPrimaryKeyRelatedField(queryset=Recipe.objects.all())
+
+    class Meta:
+        model = ImageUpload
+        fields = ('id', 'recipe', 'size', 'offset', 'created_at', 'updated_at')
+        read_only_fields = ('id', 'offset', 'created_at', 'updated_at')
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.IMAGE_MAX_UPLOAD_BYTES:
+            raise serializers.ValidationError(
+                f'Images must be between 1 and {settings.IMAGE_MAX_UPLOAD_BYTES} bytes.'
+            )
+
+        return value
+
+class ImageUploadFinalizeSerializer(InstrumentedSerializerMixin, serializers.Serializer):
+    """
+    Serializer for completing a chunked image upload
+    """
+    # Optional, lets the client make sure the server got the same bytes it sent
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False)
+
+    default_error_messages = RecipeImageSerializer.default_error_messages
+
+class RecipeImageDetailSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
+    srcset = SrcsetField(source='image_variants')
 
-class RecipeImageDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
-        fields = ('id', 'image')
+        fields = ('id', 'image', 'srcset')
         read_only_fields = ('id',)
\ No newline at end of file
@@ -0,0 +1,38 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from core.models import Tag, Ingredient, Recipe
+from recipe.cache import bump_collection_version
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def object_changed(sender, instance, **kwargs):
+    """
+    Invalidate the cached responses of the owner of a changed recipe, tag or ingredient
+    """
+    bump_collection_version(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_related_changed(sender, instance, action, **kwargs):
+    """
+    Invalidate the cached responses when the tags or ingredients of a recipe change
+    """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_collection_version(instance.user_id)
+
+
+@receiver(post_save, sender=get_user_model())
+def user_created(sender, instance, created, **kwargs):
+    """
+    Start new users on a fresh version, ids can be reused after a user is deleted
+    """
+    if created:
+        bump_collection_version(instance.pk)
@@ -0,0 +1,207 @@
+import asyncio
+
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.models import Recipe, Tag, Ingredient
+from recipe import async_views, views
+
+
+def call(viewset, actions, request, **kwargs):
+    """
+    Run a request through a viewset, awaiting the response of async ones
+    """
+    view = viewset.as_view(actions)
+    if asyncio.iscoroutinefunction(view):
+        response = async_to_sync(view)(request, **kwargs)
+    else:
+        response = view(request, **kwargs)
+
+    return response.render()
+
+
+# TestCase data lives in a transaction only the test's own connection sees
+@override_settings(ASYNC_CONCURRENT_QUERIES=False, API_CACHE_TIMEOUT=0, FAST_READ_SERIALIZATION=False)
+class AsyncViewsTests(TestCase):
+    """
+    Test the async viewsets answer like the sync ones
+    """
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = get_user_model().objects.create_user('test@amadora.com', 'testpass')
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        self.recipe = Recipe.objects.create(user=self.user, title='Soup', time_minutes=10, price=5)
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(self.ingredient)
+
+    def get(self, viewset, actions, path, **kwargs):
+        request = self.factory.get(path)
+        force_authenticate(request, self.user)
+        return call(viewset, actions, request, **kwargs)
+
+    def assertSameResponse(self, sync_viewset, async_viewset, actions, path, **kwargs):
+        expected = self.get(sync_viewset, actions, path, **kwargs)
+        res = self.get(async_viewset, actions, path, **kwargs)
+
+        self.assertEqual(res.status_code, expected.status_code)
+        self.assertEqual(res.content, expected.content)
+        return res
+
+    def test_list_tags_and_ingredients(self):
+        """
+        Test the tag and ingredient lists match the sync views
+        """
+        Tag.objects.create(user=self.user, name='Dessert')
+        self.assertSameResponse(views.TagViewSet, async_views.AsyncTagViewSet, {'get': 'list'}, '/api/recipe/tags/')
+        self.assertSameResponse(
+            views.IngredientViewSet, async_views.AsyncIngredientViewSet, {'get': 'list'},
+            '/api/recipe/ingredients/?assigned_only=1'
+        )
+
+    def test_list_recipes(self):
+        """
+        Test the recipe list, filtered or not, matches the sync view within the same query budget
+        """
+        other = Recipe.objects.create(user=self.user, title='Bread', time_minutes=60, price=2)
+        other.tags.add(Tag.objects.create(user=self.user, name='Baking'))
+
+        self.assertSameResponse(
+            views.RecipeViewSet, async_views.AsyncRecipeViewSet, {'get': 'list'}, '/api/recipe/recipes/'
+        )
+        with CaptureQueriesContext(connection) as queries:
+            res = self.assertSameResponse(
+                views.RecipeViewSet, async_views.AsyncRecipeViewSet, {'get': 'list'},
+                f'/api/recipe/recipes/?tags={self.tag.id}'
+            )
+
+        self.assertEqual([recipe['title'] for recipe in res.data['results']], ['Soup'])
+        # Both views ran: the recipes and one prefetch per relation each
+        self.assertEqual(len(queries), 6)
+
+    def test_retrieve_recipe(self):
+        """
+        Test the recipe detail matches the sync view, in one query for the recipe and one per relation
+        """
+        with CaptureQueriesContext(connection) as queries:
+            res = self.get(async_views.AsyncRecipeViewSet, {'get': 'retrieve'}, '/', pk=self.recipe.id)
+
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(res.data['tags'], [{'id': self.tag.id, 'name': 'Vegan'}])
+        self.assertSameResponse(
+            views.RecipeViewSet, async_views.AsyncRecipeViewSet, {'get': 'retrieve'}, '/', pk=self.recipe.id
+        )
+
+    @override_settings(FAST_READ_SERIALIZATION=True)
+    def test_row_serialization(self):
+        """
+        Test the recipe list and detail built from rows match the sync views
+        """
+        self.assertSameResponse(
+            views.RecipeViewSet, async_views.AsyncRecipeViewSet, {'get': 'list'}, '/api/recipe/recipes/'
+        )
+        self.assertSameResponse(
+            views.RecipeViewSet, async_views.AsyncRecipeViewSet, {'get': 'retrieve'}, '/', pk=self.recipe.id
+        )
+
+    def test_retrieve_missing_recipe(self):
+        """
+        Test other users' recipes and invalid ids are not found
+        """
+        other_user = get_user_model().objects.create_user('other@amadora.com', 'testpass')
+        other = Recipe.objects.create(user=other_user, title='Stew', time_minutes=90, price=8)
+
+        for pk in (other.id, 'abc'):
+            res = self.get(async_views.AsyncRecipeViewSet, {'get': 'retrieve'}, '/', pk=pk)
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_authentication_required(self):
+        """
+        Test unauthenticated requests are refused
+        """
+        res = call(async_views.AsyncTagViewSet, {'get': 'list'}, self.factory.get('/api/recipe/tags/'))
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_create_recipe(self):
+        """
+        Test creating a recipe with tag and ingredient ids and names
+        """
+        payload = {
+            'title': 'Salad', 'time_minutes': 5, 'price': '3.50',
+            'tags': [self.tag.id, 'Quick'], 'ingredients': [self.ingredient.id],
+        }
+        request = self.factory.post('/api/recipe/recipes/', payload, format='json')
+        force_authenticate(request, self.user)
+        res = call(async_views.AsyncRecipeViewSet, {'post': 'create'}, request)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(sorted(recipe.tags.values_list('name', flat=True)), ['Quick', 'Vegan'])
+        self.assertEqual(list(recipe.ingredients.all()), [self.ingredient])
+
+    def test_create_recipe_invalid_related(self):
+        """
+        Test unknown tag ids are reported like in the sync view
+        """
+        payload = {'title': 'Salad', 'time_minutes': 5, 'price': '3.50', 'tags': [self.tag.id + 100]}
+        responses = []
+        for viewset in (views.RecipeViewSet, async_views.AsyncRecipeViewSet):
+            request = self.factory.post('/api/recipe/recipes/', payload, format='json')
+            force_authenticate(request, self.user)
+            responses.append(call(viewset, {'post': 'create'}, request))
+
+        self.assertEqual(responses[1].status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(responses[1].data, responses[0].data)
+        self.assertFalse(Recipe.objects.filter(title='Salad').exists())
+
+    def test_sync_action_fallback(self):
+        """
+        Test actions without an async version still work
+        """
+        request = self.factory.patch('/', {'title': 'Tomato soup'}, format='json')
+        force_authenticate(request, self.user)
+        res = call(async_views.AsyncRecipeViewSet, {'patch': 'partial_update'}, request, pk=self.recipe.id)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'Tomato soup')
+
+
+@override_settings(ASYNC_CONCURRENT_QUERIES=True, API_CACHE_TIMEOUT=0, FAST_READ_SERIALIZATION=False)
+class AsyncViewsConcurrentQueriesTests(TransactionTestCase):
+    """
+    Test the async viewsets with their queries running on worker threads
+    """
+
+    def test_retrieve_and_create(self):
+        """
+        Test a retrieve and a create, whose queries run on other connections
+        """
+        factory = APIRequestFactory()
+        user = get_user_model().objects.create_user('test@amadora.com', 'testpass')
+        tag = Tag.objects.create(user=user, name='Vegan')
+        ingredient = Ingredient.objects.create(user=user, name='Salt')
+
+        request = factory.post('/api/recipe/recipes/', {
+            'title': 'Salad', 'time_minutes': 5, 'price': '3.50', 'tags': [tag.id], 'ingredients': [ingredient.id],
+        }, format='json')
+        force_authenticate(request, user)
+        res = call(async_views.AsyncRecipeViewSet, {'post': 'create'}, request)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        request = factory.get('/')
+        force_authenticate(request, user)
+        res = call(async_views.AsyncRecipeViewSet, {'get': 'retrieve'}, request, pk=res.data['id'])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['tags'], [{'id': tag.id, 'name': 'Vegan'}])
+        self.assertEqual(res.data['ingredients'], [{'id': ingredient.id, 'name': 'Salt'}])
@@ -0,0 +1,265 @@
+import errno
+import hashlib
+import tracemalloc
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import ImageJob, ImageUpload, Recipe
+from core import uploads
+from core.uploads import append_chunk
+from recipe.tests.utils import delete_variants
+
+UPLOADS_URL = reverse('recipe:imageupload-list')
+
+
+def upload_url(upload_id):
+    """Return the URL of a chunked upload"""
+    return reverse('recipe:imageupload-detail', args=[upload_id])
+
+
+def finalize_url(upload_id):
+    """Return the URL that completes a chunked upload"""
+    return reverse('recipe:imageupload-finalize', args=[upload_id])
+
+
+def sample_image_bytes(size=(100, 80)):
+    """Return the bytes of a JPEG image"""
+    buffer = BytesIO()
+    Image.effect_noise(size, 64).convert('RGB').save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class ZeroStream:
+    """Stream of zero bytes that never holds more than one read in memory"""
+
+    def __init__(self, length):
+        self.remaining = length
+
+    def read(self, size):
+        size = min(size, self.remaining)
+        self.remaining -= size
+        return bytes(size)
+
+
+@override_settings(IMAGE_JOBS_EAGER=True)
+class ImageUploadApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@amadora.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(user=self.user, title='Sample recipe', time_minutes=10, price=5.00)
+
+    def tearDown(self):
+        for upload in ImageUpload.objects.all():
+            default_storage.delete(upload.path)
+        for job in ImageJob.objects.all():
+            job.upload.delete()
+        self.recipe.refresh_from_db()
+        self.recipe.image.delete()
+        delete_variants(self.recipe.image_variants)
+
+    def start(self, size):
+        res = self.client.post(UPLOADS_URL, {'recipe': self.recipe.id, 'size': size})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data['id']
+
+    def send(self, upload_id, data, offset):
+        return self.client.patch(
+            upload_url(upload_id),
+            data=data,
+            content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def test_chunked_upload(self):
+        """Test uploading an image in chunks and finalizing it"""
+        data = sample_image_bytes()
+        upload_id = self.start(len(data))
+
+        for offset in range(0, len(data), 1000):
+            res = self.send(upload_id, data[offset:offset + 1000], offset)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Upload-Offset'], str(len(data)))
+
+        res = self.client.post(finalize_url(upload_id), {'sha256': hashlib.sha256(data).hexdigest()})
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data['status'], ImageJob.DONE)
+        self.assertFalse(ImageUpload.objects.exists())
+        self.recipe.refresh_from_db()
+        self.assertTrue(self.recipe.image)
+
+    def test_checksum_after_restart(self):
+        """Test that the checksum is still right when the running hash was lost, e.g. after a restart"""
+        data = sample_image_bytes()
+        upload_id = self.start(len(data))
+        self.send(upload_id, data[:1000], 0)
+        uploads._hashers.clear()
+        self.send(upload_id, data[1000:], 1000)
+
+        res = self.client.post(finalize_url(upload_id), {'sha256': hashlib.sha256(data).hexdigest()})
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+
+    def test_resume_after_wrong_offset(self):
+        """Test that a chunk sent for the wrong offset is refused with the offset to resume from"""
+        data = sample_image_bytes()
+        upload_id = self.start(len(data))
+        self.send(upload_id, data[:500], 0)
+
+        res = self.send(upload_id, data[1000:1500], 1000)
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['offset'], 500)
+        self.assertEqual(self.client.get(upload_url(upload_id)).data['offset'], 500)
+
+    def test_chunk_past_declared_size(self):
+        """Test that an upload can't grow past the size it announced"""
+        upload_id = self.start(10)
+
+        res = self.send(upload_id, b'x' * 20, 0)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_size_limit(self):
+        """Test that uploads larger than the image limit are refused up front"""
+        with self.settings(IMAGE_MAX_UPLOAD_BYTES=100):
+            res = self.client.post(UPLOADS_URL, {'recipe': self.recipe.id, 'size': 101})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_finalize_incomplete(self):
+        """Test that an upload can't be finalized before all its bytes arrived"""
+        data = sample_image_bytes()
+        upload_id = self.start(len(data))
+        self.send(upload_id, data[:100], 0)
+
+        res = self.client.post(finalize_url(upload_id))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ImageJob.objects.exists())
+
+    def test_finalize_checksum_mismatch(self):
+        """Test that a checksum that doesn't match the received bytes is refused"""
+        data = sample_image_bytes()
+        upload_id = self.start(len(data))
+        self.send(upload_id, data, 0)
+
+        res = self.client.post(finalize_url(upload_id), {'sha256': '0' * 64})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ImageJob.objects.exists())
+
+    def test_finalize_not_an_image(self):
+        """Test that a complete upload that isn't an image is refused"""
+        upload_id = self.start(20)
+        self.send(upload_id, b'definitely not a jpg', 0)
+
+        res = self.client.post(finalize_url(upload_id))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_finalize_decompression_bomb(self):
+        """Test that an image Pillow takes for a decompression bomb is refused"""
+        data = sample_image_bytes()
+        upload_id = self.start(len(data))
+        self.send(upload_id, data, 0)
+
+        with patch.object(Image, 'MAX_IMAGE_PIXELS', 100):
+            res = self.client.post(finalize_url(upload_id))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ImageJob.objects.exists())
+
+    def test_finalize_truncated_header(self):
+        """Test that an image cut off in its header is refused"""
+        data = b'\xff\xd8\xff\xe0' + b'x' * 10
+        upload_id = self.start(len(data))
+        self.send(upload_id, data, 0)
+
+        res = self.client.post(finalize_url(upload_id))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_finalize_storage_error(self):
+        """Test that the disk failing while the image is read isn't blamed on the client"""
+        data = sample_image_bytes()
+        upload_id = self.start(len(data))
+        self.send(upload_id, data, 0)
+
+        with patch('core.uploads.read_image_header', side_effect=OSError(errno.EIO, 'Input/output error')):
+            with self.assertRaises(OSError):
+                self.client.post(finalize_url(upload_id))
+
+    def test_finalize_server_error(self):
+        """Test that failures that have nothing to do with the image aren't blamed on the client"""
+        data = sample_image_bytes()
+        upload_id = self.start(len(data))
+        self.send(upload_id, data, 0)
+
+        with patch('core.uploads.ImageJob.objects.create', side_effect=DatabaseError('database is gone')):
+            with self.assertRaises(DatabaseError):
+                self.client.post(finalize_url(upload_id))
+
+    def test_upload_limited_to_user(self):
+        """Test that uploads are private and can only target the user's own recipes"""
+        upload_id = self.start(10)
+        user2 = get_user_model().objects.create_user('other@amadora.com', 'password123')
+        self.client.force_authenticate(user2)
+
+        self.assertEqual(self.client.get(upload_url(upload_id)).status_code, status.HTTP_404_NOT_FOUND)
+        res = self.client.post(UPLOADS_URL, {'recipe': self.recipe.id, 'size': 10})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_upload(self):
+        """Test that cancelling an upload removes its data"""
+        upload_id = self.start(10)
+        self.send(upload_id, b'x' * 5, 0)
+        path = ImageUpload.objects.get(pk=upload_id).path
+
+        res = self.client.delete(upload_url(upload_id))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(default_storage.exists(path))
+
+    def test_clear_abandoned_uploads(self):
+        """Test that the cleanup command removes stale uploads only"""
+        upload_id = self.start(10)
+        self.send(upload_id, b'x' * 5, 0)
+
+        call_command('clear_image_uploads', '--older-than', '3600', stdout=StringIO())
+        self.assertTrue(ImageUpload.objects.exists())
+
+        call_command('clear_image_uploads', '--older-than', '0', stdout=StringIO())
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_append_memory_is_bounded(self):
+        """Test that appending a large chunk never holds much more than one block in memory"""
+        size = 20 * 1024 * 1024
+        upload = ImageUpload.objects.create(user=self.user, recipe=self.recipe, size=size)
+
+        tracemalloc.start()
+        try:
+            append_chunk(upload.pk, ZeroStream(size), 0, size)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(peak, 1024 * 1024)
+        self.assertEqual(default_storage.size(upload.path), size)
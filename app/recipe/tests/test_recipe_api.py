@@ -1,19 +1,41 @@
+import base64
+import hashlib
 import tempfile
+import time
 import os
+from datetime import timedelta
+from io import BytesIO, StringIO
+from urllib.parse import urlencode
 
 from PIL import Image
 
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management import call_command
 from django.urls import reverse
-from django.test import TestCase
+from django.utils import timezone
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Recipe, Tag, Ingredient
-from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from core.jobs import recover_jobs
+from core.models import Recipe, Tag, Ingredient, ImageJob
+from recipe.cache import api_cache
+from recipe.serializers import RecipeSerializer, RecipeDetailSerializer, RecipeRowSerializer
+from recipe.tests.utils import delete_variants
 
 RECIPES_URL = reverse('recipe:recipe-list')
+BULK_URL = reverse('recipe:recipe-bulk')
+SEARCH_URL = reverse('recipe:recipe-search')
+
+# One query for the recipes plus one prefetch each for ingredients and tags, no matter how many recipes there are.
+RECIPE_READ_QUERY_BUDGET = 3
 
 def image_upload_url(recipe_id):
     """
@@ -104,7 +126,7 @@ class PrivateRecipeApiTests(TestCase):
         # Make sure that the request is valid and not turned down by the server
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         # Check for the data
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_recipes_limited_to_user(self):
         """
@@ -128,9 +150,85 @@ class PrivateRecipeApiTests(TestCase):
         # Make sure that the request is good
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         # Im supposed to recieve only 1 recipe since i made only one
-        self.assertEqual(len(res.data), 1)
+        self.assertEqual(len(res.data['results']), 1)
         # Check if the 1 thing retrieved is the data I wanted.
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
+
+    def test_recipes_paginated(self):
+        """
+        Test that paging through recipes returns them newest first without gaps
+        """
+
+        recipes = [sample_recipe(user=self.user, title=f'Recipe {i}') for i in range(5)]
+
+        res = self.client.get(RECIPES_URL, {'page_size': 2})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsNone(res.data['previous'])
+        self.assertEqual([r['id'] for r in res.data['results']], [recipes[4].id, recipes[3].id])
+
+        res = self.client.get(res.data['next'])
+        self.assertEqual([r['id'] for r in res.data['results']], [recipes[2].id, recipes[1].id])
+
+        res = self.client.get(res.data['next'])
+        self.assertEqual([r['id'] for r in res.data['results']], [recipes[0].id])
+        self.assertIsNone(res.data['next'])
+
+    def test_recipes_crafted_cursor(self):
+        """
+        Test that cursor positions that aren't ids are rejected
+        """
+        sample_recipe(user=self.user)
+
+        for position in ('[null]', '[{"a": 1}]', '["abc"]', '[[1]]'):
+            cursor = base64.b64encode(urlencode({'p': position}).encode()).decode()
+            res = self.client.get(RECIPES_URL, {'cursor': cursor})
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND, position)
+
+    def test_filter_recipes_by_tags(self):
+        """
+        Test returning recipes with any of the given tags, each recipe once
+        """
+
+        recipe1 = sample_recipe(user=self.user, title='Thai vegetable curry')
+        recipe2 = sample_recipe(user=self.user, title='Aubergine with tahini')
+        recipe3 = sample_recipe(user=self.user, title='Fish and chips')
+        tag1 = sample_tag(user=self.user, name='Vegan')
+        tag2 = sample_tag(user=self.user, name='Vegetarian')
+        recipe1.tags.add(tag1, tag2)
+        recipe2.tags.add(tag2)
+
+        res = self.client.get(RECIPES_URL, {'tags': f'{tag1.id},{tag2.id}'})
+
+        ids = [recipe['id'] for recipe in res.data['results']]
+        self.assertEqual(ids, [recipe2.id, recipe1.id])
+        self.assertNotIn(recipe3.id, ids)
+
+    def test_filter_recipes_by_tags_and_ingredients(self):
+        """
+        Test that the tag and ingredient filters must both match
+        """
+
+        recipe1 = sample_recipe(user=self.user, title='Posh beans on toast')
+        recipe2 = sample_recipe(user=self.user, title='Chicken cacciatore')
+        tag = sample_tag(user=self.user, name='Quick')
+        ingredient = sample_ingredient(user=self.user, name='Feta cheese')
+        recipe1.tags.add(tag)
+        recipe1.ingredients.add(ingredient)
+        recipe2.tags.add(tag)
+
+        res = self.client.get(RECIPES_URL, {'tags': str(tag.id), 'ingredients': str(ingredient.id)})
+
+        self.assertEqual([recipe['id'] for recipe in res.data['results']], [recipe1.id])
+
+    def test_filter_recipes_invalid_ids(self):
+        """
+        Test that a filter that isn't a list of ids is rejected
+        """
+
+        res = self.client.get(RECIPES_URL, {'ingredients': '1,abc'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ingredients', res.data)
 
     def test_view_recipe_detail(self):
         """
@@ -147,6 +245,45 @@ class PrivateRecipeApiTests(TestCase):
         serializer = RecipeDetailSerializer(recipe)
         self.assertEqual(res.data, serializer.data)
 
+    def test_list_recipes_query_budget(self):
+        """
+        Test that listing recipes runs a constant number of queries
+        """
+
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(sample_tag(user=self.user))
+        recipe.ingredients.add(sample_ingredient(user=self.user))
+        with self.assertNumQueries(RECIPE_READ_QUERY_BUDGET):
+            self.client.get(RECIPES_URL)
+
+        # Adding more recipes with their own tags and ingredients should not add any queries
+        for i in range(10):
+            recipe = sample_recipe(user=self.user, title=f'Recipe {i}')
+            recipe.tags.add(sample_tag(user=self.user, name=f'Tag {i}'))
+            recipe.ingredients.add(sample_ingredient(user=self.user, name=f'Ingredient {i}'))
+        with self.assertNumQueries(RECIPE_READ_QUERY_BUDGET):
+            res = self.client.get(RECIPES_URL)
+
+        recipes = Recipe.objects.filter(user=self.user).order_by('-id')
+        serializer = RecipeSerializer(recipes, many=True)
+        self.assertEqual(res.data['results'], serializer.data)
+
+    def test_view_recipe_detail_query_budget(self):
+        """
+        Test that the recipe detail runs a constant number of queries
+        """
+
+        recipe = sample_recipe(user=self.user)
+        for i in range(5):
+            recipe.tags.add(sample_tag(user=self.user, name=f'Tag {i}'))
+            recipe.ingredients.add(sample_ingredient(user=self.user, name=f'Ingredient {i}'))
+
+        with self.assertNumQueries(RECIPE_READ_QUERY_BUDGET):
+            res = self.client.get(detail_url(recipe.id))
+
+        serializer = RecipeDetailSerializer(recipe)
+        self.assertEqual(res.data, serializer.data)
+
     def test_create_basic_recipe(self):
         """
         Test creating recipe
@@ -210,6 +347,116 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(ingredient1, ingredients)
         self.assertIn(ingredient2, ingredients)
 
+    def test_create_recipe_resolves_ingredients_in_one_query(self):
+        """
+        Test that the number of queries to create a recipe does not grow with its ingredients
+        """
+
+        def create_with(count):
+            ingredients = [
+                sample_ingredient(user=self.user, name=f'Ingredient {count} {i}') for i in range(count)
+            ]
+            payload = {
+                'title': f'Recipe with {count} ingredients',
+                'ingredients': [ingredient.id for ingredient in ingredients],
+                'tags': [],
+                'time_minutes': 10,
+                'price': 5.00
+            }
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(RECIPES_URL, payload, format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        self.assertEqual(create_with(1), create_with(40))
+
+    def test_create_recipe_reports_all_missing_ids(self):
+        """
+        Test that every unknown ingredient id is reported at once
+        """
+
+        ingredient = sample_ingredient(user=self.user)
+        payload = {
+            'title': 'Mystery stew',
+            'ingredients': [ingredient.id, 9998, 9999],
+            'tags': [],
+            'time_minutes': 10,
+            'price': 5.00
+        }
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['ingredients'], [
+            'Invalid pk "9998" - object does not exist.',
+            'Invalid pk "9999" - object does not exist.',
+        ])
+
+    def test_create_recipe_with_other_users_tag(self):
+        """
+        Test that a recipe can not reference another user's tag
+        """
+
+        user2 = get_user_model().objects.create_user(
+            'other@amadora.com',
+            'password123'
+        )
+        tag = sample_tag(user=user2)
+        payload = {
+            'title': 'Borrowed tag pie',
+            'ingredients': [],
+            'tags': [tag.id],
+            'time_minutes': 10,
+            'price': 5.00
+        }
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['tags'], [f'Invalid pk "{tag.id}" - object does not exist.'])
+
+    def test_create_recipe_with_tag_names(self):
+        """
+        Test creating a recipe that names its tags, reusing the ones that exist
+        """
+
+        existing = sample_tag(user=self.user, name='Vegan')
+        other = sample_tag(user=self.user, name='Quick')
+        payload = {
+            'title': 'Tofu scramble',
+            'tags': ['Vegan', 'Breakfast', {'name': 'Breakfast'}, other.id],
+            'ingredients': ['Tofu'],
+            'time_minutes': 10,
+            'price': 4.00
+        }
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(
+            sorted(tag.name for tag in recipe.tags.all()),
+            ['Breakfast', 'Quick', 'Vegan']
+        )
+        self.assertIn(existing, recipe.tags.all())
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(recipe.ingredients.get().name, 'Tofu')
+        self.assertEqual(res.data['ingredients'], [recipe.ingredients.get().id])
+
+    def test_create_recipe_with_invalid_tag_name(self):
+        """
+        Test that a blank tag name is rejected
+        """
+
+        payload = {
+            'title': 'Nameless',
+            'tags': [{'name': ' '}],
+            'ingredients': [],
+            'time_minutes': 10,
+            'price': 4.00
+        }
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['tags'], ['Invalid name "".'])
+
     def test_partial_update_recipe(self):
         """
         Test updating a recipe with patch
@@ -264,6 +511,638 @@ class PrivateRecipeApiTests(TestCase):
         tags = recipe.tags.all()
         self.assertEqual(len(tags), 0)
 
+@override_settings(API_CACHE_TIMEOUT=0)
+class RecipeRowSerializationTests(TestCase):
+    """
+    Test the recipe list and detail built from rows answer exactly like the model serializers
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@amadora.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        tags = [sample_tag(user=self.user, name=f'Tag {i}') for i in range(3)]
+        ingredients = [sample_ingredient(user=self.user, name=f'Ingredient {i}') for i in range(3)]
+        self.recipes = []
+        for i, price in enumerate((5, 12.5, '0.99', 999)):
+            recipe = sample_recipe(user=self.user, title=f'Recipe "{i}" é', price=price, link=f'https://x.io/{i}')
+            recipe.tags.add(*tags[:i])
+            recipe.ingredients.add(*ingredients[i % 3:])
+            self.recipes.append(recipe)
+        self.recipes[0].image = 'uploads/recipe/original.jpg'
+        self.recipes[0].image_variants = {
+            'webp': {'400': 'uploads/recipe/original_400w.webp', '200': 'uploads/recipe/original_200w.webp'},
+        }
+        self.recipes[0].save()
+
+    def get_both(self, url):
+        """
+        Return the response bodies with and without the row serializer
+        """
+        with override_settings(FAST_READ_SERIALIZATION=True):
+            fast = self.client.get(url)
+        with override_settings(FAST_READ_SERIALIZATION=False):
+            expected = self.client.get(url)
+        self.assertEqual(fast.status_code, expected.status_code)
+
+        return fast, expected
+
+    def test_list_identical(self):
+        """
+        Test that every page of the list renders the same bytes
+        """
+        url = RECIPES_URL + '?page_size=3'
+        while url:
+            fast, expected = self.get_both(url)
+            self.assertEqual(fast.content, expected.content)
+            url = fast.data['next']
+
+    def test_detail_identical(self):
+        """
+        Test that the detail renders the same bytes, with and without related objects
+        """
+        for recipe in self.recipes:
+            fast, expected = self.get_both(detail_url(recipe.id))
+            self.assertEqual(fast.content, expected.content)
+
+    def test_detail_not_found(self):
+        """
+        Test that other users' recipes and invalid ids are not found
+        """
+        other = sample_recipe(user=get_user_model().objects.create_user('other@amadora.com', 'testpass'))
+
+        for url in (detail_url(other.id), '/api/recipe/recipes/abc/'):
+            fast, expected = self.get_both(url)
+            self.assertEqual(fast.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_serializer_without_request(self):
+        """
+        Test that the row serializer matches the model serializers without a request too
+        """
+        recipes = Recipe.objects.filter(user=self.user).order_by('-id')
+
+        self.assertEqual(
+            RecipeRowSerializer(RecipeRowSerializer.recipe_rows(recipes), many=True).data,
+            RecipeSerializer(recipes, many=True).data
+        )
+        self.assertEqual(
+            RecipeRowSerializer(RecipeRowSerializer.recipe_rows(recipes)[0], detail=True).data,
+            RecipeDetailSerializer(recipes[0]).data
+        )
+
+class BulkRecipeApiTests(TestCase):
+    """
+    Test creating, updating and deleting many recipes at once
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@amadora.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def recipe_payload(self, title, **params):
+        """
+        Return a valid recipe payload
+        """
+
+        payload = {
+            'title': title,
+            'ingredients': [],
+            'tags': [],
+            'time_minutes': 10,
+            'price': '5.00'
+        }
+        payload.update(params)
+
+        return payload
+
+    def test_bulk_create_recipes(self):
+        """
+        Test creating many recipes with their tags and ingredients
+        """
+
+        tag = sample_tag(user=self.user)
+        ingredient = sample_ingredient(user=self.user)
+        payload = [
+            self.recipe_payload('Pancakes', tags=[tag.id], ingredients=[ingredient.id]),
+            self.recipe_payload('Waffles', tags=[tag.id, tag.id]),
+        ]
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([r['title'] for r in res.data], ['Pancakes', 'Waffles'])
+        pancakes = Recipe.objects.get(id=res.data[0]['id'], user=self.user)
+        waffles = Recipe.objects.get(id=res.data[1]['id'], user=self.user)
+        self.assertEqual(list(pancakes.tags.all()), [tag])
+        self.assertEqual(list(pancakes.ingredients.all()), [ingredient])
+        self.assertEqual(list(waffles.tags.all()), [tag])
+        self.assertEqual(res.data[0]['tags'], [tag.id])
+
+    def test_bulk_create_reports_errors_per_item(self):
+        """
+        Test that an invalid item rejects the whole batch and the errors line up with the items
+        """
+
+        payload = [
+            self.recipe_payload('Pancakes'),
+            self.recipe_payload('', tags=[9999]),
+        ]
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('title', res.data[1])
+        self.assertIn('tags', res.data[1])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_bulk_create_validates_related_ids_once(self):
+        """
+        Test that validating the batch does not query the related ids of every item
+        """
+
+        tag = sample_tag(user=self.user)
+
+        def create_many(count):
+            payload = [self.recipe_payload(f'Recipe {i}', tags=[tag.id]) for i in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(BULK_URL, payload, format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            return [q['sql'] for q in queries if q['sql'].startswith('SELECT')]
+
+        self.assertEqual(len(create_many(1)), len(create_many(20)))
+
+    @skipUnless(connection.features.can_return_rows_from_bulk_insert, 'Needs bulk insert with RETURNING')
+    def test_bulk_create_query_budget(self):
+        """
+        Test that the whole batch is written with a constant number of queries
+        """
+
+        tag = sample_tag(user=self.user)
+
+        def create_many(count):
+            payload = [self.recipe_payload(f'Recipe {i}', tags=[tag.id]) for i in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(BULK_URL, payload, format='json')
+            return len(queries)
+
+        self.assertEqual(create_many(1), create_many(20))
+
+    def test_bulk_create_creates_names_once(self):
+        """
+        Test that the names shared by a batch create one tag each with a single insert
+        """
+
+        payload = [
+            self.recipe_payload('Pancakes', tags=['Breakfast', 'Sweet']),
+            self.recipe_payload('Omelette', tags=['Breakfast']),
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        breakfast = Tag.objects.get(user=self.user, name='Breakfast')
+        self.assertIn(breakfast.id, res.data[0]['tags'])
+        self.assertEqual(res.data[1]['tags'], [breakfast.id])
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        tag_inserts = [q for q in queries if q['sql'].startswith('INSERT') and 'core_tag"' in q['sql']]
+        self.assertEqual(len(tag_inserts), 1)
+
+    def test_bulk_update_recipes(self):
+        """
+        Test partially updating many recipes
+        """
+
+        recipe1 = sample_recipe(user=self.user, title='Old one')
+        recipe2 = sample_recipe(user=self.user, title='Old two')
+        recipe2.tags.add(sample_tag(user=self.user))
+        new_tag = sample_tag(user=self.user, name='Curry')
+        payload = [
+            {'id': recipe1.id, 'title': 'New one'},
+            {'id': recipe2.id, 'tags': [new_tag.id]},
+        ]
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipe1.refresh_from_db()
+        recipe2.refresh_from_db()
+        self.assertEqual(recipe1.title, 'New one')
+        self.assertEqual(recipe2.title, 'Old two')
+        self.assertEqual(list(recipe2.tags.all()), [new_tag])
+        self.assertEqual(res.data[1]['tags'], [new_tag.id])
+
+    def test_bulk_update_other_users_recipe(self):
+        """
+        Test that another user's recipe can not be updated in bulk
+        """
+
+        user2 = get_user_model().objects.create_user(
+            'other@amadora.com',
+            'password123'
+        )
+        recipe = sample_recipe(user=user2, title='Theirs')
+        res = self.client.patch(BULK_URL, [{'id': recipe.id, 'title': 'Mine'}], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data, [{'id': ['Not found.']}])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'Theirs')
+
+    def test_bulk_delete_recipes(self):
+        """
+        Test deleting many recipes and getting a result for each id
+        """
+
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        res = self.client.delete(BULK_URL, [recipe1.id, 9999], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'id': recipe1.id, 'status': status.HTTP_204_NO_CONTENT},
+            {'id': 9999, 'status': status.HTTP_404_NOT_FOUND, 'detail': 'Not found.'},
+        ])
+        self.assertEqual(list(Recipe.objects.all()), [recipe2])
+
+    def test_bulk_update_duplicate_ids(self):
+        """
+        Test that a recipe can only be updated once per bulk request
+        """
+
+        recipe = sample_recipe(user=self.user, title='Original')
+        payload = [
+            {'id': recipe.id, 'title': 'First'},
+            {'id': recipe.id, 'title': 'Second'},
+        ]
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data, [{}, {'id': ['Duplicate id.']}])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'Original')
+
+    def test_bulk_ids_must_be_integers(self):
+        """
+        Test that true and false are not taken for ids 1 and 0
+        """
+
+        recipe = sample_recipe(user=self.user)
+        Recipe.objects.filter(pk=recipe.pk).update(id=1)
+
+        res = self.client.patch(BULK_URL, [{'id': True, 'title': 'Changed'}], format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data, [{'id': ['Not found.']}])
+
+        res = self.client.delete(BULK_URL, [True], format='json')
+        self.assertEqual(res.data, [{'id': True, 'status': status.HTTP_404_NOT_FOUND, 'detail': 'Not found.'}])
+        self.assertEqual(Recipe.objects.get(pk=1).title, recipe.title)
+
+    def test_bulk_requires_a_list(self):
+        """
+        Test that the bulk endpoint rejects anything but a list
+        """
+
+        res = self.client.post(BULK_URL, self.recipe_payload('Pancakes'), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+class RecipeResponseCacheTests(TestCase):
+    """
+    Test caching the recipe read responses
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@amadora.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user)
+
+    def test_list_served_from_cache(self):
+        """
+        Test that repeating a list request doesn't touch the database
+        """
+
+        res1 = self.client.get(RECIPES_URL)
+        with self.assertNumQueries(0):
+            res2 = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res1.data, res2.data)
+
+    def test_detail_served_from_cache(self):
+        """
+        Test that repeating a detail request doesn't touch the database
+        """
+
+        self.client.get(detail_url(self.recipe.id))
+        with self.assertNumQueries(0):
+            res = self.client.get(detail_url(self.recipe.id))
+
+        self.assertEqual(res.data['id'], self.recipe.id)
+
+    def test_query_params_cached_separately(self):
+        """
+        Test that different query strings get their own cache entries
+        """
+
+        tag = sample_tag(user=self.user)
+        self.recipe.tags.add(tag)
+        sample_recipe(user=self.user, title='Untagged')
+
+        res1 = self.client.get(RECIPES_URL)
+        res2 = self.client.get(RECIPES_URL, {'tags': str(tag.id)})
+
+        self.assertEqual(len(res1.data['results']), 2)
+        self.assertEqual([r['id'] for r in res2.data['results']], [self.recipe.id])
+
+    def test_write_invalidates_cache(self):
+        """
+        Test that creating, updating and deleting recipes shows up in the next read
+        """
+
+        self.client.get(RECIPES_URL)
+        res = self.client.post(RECIPES_URL, {'title': 'New', 'time_minutes': 1, 'price': 1.00})
+        new_id = res.data['id']
+        self.assertEqual(len(self.client.get(RECIPES_URL).data['results']), 2)
+
+        self.client.get(detail_url(new_id))
+        self.client.patch(detail_url(new_id), {'title': 'Renamed'})
+        self.assertEqual(self.client.get(detail_url(new_id)).data['title'], 'Renamed')
+
+        self.client.delete(detail_url(new_id))
+        self.assertEqual(len(self.client.get(RECIPES_URL).data['results']), 1)
+
+    def test_related_changes_invalidate_cache(self):
+        """
+        Test that adding a tag or renaming an ingredient shows up in the cached detail
+        """
+
+        ingredient = sample_ingredient(user=self.user)
+        self.recipe.ingredients.add(ingredient)
+        self.client.get(detail_url(self.recipe.id))
+
+        tag = sample_tag(user=self.user)
+        self.recipe.tags.add(tag)
+        ingredient.name = 'Nutmeg'
+        ingredient.save()
+
+        res = self.client.get(detail_url(self.recipe.id))
+        self.assertEqual(res.data['tags'], [{'id': tag.id, 'name': tag.name}])
+        self.assertEqual(res.data['ingredients'][0]['name'], 'Nutmeg')
+
+    def test_bulk_write_invalidates_cache(self):
+        """
+        Test that recipes created in bulk show up in the next read
+        """
+
+        self.client.get(RECIPES_URL)
+        payload = [{'title': 'Bulk', 'ingredients': [], 'tags': [], 'time_minutes': 1, 'price': '1.00'}]
+        self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(len(self.client.get(RECIPES_URL).data['results']), 2)
+
+    def test_cache_limited_to_user(self):
+        """
+        Test that one user never gets another user's cached response
+        """
+
+        self.client.get(RECIPES_URL)
+        user2 = get_user_model().objects.create_user(
+            'other@amadora.com',
+            'password123'
+        )
+        self.client.force_authenticate(user2)
+
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.data['results'], [])
+
+    @override_settings(API_CACHE_ENABLED=False)
+    def test_cache_not_shared(self):
+        """
+        Test that neither responses nor ETags are served while the cache isn't shared between the processes
+        """
+
+        res = self.client.get(RECIPES_URL)
+        self.assertNotIn('ETag', res)
+        with self.assertNumQueries(RECIPE_READ_QUERY_BUDGET):
+            res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(API_CACHE_TIMEOUT=0)
+    def test_cache_disabled(self):
+        """
+        Test that a zero timeout turns the cache off
+        """
+
+        self.client.get(RECIPES_URL)
+        with self.assertNumQueries(RECIPE_READ_QUERY_BUDGET):
+            self.client.get(RECIPES_URL)
+
+class RecipeConditionalGetTests(TestCase):
+    """
+    Test ETag and Last-Modified on the recipe reads
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@amadora.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user)
+
+    def test_list_not_modified(self):
+        """
+        Test that a matching If-None-Match gets a 304 without touching the database
+        """
+
+        res = self.client.get(RECIPES_URL)
+        self.assertIn('ETag', res)
+        self.assertIn('Last-Modified', res)
+
+        with self.assertNumQueries(0):
+            res2 = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(res2.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res2['ETag'], res['ETag'])
+        self.assertEqual(res2.content, b'')
+
+    def test_detail_etag_changes_after_write(self):
+        """
+        Test that the ETag no longer matches once the recipe changes
+        """
+
+        url = detail_url(self.recipe.id)
+        etag = self.client.get(url)['ETag']
+        self.client.patch(url, {'title': 'Renamed'})
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+        self.assertEqual(res.data['title'], 'Renamed')
+
+    def test_etag_differs_per_query(self):
+        """
+        Test that each query string has its own ETag
+        """
+
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        res = self.client.get(RECIPES_URL, {'page_size': 1}, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_if_modified_since_ignored(self):
+        """
+        Test that If-Modified-Since alone never gets a 304, a write within the same second would go unnoticed
+        """
+
+        last_modified = self.client.get(RECIPES_URL)['Last-Modified']
+        self.client.patch(detail_url(self.recipe.id), {'title': 'Renamed'})
+
+        res = self.client.get(RECIPES_URL, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'][0]['title'], 'Renamed')
+
+    @override_settings(API_CACHE_VERSION_TIMEOUT=1)
+    def test_version_expires(self):
+        """
+        Test that the collection version expires, so a missed invalidation can't last
+        """
+
+        # Drop the version setUp's writes made with the default timeout
+        api_cache().clear()
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        with patch('django.core.cache.backends.locmem.time.time', return_value=time.time() + 2):
+            res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_updated_at_set_on_bulk_update(self):
+        """
+        Test that bulk updates move updated_at forward
+        """
+
+        before = self.recipe.updated_at
+        self.client.patch(BULK_URL, [{'id': self.recipe.id, 'title': 'Bulk'}], format='json')
+
+        self.recipe.refresh_from_db()
+        self.assertGreater(self.recipe.updated_at, before)
+
+class RecipeSearchApiTests(TestCase):
+    """
+    Test searching recipes
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@amadora.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def search(self, query):
+        """
+        Search and return the ids of the results
+        """
+
+        res = self.client.get(SEARCH_URL, {'q': query})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        return [recipe['id'] for recipe in res.data['results']]
+
+    def test_search_by_title_and_related_names(self):
+        """
+        Test that search looks at titles, tag names and ingredient names
+        """
+
+        curry = sample_recipe(user=self.user, title='Thai curry')
+        salad = sample_recipe(user=self.user, title='Green salad')
+        salad.tags.add(sample_tag(user=self.user, name='Vegan'))
+        soup = sample_recipe(user=self.user, title='Soup')
+        soup.ingredients.add(sample_ingredient(user=self.user, name='Pumpkin'))
+
+        self.assertEqual(self.search('curry'), [curry.id])
+        self.assertEqual(self.search('vegan'), [salad.id])
+        self.assertEqual(self.search('pumpkin'), [soup.id])
+
+    def test_search_ranks_title_matches_first(self):
+        """
+        Test that a recipe with the term in its title ranks above one with it in a tag
+        """
+
+        titled = sample_recipe(user=self.user, title='Chocolate cake')
+        tagged = sample_recipe(user=self.user, title='Brownies')
+        tagged.tags.add(sample_tag(user=self.user, name='Chocolate'))
+
+        self.assertEqual(self.search('chocolate'), [titled.id, tagged.id])
+
+    def test_search_follows_renamed_tags(self):
+        """
+        Test that renaming a tag updates the search results of its recipes
+        """
+
+        recipe = sample_recipe(user=self.user, title='Pad thai')
+        tag = sample_tag(user=self.user, name='Noodles')
+        recipe.tags.add(tag)
+        tag.name = 'Street food'
+        tag.save()
+
+        self.assertEqual(self.search('noodles'), [])
+        self.assertEqual(self.search('street'), [recipe.id])
+
+    def test_search_limited_to_user(self):
+        """
+        Test that search only returns the user's own recipes
+        """
+
+        user2 = get_user_model().objects.create_user(
+            'other@amadora.com',
+            'password123'
+        )
+        sample_recipe(user=user2, title='Lasagne')
+
+        self.assertEqual(self.search('lasagne'), [])
+
+    def test_search_bulk_created_recipes(self):
+        """
+        Test that recipes created in bulk can be found
+        """
+
+        payload = [{
+            'title': 'Banana bread',
+            'ingredients': ['Walnuts'],
+            'tags': [],
+            'time_minutes': 60,
+            'price': '3.00'
+        }]
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(self.search('walnuts'), [res.data[0]['id']])
+
+    def test_search_requires_query(self):
+        """
+        Test that searching without a query is rejected
+        """
+
+        res = self.client.get(SEARCH_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+@override_settings(IMAGE_JOBS_EAGER=True)
 class RecipeImageUploadTests(TestCase):
 
     def setUp(self):
@@ -276,19 +1155,33 @@ class RecipeImageUploadTests(TestCase):
         self.recipe = sample_recipe(user=self.user)
 
     def tearDown(self):
+        self.recipe.refresh_from_db()
         self.recipe.image.delete()
+        delete_variants(self.recipe.image_variants)
+        for job in ImageJob.objects.all():
+            job.upload.delete()
 
-    def test_upload_image_to_recipe(self):
-        """Test uploading an email to recipe"""
+    def pending_uploads(self):
+        """Return the names of the uploads waiting for their jobs"""
+        if not default_storage.exists('uploads/pending'):
+            return set()
+        return set(default_storage.listdir('uploads/pending')[1])
+
+    def upload(self, image, **save_kwargs):
+        """Upload a Pillow image to the recipe"""
         url = image_upload_url(self.recipe.id)
         with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
-            img = Image.new('RGB', (10, 10))
-            img.save(ntf, format='JPEG')
+            image.save(ntf, format='JPEG', **save_kwargs)
             ntf.seek(0)
-            res = self.client.post(url, {'image': ntf}, format='multipart')
+            return self.client.post(url, {'image': ntf}, format='multipart')
+
+    def test_upload_image_to_recipe(self):
+        """Test uploading an email to recipe"""
+        res = self.upload(Image.new('RGB', (10, 10)))
 
         self.recipe.refresh_from_db()
-        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data['status'], ImageJob.DONE)
         self.assertIn('image', res.data)
         self.assertTrue(os.path.exists(self.recipe.image.path))
 
@@ -297,4 +1190,201 @@ class RecipeImageUploadTests(TestCase):
         url = image_upload_url(self.recipe.id)
         res = self.client.post(url, {'image': 'notimage'}, format='multipart')
 
-        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_not_an_image(self):
+        """Test that a file that isn't an image is rejected before it is queued"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            ntf.write(b'definitely not a jpeg')
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ImageJob.objects.exists())
+
+    def test_upload_image_resized_and_rotated(self):
+        """Test that the stored image follows its EXIF orientation and fits the size limit"""
+        exif = Image.Exif()
+        # Orientation 6 means the camera was turned, the picture has to be rotated 90 degrees
+        exif[0x0112] = 6
+        with self.settings(IMAGE_MAX_DIMENSION=50):
+            self.upload(Image.new('RGB', (200, 100)), exif=exif.tobytes())
+
+        self.recipe.refresh_from_db()
+        with Image.open(self.recipe.image.path) as stored:
+            self.assertEqual(stored.size, (25, 50))
+            self.assertEqual(stored.format, 'JPEG')
+
+    def test_upload_corrupted_image_fails_job(self):
+        """Test that an image that can't be decoded fails its job"""
+        buffer = BytesIO()
+        Image.effect_noise((100, 100), 64).convert('RGB').save(buffer, format='JPEG')
+        url = image_upload_url(self.recipe.id)
+        pending = self.pending_uploads()
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            # Keep the header, cut off the pixel data
+            ntf.write(buffer.getvalue()[:len(buffer.getvalue()) // 2])
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data['status'], ImageJob.FAILED)
+        self.assertTrue(res.data['error'])
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+        # Nothing is ever going to process the upload again
+        self.assertEqual(self.pending_uploads(), pending)
+
+    def test_poll_image_job(self):
+        """Test following the Location of a queued upload until it is processed"""
+        with self.settings(IMAGE_JOBS_EAGER=False):
+            res = self.upload(Image.new('RGB', (10, 10)))
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data['status'], ImageJob.PENDING)
+        self.assertEqual(self.client.get(res['Location']).data['status'], ImageJob.PENDING)
+
+        call_command('process_image_jobs', stdout=StringIO())
+
+        job = self.client.get(res['Location']).data
+        self.assertEqual(job['status'], ImageJob.DONE)
+        self.recipe.refresh_from_db()
+        self.assertTrue(job['image'].endswith(self.recipe.image.url))
+
+    def test_image_job_fails_after_decoding(self):
+        """Test that a job failing after the image was decoded is marked failed"""
+        pending = self.pending_uploads()
+        with patch('core.jobs.save_recipe_image', side_effect=OSError('disk full')):
+            res = self.upload(Image.new('RGB', (10, 10)))
+
+        job = ImageJob.objects.get(pk=res.data['id'])
+        self.assertEqual(job.status, ImageJob.FAILED)
+        self.assertTrue(job.error)
+        self.assertNotIn('disk full', job.error)
+        self.assertFalse(job.upload)
+        self.assertEqual(self.pending_uploads(), pending)
+
+    def test_recover_stale_image_jobs(self):
+        """Test that jobs lost by their worker are requeued and processed without the command"""
+        with self.settings(IMAGE_JOBS_EAGER=False):
+            res = self.upload(Image.new('RGB', (10, 10)))
+        stale = timezone.now() - timedelta(seconds=120)
+        ImageJob.objects.filter(pk=res.data['id']).update(
+            status=ImageJob.PROCESSING, created_at=stale, updated_at=stale
+        )
+
+        self.assertEqual(recover_jobs(stale_after=300), [])
+        self.assertEqual(ImageJob.objects.get(pk=res.data['id']).status, ImageJob.PROCESSING)
+
+        self.assertEqual([str(pk) for pk in recover_jobs(stale_after=60)], [res.data['id']])
+        self.assertEqual(ImageJob.objects.get(pk=res.data['id']).status, ImageJob.DONE)
+
+    def test_image_job_limited_to_user(self):
+        """Test that users can only see their own image jobs"""
+        job = ImageJob.objects.create(user=self.user, recipe=self.recipe)
+        user2 = get_user_model().objects.create_user(
+            'other@amadora.com',
+            'password123'
+        )
+        self.client.force_authenticate(user2)
+
+        res = self.client.get(reverse('recipe:imagejob-detail', args=[job.pk]))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_upload_image_creates_variants(self):
+        """Test that only the variants narrower than the image are made, in every format"""
+        with self.settings(IMAGE_VARIANT_WIDTHS=[20, 50, 500], IMAGE_VARIANT_FORMATS=['webp', 'jpeg']):
+            res = self.upload(Image.new('RGB', (100, 60)))
+
+        self.recipe.refresh_from_db()
+        variants = self.recipe.image_variants
+        self.assertEqual(set(variants), {'webp', 'jpeg'})
+        self.assertEqual(set(variants['webp']), {'20', '50'})
+        with Image.open(default_storage.path(variants['webp']['50'])) as stored:
+            self.assertEqual(stored.format, 'WEBP')
+            self.assertEqual(stored.size, (50, 30))
+        self.assertIn(' 20w, ', res.data['srcset']['jpeg'])
+        self.assertTrue(res.data['srcset']['jpeg'].endswith(' 50w'))
+
+    def test_recipe_list_exposes_srcset(self):
+        """Test that listed recipes carry their variants so clients can skip the original"""
+        with self.settings(IMAGE_VARIANT_WIDTHS=[20], IMAGE_VARIANT_FORMATS=['webp']):
+            self.upload(Image.new('RGB', (100, 60)))
+
+        res = self.client.get(RECIPES_URL)
+
+        self.recipe.refresh_from_db()
+        srcset = res.data['results'][0]['srcset']
+        url = default_storage.url(self.recipe.image_variants['webp']['20'])
+        self.assertEqual(srcset, {'webp': f'http://testserver{url} 20w'})
+
+    def test_replacing_image_removes_old_variants(self):
+        """Test that the garbage collector deletes a replaced image and its variants"""
+        with self.settings(IMAGE_VARIANT_WIDTHS=[20], IMAGE_VARIANT_FORMATS=['jpeg']):
+            self.upload(Image.new('RGB', (100, 60)))
+            self.recipe.refresh_from_db()
+            old_image = self.recipe.image.name
+            old_path = self.recipe.image_variants['jpeg']['20']
+            self.upload(Image.new('RGB', (100, 60), color='white'))
+
+        self.assertTrue(default_storage.exists(old_image))
+        call_command('collect_image_garbage', '--grace', '0', stdout=StringIO())
+
+        self.recipe.refresh_from_db()
+        self.assertTrue(default_storage.exists(self.recipe.image.name))
+        self.assertFalse(default_storage.exists(old_image))
+        self.assertFalse(default_storage.exists(old_path))
+        self.assertTrue(default_storage.exists(self.recipe.image_variants['jpeg']['20']))
+
+    def test_generate_variants_for_existing_images(self):
+        """Test backfilling the variants of images stored before they existed"""
+        self.upload(Image.new('RGB', (100, 60)))
+        self.recipe.refresh_from_db()
+        delete_variants(self.recipe.image_variants)
+        Recipe.objects.filter(pk=self.recipe.pk).update(image_variants={})
+
+        with self.settings(IMAGE_VARIANT_WIDTHS=[30], IMAGE_VARIANT_FORMATS=['webp']):
+            call_command('generate_image_variants', stdout=StringIO())
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(list(self.recipe.image_variants), ['webp'])
+        self.assertTrue(default_storage.exists(self.recipe.image_variants['webp']['30']))
+
+    def test_identical_images_share_one_file(self):
+        """Test that the same photo uploaded to two recipes is stored once"""
+        image = Image.effect_noise((60, 40), 64).convert('RGB')
+        other = sample_recipe(user=self.user, title='Other recipe')
+        self.upload(image, quality=90)
+        self.recipe, first = other, self.recipe
+        self.upload(image, quality=90)
+
+        first.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(first.image.name, other.image.name)
+        with first.image.open('rb') as stored:
+            digest = hashlib.sha256(stored.read()).hexdigest()
+        self.assertEqual(os.path.basename(first.image.name), f'{digest}.jpg')
+
+    def test_replacing_shared_image_keeps_file(self):
+        """Test that replacing an image another recipe still uses leaves the file alone"""
+        image = Image.effect_noise((100, 60), 64).convert('RGB')
+        other = sample_recipe(user=self.user, title='Other recipe')
+        with self.settings(IMAGE_VARIANT_WIDTHS=[20], IMAGE_VARIANT_FORMATS=['jpeg']):
+            self.upload(image)
+            self.recipe, first = other, self.recipe
+            self.upload(image)
+            other.refresh_from_db()
+            shared, shared_variant = other.image.name, other.image_variants['jpeg']['20']
+            self.upload(Image.new('RGB', (100, 60)))
+
+        self.assertTrue(default_storage.exists(shared))
+        self.assertTrue(default_storage.exists(shared_variant))
+        first.refresh_from_db()
+        self.assertEqual(first.image.name, shared)
+        # Leave the files of the first recipe to tearDown of the second one
+        other.refresh_from_db()
+        default_storage.delete(other.image.name)
+        delete_variants(other.image_variants)
+        self.recipe = first
@@ -1,3 +1,6 @@
+import base64
+from urllib.parse import urlencode
+
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import TestCase
@@ -5,7 +8,7 @@ from django.test import TestCase
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Tag
+from core.models import Tag, Recipe
 from recipe.serializers import TagSerializer
 
 TAGS_URL = reverse('recipe:tag-list')
@@ -58,7 +61,7 @@ class PrivateTagsApiTests(TestCase):
         # Check for a confirmed response.
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         # Check if the serialized/processed data matches what we actually got.
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_tags_limited_to_user(self):
         """
@@ -80,9 +83,57 @@ class PrivateTagsApiTests(TestCase):
         # Make sure the request was a success.
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         # Check the length. I want to see that Im grabbing 1. Because thats how many tags I added
-        self.assertEqual(len(res.data), 1)
+        self.assertEqual(len(res.data['results']), 1)
         # The first user from the request. I assigned the created tag to be returned to tag. Hence im checking if the response.data is the same.
-        self.assertEqual(res.data[0]['name'], tag.name)
+        self.assertEqual(res.data['results'][0]['name'], tag.name)
+
+    def test_tags_paginated(self):
+        """
+        Test that paging through tags returns every tag once, in name order
+        """
+
+        for name in ['Vegan', 'Quick', 'Spicy', 'Dessert', 'Keto', 'Breakfast']:
+            Tag.objects.create(user=self.user, name=name)
+        expected = list(
+            Tag.objects.filter(user=self.user).order_by('-name', '-id').values_list('id', flat=True)
+        )
+
+        # Follow the next links two tags at a time
+        seen = []
+        url = TAGS_URL + '?page_size=2'
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(res.data['results']), 2)
+            seen.extend(tag['id'] for tag in res.data['results'])
+            last_page = res.data
+            url = res.data['next']
+
+        self.assertEqual(seen, expected)
+
+        # And walk back one page from the last one
+        res = self.client.get(last_page['previous'])
+        self.assertEqual([tag['id'] for tag in res.data['results']], expected[2:4])
+
+    def test_tags_invalid_cursor(self):
+        """
+        Test that a tampered cursor is rejected
+        """
+
+        res = self.client.get(TAGS_URL, {'cursor': 'garbage'})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tags_crafted_cursor(self):
+        """
+        Test that cursor positions that don't fit the columns are rejected
+        """
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        for position in ('[null, 1]', '["Vegan", null]', '["Vegan", {"a": 1}]', '["Vegan", "abc"]', '[[], 1]'):
+            cursor = base64.b64encode(urlencode({'p': position}).encode()).decode()
+            res = self.client.get(TAGS_URL, {'cursor': cursor})
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND, position)
 
     def test_create_tag_successful(self):
         """
@@ -99,6 +150,29 @@ class PrivateTagsApiTests(TestCase):
         ).exists()
         self.assertTrue(exists)
 
+    def test_created_tag_listed_after_cached_list(self):
+        """
+        Test that a cached tag list is invalidated when a tag is created
+        """
+
+        self.client.get(TAGS_URL)
+        self.client.post(TAGS_URL, {'name': 'Fresh'})
+
+        res = self.client.get(TAGS_URL)
+
+        self.assertEqual([tag['name'] for tag in res.data['results']], ['Fresh'])
+
+    def test_create_tag_duplicate_name(self):
+        """
+        Test that a user can not create two tags with the same name
+        """
+
+        Tag.objects.create(user=self.user, name='Vegan')
+        res = self.client.post(TAGS_URL, {'name': 'Vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
     def test_create_tag_invalid(self):
         """
         Test creating a new tag with invalid payload
@@ -107,4 +181,25 @@ class PrivateTagsApiTests(TestCase):
         payload = {'name': ''}
         res = self.client.post(TAGS_URL, payload)
 
-        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_retrieve_tags_assigned_to_recipes(self):
+        """
+        Test filtering tags by those assigned to recipes, each returned once
+        """
+
+        assigned = Tag.objects.create(user=self.user, name='Apples')
+        unassigned = Tag.objects.create(user=self.user, name='Turkey')
+        for title in ('Apple crumble', 'Apple pie'):
+            recipe = Recipe.objects.create(
+                title=title,
+                time_minutes=5,
+                price=10,
+                user=self.user
+            )
+            recipe.tags.add(assigned)
+
+        res = self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        self.assertEqual([item['id'] for item in res.data['results']], [assigned.id])
+        self.assertNotIn(unassigned.id, [item['id'] for item in res.data['results']])
@@ -0,0 +1,10 @@
+from django.core.files.storage import default_storage
+
+
+def delete_variants(variants):
+    """
+    Delete the variant files of a test recipe, the ones the garbage collector would get to an hour later
+    """
+    for paths in variants.values():
+        for path in paths.values():
+            default_storage.delete(path)
@@ -1,13 +1,25 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
 from recipe import views
 
+# ASYNC_VIEWS serves the recipe, tag and ingredient endpoints with their async versions, for ASGI deployments
+if settings.ASYNC_VIEWS:
+    from recipe import async_views
+    TagViewSet, IngredientViewSet, RecipeViewSet = (
+        async_views.AsyncTagViewSet, async_views.AsyncIngredientViewSet, async_views.AsyncRecipeViewSet
+    )
+else:
+    TagViewSet, IngredientViewSet, RecipeViewSet = views.TagViewSet, views.IngredientViewSet, views.RecipeViewSet
+
 # DefaultRouter is from DjangoRest that generates the urls for our view
 router = DefaultRouter()
-router.register('tags', views.TagViewSet)
-router.register('ingredients', views.IngredientViewSet)
-router.register('recipes', views.RecipeViewSet)
+router.register('tags', TagViewSet)
+router.register('ingredients', IngredientViewSet)
+router.register('recipes', RecipeViewSet)
+router.register('image-jobs', views.ImageJobViewSet)
+router.register('image-uploads', views.ImageUploadViewSet)
 
 app_name = 'recipe'
 
@@ -1,25 +1,89 @@
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.db.models import Exists, OuterRef, Prefetch
+
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework import viewsets, mixins, status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 
-from core.models import Tag, Ingredient, Recipe
+from core import metrics
+from core.authentication import CachedTokenAuthentication
+from core.images import ImageTooLarge
+from core.jobs import enqueue_image_job
+from core.models import Tag, Ingredient, Recipe, ImageJob, ImageUpload
+from core.search import search_recipes
+from core.uploads import (
+    IncompleteChunk, InvalidImage, UploadChecksumMismatch, UploadOffsetMismatch, append_chunk, delete_upload,
+    finalize_upload
+)
 
 from recipe import serializers
+from recipe.cache import CachedResponseMixin, bump_collection_version
+from recipe.pagination import RecipePagination, NamePagination
+
+# The recipe columns the list and detail serializers actually read. Everything else (user, image) stays deferred.
+RECIPE_READ_COLUMNS = ('id', 'title', 'time_minutes', 'price', 'link', 'image', 'image_variants')
+
+# The most recipes a single bulk request may carry
+BULK_MAX_ITEMS = 1000
+
+# How many search results are returned by default and at most
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+def _params_to_ints(name, value):
+    """
+    Convert a comma separated list of ids from the query string to a list of integers
+    """
+    try:
+        return [int(pk) for pk in value.split(',') if pk.strip()]
+    except ValueError:
+        raise ValidationError({name: ['Expected a comma separated list of ids.']})
 
-class BaseViewSetAttr(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin):
+def _queue_image_job(job, context):
+    """
+    Hand a job to the image workers and answer with its status
+    """
+    enqueue_image_job(job)
+    if settings.IMAGE_JOBS_EAGER:
+        # The job already ran, report how it went
+        job.refresh_from_db()
+
+    # 202 means the image is accepted but not there yet, the client polls the job for its status
+    return Response(
+        serializers.ImageJobSerializer(job, context=context).data,
+        status=status.HTTP_202_ACCEPTED,
+        headers={'Location': reverse('recipe:imagejob-detail', args=[job.pk])}
+    )
+
+class BaseViewSetAttr(CachedResponseMixin, viewsets.GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin):
     """
     Base viewsetfor recipe
     """
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = NamePagination
+
+    # The Recipe relation pointing at these objects, used to find the ones assigned to a recipe
+    recipe_relation = None
 
     def get_queryset(self):
         """
         Return objects for the current valid user
         """
-        return self.queryset.filter(user = self.request.user).order_by('-name')
+        queryset = self.queryset.filter(user = self.request.user).order_by('-name', '-id')
+        # ?assigned_only=1 keeps the objects used by at least one recipe. EXISTS stops at the first
+        # recipe it finds, where joining the recipes would need a DISTINCT over the whole join.
+        if self.request.query_params.get('assigned_only') in ('1', 'true'):
+            through = getattr(Recipe, self.recipe_relation).through
+            column = self.queryset.model._meta.model_name + '_id'
+            queryset = queryset.filter(Exists(through.objects.filter(**{column: OuterRef('pk')})))
+
+        return queryset
 
     def perform_create(self, serializer):
         """
@@ -36,6 +100,7 @@ class TagViewSet(BaseViewSetAttr):
     
     queryset = Tag.objects.all()
     serializer_class = serializers.TagSerializer
+    recipe_relation = 'tags'
 
 class IngredientViewSet(BaseViewSetAttr):
     """
@@ -44,24 +109,103 @@ class IngredientViewSet(BaseViewSetAttr):
 
     queryset = Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
+    recipe_relation = 'ingredients'
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     Manage recipes in the database
     """
 
     serializer_class = serializers.RecipeSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = RecipePagination
 
     def get_queryset(self):
         """
         Retrieve the recipes for the authenticated user
         """
 
-        return self.queryset.filter(user=self.request.user).order_by('-id')
+        queryset = self.queryset.filter(user=self.request.user).order_by('-id')
+        if self.action == 'list':
+            queryset = self._filter_related(queryset)
+
+        # The list only needs the ids of the related objects, the detail nests them so it also needs the names.
+        # Prefetching them means one query per relation instead of two extra queries for every recipe.
+        if self.action in ('list', 'search'):
+            return self._prefetch_related(queryset, ('id',))
+        elif self.action == 'retrieve':
+            return self._prefetch_related(queryset, ('id', 'name'))
+
+        return queryset
+
+    def _filter_related(self, queryset):
+        """
+        Filter recipes by ?tags=1,2 and ?ingredients=3, keeping the recipes with any of the given ids
+        """
+        # Each filter is an EXISTS over the through table instead of a join, so a recipe matching
+        # several ids still shows up once and there's no DISTINCT to sort out the duplicates
+        for param in ('tags', 'ingredients'):
+            value = self.request.query_params.get(param)
+            if value is None:
+                continue
+            through = getattr(Recipe, param).through
+            column = through._meta.get_field(param[:-1]).attname
+            queryset = queryset.filter(Exists(through.objects.filter(
+                recipe_id=OuterRef('pk'),
+                **{column + '__in': _params_to_ints(param, value)}
+            )))
+
+        return queryset
+
+    def _prefetch_related(self, queryset, related_columns):
+        """
+        Shape a read queryset: project the recipe columns and prefetch ingredients and tags
+        """
+
+        return queryset.only(*RECIPE_READ_COLUMNS).prefetch_related(
+            Prefetch('ingredients', queryset=Ingredient.objects.only(*related_columns)),
+            Prefetch('tags', queryset=Tag.objects.only(*related_columns)),
+        )
     
+    def list(self, request, *args, **kwargs):
+        if settings.FAST_READ_SERIALIZATION:
+            return self.cached_response(self.list_rows, request, *args, **kwargs)
+
+        return super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if settings.FAST_READ_SERIALIZATION:
+            return self.cached_response(self.retrieve_rows, request, *args, **kwargs)
+
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def list_rows(self, request, *args, **kwargs):
+        """
+        ListModelMixin.list on values() rows, serialized by RecipeRowSerializer
+        """
+        rows = serializers.RecipeRowSerializer.recipe_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(serializers.RecipeRowSerializer(rows, many=True, context=self.get_serializer_context()).data)
+
+        data = serializers.RecipeRowSerializer(page, many=True, context=self.get_serializer_context()).data
+        return self.get_paginated_response(data)
+
+    def retrieve_rows(self, request, *args, **kwargs):
+        """
+        RetrieveModelMixin.retrieve on a values() row, serialized by RecipeRowSerializer
+        """
+        rows = serializers.RecipeRowSerializer.recipe_rows(self.filter_queryset(self.get_queryset()))
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(rows, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(request, row)
+
+        return Response(
+            serializers.RecipeRowSerializer(row, detail=True, context=self.get_serializer_context()).data
+        )
+
     def get_serializer_class(self):
         """
         Return appropriate serializer class
@@ -87,29 +231,146 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
         """
-        Upload an image to a recipe
+        Queue an image upload for a recipe
         """
         # This will always be the way you call to grab the object
         recipe = self.get_object()
-        # we grab the recipe and pass in whatever data we got from the request
-        serializer = self.get_serializer(
-            recipe,
-            data=request.data
+        serializer = self.get_serializer(data=request.data)
+        # Only a cheap check happens here, the decoding and resizing happens in the image workers
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        job = ImageJob.objects.create(
+            user=request.user,
+            recipe=recipe,
+            upload=serializer.validated_data['image']
         )
-        # is_valid checks if the image is the same asthe imagefield value we assigned
-        if serializer.is_valid():
-            # Save the valid serializer
-            serializer.save()
-            # return what we got. Since our serializers return the object. And we also return that since its valid then its an OK
+        metrics.IMAGE_UPLOAD_SIZE.observe(serializer.validated_data['image'].size, source='form')
+
+        return _queue_image_job(job, self.get_serializer_context())
+
+    @action(methods=['GET'], detail=False, url_path='search')
+    def search(self, request):
+        """
+        Search recipes by title, tag names and ingredient names, best matches first
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': ['This query parameter is required.']})
+        try:
+            limit = min(int(request.query_params.get('limit', SEARCH_DEFAULT_LIMIT)), SEARCH_MAX_LIMIT)
+        except ValueError:
+            raise ValidationError({'limit': ['A valid integer is required.']})
+
+        # Ranked results don't follow the id order the cursor pages on, so search returns the top matches instead
+        recipes = search_recipes(self.get_queryset(), query)[:max(limit, 1)]
+        serializer = self.get_serializer(recipes, many=True)
+
+        return Response({'results': serializer.data})
+
+    @action(methods=['POST', 'PATCH', 'DELETE'], detail=False, url_path='bulk')
+    def bulk(self, request):
+        """
+        Create, update or delete many recipes in one request
+        """
+        # POST takes a list of recipes, PATCH a list of recipes with their id and DELETE a list of ids
+        data = request.data
+        if not isinstance(data, list):
             return Response(
-                serializer.data,
-                status=status.HTTP_200_OK
+                {'detail': 'Expected a list of items.'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        # Else, theres an error.
-        return Response(
-            serializer.errors,
-            status=status.HTTP_400_BAD_REQUEST
+        if len(data) > BULK_MAX_ITEMS:
+            return Response(
+                {'detail': f'A bulk request can hold at most {BULK_MAX_ITEMS} items.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if request.method == 'POST':
+            return self._bulk_create(data)
+        elif request.method == 'PATCH':
+            return self._bulk_update(data)
+
+        return self._bulk_destroy(data)
+
+    def _bulk_create(self, data):
+        """
+        Validate all the recipes and insert them in one transaction
+        """
+        serializer = self.get_serializer(data=data, many=True)
+        if not serializer.is_valid():
+            # The errors line up with the submitted items, valid items get an empty dict
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        recipes = serializer.save(user=self.request.user)
+        # bulk_create doesn't send the signals that invalidate the cached responses
+        bump_collection_version(self.request.user.pk)
+
+        return Response(self._bulk_results(recipes), status=status.HTTP_201_CREATED)
+
+    def _bulk_update(self, data):
+        """
+        Partially update all the recipes in one transaction
+        """
+        # Not isinstance: JSON true and false are bools, which are ints in Python and would stand for ids 1 and 0
+        ids = [item.get('id') if isinstance(item, dict) and type(item.get('id')) is int else None for item in data]
+        recipes = self.get_queryset().in_bulk([pk for pk in ids if pk is not None])
+        # The same recipe twice would be validated and saved twice, the last one silently winning
+        seen = set()
+        errors = []
+        for pk in ids:
+            if recipes.get(pk) is None:
+                errors.append({'id': ['Not found.']})
+            elif pk in seen:
+                errors.append({'id': ['Duplicate id.']})
+            else:
+                errors.append({})
+            seen.add(pk)
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ids],
+            data=data,
+            many=True,
+            partial=True
         )
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        recipes = serializer.save()
+        bump_collection_version(self.request.user.pk)
+
+        return Response(self._bulk_results(recipes), status=status.HTTP_200_OK)
+
+    def _bulk_destroy(self, data):
+        """
+        Delete the recipes with the given ids and report what happened to each id
+        """
+        with transaction.atomic():
+            recipes = self.get_queryset().filter(id__in=[pk for pk in data if type(pk) is int])
+            found = set(recipes.values_list('id', flat=True))
+            recipes.delete()
+
+        return Response([
+            {'id': pk, 'status': status.HTTP_204_NO_CONTENT} if type(pk) is int and pk in found
+            else {'id': pk, 'status': status.HTTP_404_NOT_FOUND, 'detail': 'Not found.'}
+            for pk in data
+        ], status=status.HTTP_200_OK)
+
+    def _bulk_results(self, recipes):
+        """
+        Serialize the written recipes, in the order they were submitted, with a constant number of queries
+        """
+        fetched = self._prefetch_related(
+            self.queryset.filter(user=self.request.user), ('id',)
+        ).in_bulk([recipe.pk for recipe in recipes])
+
+        return serializers.RecipeSerializer(
+            [fetched[recipe.pk] for recipe in recipes],
+            many=True
+        ).data
 
     @action(methods=['GET'], detail=True, url_path='retrieve-image')
     def get_images(self, request, pk=None):
@@ -120,3 +381,92 @@ class RecipeViewSet(viewsets.ModelViewSet):
         )
 
 
+class ImageJobViewSet(viewsets.GenericViewSet, mixins.RetrieveModelMixin):
+    """
+    Poll the status of recipe image uploads
+    """
+
+    serializer_class = serializers.ImageJobSerializer
+    queryset = ImageJob.objects.all()
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        """
+        Return the jobs of the authenticated user
+        """
+        return self.queryset.filter(user=self.request.user).select_related('recipe')
+
+class ImageUploadViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                         mixins.DestroyModelMixin):
+    """
+    Upload large recipe images in chunks.
+
+    POST {"recipe": id, "size": bytes} starts an upload. Each chunk is then PATCHed as the raw request body
+    with an Upload-Offset header saying where it goes, and GET tells where to resume after a failure.
+    POST .../finalize/ queues the finished image just like upload-image does.
+    """
+
+    serializer_class = serializers.ImageUploadSerializer
+    queryset = ImageUpload.objects.all()
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        """
+        Return the uploads of the authenticated user
+        """
+        return self.queryset.filter(user=self.request.user).select_related('recipe')
+
+    def get_serializer_class(self):
+        if self.action == 'finalize':
+            return serializers.ImageUploadFinalizeSerializer
+
+        return self.serializer_class
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        delete_upload(instance)
+
+    def partial_update(self, request, pk=None):
+        """
+        Append a chunk, streaming it to disk without ever reading it whole
+        """
+        upload = self.get_object()
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            raise ValidationError({'Upload-Offset': ['This header is required and must be an integer.']})
+
+        try:
+            upload = append_chunk(upload.pk, request.stream, offset, length)
+        except UploadOffsetMismatch as exc:
+            return Response(
+                {'detail': str(exc), 'offset': exc.offset},
+                status=status.HTTP_409_CONFLICT,
+                headers={'Upload-Offset': str(exc.offset)}
+            )
+        except IncompleteChunk as exc:
+            raise ValidationError({'detail': [str(exc)]})
+
+        return Response(self.get_serializer(upload).data, headers={'Upload-Offset': str(upload.offset)})
+
+    @action(methods=['POST'], detail=True, url_path='finalize')
+    def finalize(self, request, pk=None):
+        """
+        Check a complete upload and queue it for processing
+        """
+        upload = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            job, _ = finalize_upload(upload, serializer.validated_data.get('sha256'))
+        except (IncompleteChunk, UploadChecksumMismatch, ImageTooLarge) as exc:
+            raise ValidationError({'detail': [str(exc)]})
+        except InvalidImage:
+            raise ValidationError({'detail': [serializer.error_messages['invalid_image']]})
+
+        return _queue_image_job(job, self.get_serializer_context())
@@ -3,7 +3,9 @@ from django.utils.translation import ugettext_lazy as _
 
 from rest_framework import serializers
 
-class UserSerializer(serializers.ModelSerializer):
+from core.instrumentation import InstrumentedSerializerMixin
+
+class UserSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for the users object
     """
@@ -38,7 +40,7 @@ class UserSerializer(serializers.ModelSerializer):
     
         return user
 
-class AuthTokenSerializer(serializers.Serializer):
+class AuthTokenSerializer(InstrumentedSerializerMixin, serializers.Serializer):
     """
     Serializer for the user authentication object
     """
@@ -1,8 +1,11 @@
 
 
-from rest_framework import generics, authentication, permissions
+from django.contrib.auth import get_user_model
+
+from rest_framework import generics, permissions
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
+from core.authentication import CachedTokenAuthentication
 from user.serializers import UserSerializer, AuthTokenSerializer
 
 # Create your views here.
@@ -18,8 +21,10 @@ class CreateTokenView(ObtainAuthToken):
     """
     # Same as what we did in the create user. We have a fucntion and now we need to access this given a URL
     serializer_class = AuthTokenSerializer
-    # This one allows us to view the endpoint if we were to make this call in the browser.
+    # ObtainAuthToken only renders and parses with DRF's own JSON classes, use the configured ones instead.
+    # The browsable API is one of them when BROWSABLE_API is on.
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES
 
 class ManageUserView(generics.RetrieveUpdateAPIView):
     """
@@ -28,7 +33,7 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
     # Create a serializer class atribute
     serializer_class = UserSerializer
     # We need authenticate the user, this is done by assigning it a token, you can also use cookie authentication but for this case, we're using token
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     # The level of access the user has. In this case we dont need any super admin permission. The user just needs to be logged in/Authenticated
     permission_classes = (permissions.IsAuthenticated,)
 
@@ -37,4 +42,6 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
         """
         Retrieve and return authentication user
         """
-        return self.request.user
\ No newline at end of file
+        # request.user may come from the token cache, up to TOKEN_CACHE_TTL old. Saving it would write its stale
+        # password and is_active back over changes another process made, so updates start from the database.
+        return generics.get_object_or_404(get_user_model(), pk=self.request.user.pk)